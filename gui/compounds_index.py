@@ -0,0 +1,307 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import os
+import json
+import struct
+import hashlib
+import xml.etree.ElementTree
+from pathlib import Path
+from collections.abc import MutableMapping
+
+# load modules
+import mspy
+
+
+# COMPOUNDS LIBRARY INDEX
+# -----------------------
+# Compounds library is read by streaming parser and kept as raw records of
+# (expression, description). Compound objects are created on first access
+# only. Parsed records are written into binary sidecar index, so following
+# loads of unchanged library skip XML parsing and formula checking entirely.
+#
+# Index layout:
+#   8 bytes  - magic
+#   8 bytes  - header length (little-endian uint64)
+#   header   - JSON (source size and mtime, elements key, groups sizes)
+#   strings  - UTF-8 name, expression and description of each compound
+#              separated by zero byte
+
+COMPOUNDS_INDEX_DIR = Path.home() / '.mmass' / 'cache' / 'compounds'
+COMPOUNDS_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+
+COMPOUNDS_INDEX_MAGIC = b'MMSCIDX1'
+COMPOUNDS_INDEX_VERSION = 1
+
+
+class compoundsGroup(MutableMapping):
+    """Compounds group creating compound objects lazily.
+        records (dict) - compound name to (expression, description)
+    """
+
+    def __init__(self, records=None):
+
+        # values are raw records until accessed, then compound objects
+        self._items = dict(records or {})
+    # ----
+
+
+    def __getitem__(self, name):
+
+        item = self._items[name]
+        if type(item) is tuple:
+            compound = mspy.obj_compound.compound(item[0])
+            compound.description = item[1]
+            self._items[name] = item = compound
+
+        return item
+    # ----
+
+
+    def __setitem__(self, name, compound):
+        self._items[name] = compound
+    # ----
+
+
+    def __delitem__(self, name):
+        del self._items[name]
+    # ----
+
+
+    def __iter__(self):
+        return iter(self._items)
+    # ----
+
+
+    def __len__(self):
+        return len(self._items)
+    # ----
+
+
+    def __contains__(self, name):
+        return name in self._items
+    # ----
+
+
+
+    # GETTERS
+
+    def expression(self, name):
+        """Get compound formula without creating compound object."""
+
+        item = self._items[name]
+        if type(item) is tuple:
+            return item[0]
+        return item.expression
+    # ----
+
+
+    def records(self):
+        """Get (name, expression, description) of all compounds."""
+
+        buff = []
+        for name, item in self._items.items():
+            if type(item) is tuple:
+                buff.append((name, item[0], item[1]))
+            else:
+                buff.append((name, item.expression, getattr(item, 'description', '')))
+
+        return buff
+    # ----
+
+
+
+def compoundExpressions(group):
+    """Get compound name to formula map of given group (dict or compoundsGroup)."""
+
+    if isinstance(group, compoundsGroup):
+        return dict((name, group.expression(name)) for name in group)
+    return dict((name, compound.expression) for name, compound in group.items())
+# ----
+
+
+def compoundRecords(group):
+    """Get (name, expression, description) of given group (dict or compoundsGroup)."""
+
+    if isinstance(group, compoundsGroup):
+        return group.records()
+    return [(name, compound.expression, getattr(compound, 'description', '')) for name, compound in group.items()]
+# ----
+
+
+def loadLibrary(path):
+    """Load compounds library by index or streaming parser.
+        path (str) - compounds XML path
+    Returns dict of group name to compoundsGroup.
+    """
+
+    # use index if up to date
+    library = readIndex(path)
+    if library is not None:
+        return library
+
+    # parse library
+    library = parseLibrary(path)
+
+    # store index for next time
+    try:
+        writeIndex(path, library)
+    except Exception as e:
+        print('[compounds] Failed to write library index: %s' % e)
+
+    return library
+# ----
+
+
+def parseLibrary(path):
+    """Parse compounds XML by streaming parser, skipping invalid formulas."""
+
+    library = {}
+    group = None
+    groupElement = None
+    checked = {}
+
+    for event, element in xml.etree.ElementTree.iterparse(str(path), events=('start', 'end')):
+
+        # open group
+        if event == 'start':
+            if element.tag == 'group':
+                group = library[element.get('name', '')] = {}
+                groupElement = element
+            continue
+
+        # read compound
+        if element.tag == 'compound' and group is not None:
+            name = element.get('name', '')
+            formula = element.get('formula', '')
+
+            if not formula in checked:
+                try:
+                    mspy.obj_compound.compound(formula)
+                    checked[formula] = True
+                except:
+                    checked[formula] = False
+
+            if checked[formula]:
+                group[name] = (formula, element.text or '')
+
+            # drop parsed element to keep memory flat
+            element.clear()
+            try:
+                groupElement.remove(element)
+            except ValueError:
+                pass
+
+        # close group
+        elif element.tag == 'group':
+            group = None
+            groupElement = None
+            element.clear()
+
+    return dict((name, compoundsGroup(records)) for name, records in library.items())
+# ----
+
+
+def readIndex(path):
+    """Read library index if it matches current library file, None otherwise."""
+
+    indexPath = indexPathFor(path)
+    if not indexPath.exists():
+        return None
+
+    try:
+        with indexPath.open('rb') as handle:
+            if handle.read(8) != COMPOUNDS_INDEX_MAGIC:
+                return None
+            size = struct.unpack('<Q', handle.read(8))[0]
+            header = json.loads(handle.read(size).decode('utf-8'))
+            if header != dict(header, **_sourceKey(path)):
+                return None
+            strings = handle.read().decode('utf-8').split('\0')
+
+    except Exception as e:
+        print('[compounds] Failed to read library index: %s' % e)
+        return None
+
+    # split records into groups
+    library = {}
+    i = 0
+    for groupName, count in header['groups']:
+        records = {}
+        for x in range(i, i + 3*count, 3):
+            records[strings[x]] = (strings[x+1], strings[x+2])
+        library[groupName] = compoundsGroup(records)
+        i += 3*count
+
+    return library
+# ----
+
+
+def writeIndex(path, library):
+    """Write library index for given library file."""
+
+    indexPath = indexPathFor(path)
+
+    strings = []
+    groups = []
+    for groupName, group in library.items():
+        records = compoundRecords(group)
+        groups.append((groupName, len(records)))
+        for record in records:
+            strings += record
+
+    header = _sourceKey(path)
+    header['groups'] = groups
+    headerData = json.dumps(header).encode('utf-8')
+
+    # write to temporary file and replace
+    tmpPath = indexPath.with_suffix('.tmp')
+    with tmpPath.open('wb') as handle:
+        handle.write(COMPOUNDS_INDEX_MAGIC)
+        handle.write(struct.pack('<Q', len(headerData)))
+        handle.write(headerData)
+        handle.write('\0'.join(strings).encode('utf-8'))
+    os.replace(str(tmpPath), str(indexPath))
+# ----
+
+
+def indexPathFor(path):
+    """Get index path of given library file."""
+
+    key = hashlib.sha1(os.path.abspath(str(path)).encode('utf-8')).hexdigest()[:16]
+    return COMPOUNDS_INDEX_DIR / (key + '.index')
+# ----
+
+
+def _sourceKey(path):
+    """Get identification of library file and element table."""
+
+    stat = os.stat(str(path))
+
+    buff = []
+    for symbol in sorted(mspy.blocks.elements):
+        buff.append((symbol, sorted(mspy.blocks.elements[symbol].isotopes)))
+    elements = hashlib.sha1(repr(buff).encode('utf-8')).hexdigest()[:16]
+
+    return {
+        'version': COMPOUNDS_INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'elements': elements,
+    }
+# ----
@@ -111,6 +111,8 @@ main={
     'compassMode': 'Profile',
     'compassFormat': 'mzML',
     'compassDeleteFile': 1,
+    'undoLevels': 10,
+    'undoMemory': 512,
 }
 
 recent=[]
@@ -916,6 +918,8 @@ def saveConfig(path=os.path.join(confdir, 'config.xml')):
     buff += '    <param name="compassMode" value="%s" type="str" />\n' % (main['compassMode'])
     buff += '    <param name="compassFormat" value="%s" type="str" />\n' % (main['compassFormat'])
     buff += '    <param name="compassDeleteFile" value="%d" type="int" />\n' % (bool(main['compassDeleteFile']))
+    buff += '    <param name="undoLevels" value="%d" type="int" />\n' % (main['undoLevels'])
+    buff += '    <param name="undoMemory" value="%d" type="int" />\n' % (main['undoMemory'])
     buff += '  </main>\n\n'
     
     # recent files
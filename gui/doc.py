@@ -34,6 +34,10 @@ from gui import config
 import mspy
 
 
+# approximate memory of single annotation or match in undo history (in bytes)
+UNDO_ITEM_SIZE = 200
+
+
 # DOCUMENT STRUCTURE
 # ------------------
 
@@ -64,37 +68,43 @@ class document():
         self.flipped = False
         self.offset = [0,0]
         
-        # undo buffers
+        # undo history
         self.undo = None
-        self._spectrumBuff = None
-        self._annotationsBuff = None
-        self._sequencesBuff = None
+        self._history = []
     # ----
     
     
     def backup(self, items=None):
-        """Backup current state for undo."""
-        
-        self.undo = items
-        
-        # delete old
-        self._spectrumBuff = None
-        self._annotationsBuff = None
-        self._sequencesBuff = None
-        
+        """Backup current state for undo.
+        Spectrum snapshots share data arrays with current spectrum, so only
+        data changed later take additional memory. Number of stored steps and
+        their memory are limited by config.main['undoLevels'] and
+        config.main['undoMemory'] (MB).
+            items (tuple, str or None) - changed items, None to clear history
+        """
+        
+        # clear history
         if not items:
+            self.undo = None
+            del self._history[:]
             return
         
         # store data
+        step = {'items': items}
         if 'spectrum' in items:
-            self._spectrumBuff = copy.deepcopy(self.spectrum)
-        if 'annotations' in items:
-            self._annotationsBuff = copy.deepcopy(self.annotations)
+            step['spectrum'] = self.spectrum.snapshot()
+        if 'annotations' in items or 'notations' in items:
+            step['annotations'] = [copy.copy(item) for item in self.annotations]
         if 'sequences' in items:
-            self._sequencesBuff = copy.deepcopy(self.sequences)
-        if 'notations' in items:
-            self._annotationsBuff = copy.deepcopy(self.annotations)
-            self._sequencesBuff = copy.deepcopy(self.sequences)
+            step['sequences'] = copy.deepcopy(self.sequences)
+        elif 'notations' in items:
+            step['matches'] = [[copy.copy(item) for item in sequence.matches] for sequence in self.sequences]
+        
+        self._history.append(step)
+        self.undo = items
+        
+        # remove old steps
+        self._trimHistory()
     # ----
     
     
@@ -102,32 +112,71 @@ class document():
         """Revert to last stored state."""
         
         # check undo
-        if not self.undo:
+        if not self._history:
+            self.undo = None
             return False
         
         # revert data
-        items = self.undo
+        step = self._history.pop()
+        items = step['items']
         if 'spectrum' in items:
-            self.spectrum = self._spectrumBuff
+            self.spectrum = step['spectrum']
         if 'annotations' in items:
-            self.annotations[:] = self._annotationsBuff[:]
+            self.annotations[:] = step['annotations']
         if 'sequences' in items:
-            self.sequences[:] = self._sequencesBuff[:]
+            self.sequences[:] = step['sequences']
         if 'notations' in items:
-            self.annotations[:] = self._annotationsBuff[:]
-            for x in range(len(self.sequences)):
-                self.sequences[x].matches[:] = self._sequencesBuff[x].matches[:]
+            self.annotations[:] = step['annotations']
+            if 'matches' in step:
+                for sequence, matches in zip(self.sequences, step['matches']):
+                    sequence.matches[:] = matches
         
-        # clear buffers
+        # set next step
         self.undo = None
-        self._spectrumBuff = None
-        self._annotationsBuff = None
-        self._sequencesBuff = None
+        if self._history:
+            self.undo = self._history[-1]['items']
         
         return items
     # ----
     
     
+    def _trimHistory(self):
+        """Remove oldest undo steps exceeding limits."""
+        
+        # check number of steps
+        levels = max(1, config.main['undoLevels'])
+        del self._history[:-levels]
+        
+        # check memory
+        limit = config.main['undoMemory'] * 1024 * 1024
+        while len(self._history) > 1 and self._historySize() > limit:
+            del self._history[0]
+    # ----
+    
+    
+    def _historySize(self):
+        """Get approximate memory used by undo history only (in bytes)."""
+        
+        # get arrays used by current document
+        current = self.spectrum.nbytes()
+        
+        # count arrays and notations of stored steps
+        buffers = {}
+        size = 0
+        for step in self._history:
+            if 'spectrum' in step:
+                buffers.update(step['spectrum'].nbytes())
+            size += UNDO_ITEM_SIZE * len(step.get('annotations', []))
+            size += UNDO_ITEM_SIZE * sum(len(sequence.matches) for sequence in step.get('sequences', []))
+            size += UNDO_ITEM_SIZE * sum(len(matches) for matches in step.get('matches', []))
+        
+        # skip arrays shared with current document
+        size += sum(value for key, value in buffers.items() if key not in current)
+        
+        return size
+    # ----
+    
+    
     def sortAnnotations(self):
         """Sort annotations by m/z."""
         
@@ -731,6 +780,8 @@ class document():
 class annotation():
     """Annotation object definition."""
     
+    __slots__ = ('label', 'mz', 'ai', 'base', 'charge', 'radical', 'theoretical', 'formula', 'peakIndex', '_attributes')
+    
     def __init__(self, label, mz, ai, base=0., charge=None, radical=None, theoretical=None, formula=None):
         
         self.label = label
@@ -741,6 +792,50 @@ class annotation():
         self.radical = radical
         self.theoretical = theoretical
         self.formula = formula
+        
+        self.peakIndex = None
+        
+        # additional attributes are created on first use
+        self._attributes = None
+    # ----
+    
+    
+    def __copy__(self):
+        
+        dupl = annotation.__new__(annotation)
+        dupl.label = self.label
+        dupl.mz = self.mz
+        dupl.ai = self.ai
+        dupl.base = self.base
+        dupl.charge = self.charge
+        dupl.radical = self.radical
+        dupl.theoretical = self.theoretical
+        dupl.formula = self.formula
+        dupl.peakIndex = self.peakIndex
+        dupl._attributes = self._attributes
+        
+        return dupl
+    # ----
+    
+    
+    def __deepcopy__(self, memo):
+        
+        dupl = self.__copy__()
+        if self._attributes:
+            dupl._attributes = copy.deepcopy(self._attributes, memo)
+        
+        return dupl
+    # ----
+    
+    
+    @property
+    def attributes(self):
+        """Get additional attributes."""
+        
+        if self._attributes is None:
+            self._attributes = {}
+        
+        return self._attributes
     # ----
     
     
@@ -778,6 +873,8 @@ class annotation():
 class match():
     """Match object definition."""
     
+    __slots__ = ('label', 'mz', 'ai', 'base', 'charge', 'radical', 'theoretical', 'formula', 'sequenceRange', 'fragmentSerie', 'fragmentIndex', 'peakIndex', '_attributes')
+    
     def __init__(self, label, mz, ai, base=0., charge=None, radical=None, theoretical=None, formula=None):
         
         self.label = label
@@ -792,6 +889,54 @@ class match():
         self.sequenceRange = None
         self.fragmentSerie = None
         self.fragmentIndex = None
+        self.peakIndex = None
+        
+        # additional attributes are created on first use
+        self._attributes = None
+    # ----
+    
+    
+    def __copy__(self):
+        
+        dupl = match.__new__(match)
+        dupl.label = self.label
+        dupl.mz = self.mz
+        dupl.ai = self.ai
+        dupl.base = self.base
+        dupl.charge = self.charge
+        dupl.radical = self.radical
+        dupl.theoretical = self.theoretical
+        dupl.formula = self.formula
+        dupl.sequenceRange = self.sequenceRange
+        dupl.fragmentSerie = self.fragmentSerie
+        dupl.fragmentIndex = self.fragmentIndex
+        dupl.peakIndex = self.peakIndex
+        dupl._attributes = self._attributes
+        
+        return dupl
+    # ----
+    
+    
+    def __deepcopy__(self, memo):
+        
+        dupl = self.__copy__()
+        if self.sequenceRange is not None:
+            dupl.sequenceRange = copy.deepcopy(self.sequenceRange, memo)
+        if self._attributes:
+            dupl._attributes = copy.deepcopy(self._attributes, memo)
+        
+        return dupl
+    # ----
+    
+    
+    @property
+    def attributes(self):
+        """Get additional attributes."""
+        
+        if self._attributes is None:
+            self._attributes = {}
+        
+        return self._attributes
     # ----
     
     
@@ -0,0 +1,1121 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import os
+import json
+import time
+import struct
+import hashlib
+import contextlib
+import numpy
+from pathlib import Path
+
+# load modules
+import mspy
+from .ion_engine import adductRule, isotopeFormula, RADICAL
+
+
+# ION CACHE
+# ---------
+# Precomputed ions are kept in append-only shards listed by a small JSON
+# manifest. Shards are never modified once written, new results are always
+# added as a new shard and the manifest is replaced atomically, so readers
+# never see partial data. Writers update the manifest under a lock file and
+# merge its current content, so concurrent appends are not lost. When the
+# number of shards exceeds ION_MAX_SHARDS, shards of the same valid coverage
+# are merged, partly invalidated shards are rewritten without stale ions and
+# shards which can't be used anymore are dropped. Manifest keeps coverage and
+# fingerprints of each shard, so compaction is only started if it can change
+# anything.
+#
+# Each shard is one columnar file. Ions are sorted by m/z and stored as
+# parallel arrays which are memory-mapped on open, so the shard can be opened
+# in constant time and queried without unpickling any objects. All compounds
+# of a shard share the same coverage (mass type, charges, adducts, isotopes).
+#
+# Shard layout:
+#   8 bytes  - magic
+#   8 bytes  - header length (little-endian uint64)
+#   header   - JSON (tables, coverage, column offsets), padded to 8 bytes
+#   columns  - raw little-endian arrays
+#
+# Entries are content-addressed. Each compound carries a key made from its
+# formula and the header keeps fingerprints of the element table and of
+# every adduct and isotope formula, so edited compounds, changed FORMULAS
+# or updated element masses are detected and recomputed individually. When
+# the same ion is found in several shards, the newest one is used.
+
+ION_CACHE_DIR = Path.home() / '.mmass' / 'cache' / 'ions'
+ION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+ION_MANIFEST_NAME = 'manifest.json'
+ION_LOCK_NAME = 'manifest.lock'
+ION_LOCK_TIMEOUT = 30.
+ION_MAX_SHARDS = 16
+ION_SHARD_NAME = 'ions-%06d-%d.store'
+ION_STORE_MAGIC = b'MMSIONS1'
+ION_STORE_VERSION = 3
+
+
+def fingerprint(*items):
+    """Make short content hash of given items."""
+
+    data = '|'.join(repr(item) for item in items)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+# ----
+
+
+def elementsFingerprint():
+    """Make fingerprint of current element masses table."""
+
+    buff = []
+    for symbol in sorted(mspy.blocks.elements):
+        isotopes = mspy.blocks.elements[symbol].isotopes
+        buff.append((symbol, sorted(isotopes.items())))
+
+    return fingerprint(mspy.mod_basics.ELECTRON_MASS, buff)
+# ----
+
+
+def adductFingerprint(adduct):
+    """Make fingerprint of adduct definition."""
+
+    if adduct == RADICAL:
+        return fingerprint(adduct)
+    return fingerprint(adduct, adductRule(adduct))
+# ----
+
+
+def isotopeFingerprint(label):
+    """Make fingerprint of isotope label definition."""
+
+    try:
+        return fingerprint(label, isotopeFormula(label))
+    except ValueError:
+        return None
+# ----
+
+
+def compoundKey(expression):
+    """Make content key of compound formula."""
+    return int(fingerprint(expression), 16)
+# ----
+
+
+def ionPairs(adducts, isotopes):
+    """Get all (adduct, isotope) configs, radical ions are never labelled."""
+
+    pairs = []
+    for adduct in adducts:
+        if adduct == RADICAL:
+            pairs.append((adduct, ''))
+        else:
+            pairs += [(adduct, isotope) for isotope in isotopes]
+
+    return pairs
+# ----
+
+
+class ionStore:
+    """Memory-mapped columnar ion store shard."""
+
+    def __init__(self, path):
+
+        self.path = Path(path)
+
+        # read header
+        with self.path.open('rb') as handle:
+            magic = handle.read(8)
+            if magic != ION_STORE_MAGIC:
+                raise ValueError('Unknown ion shard format! --> ' + str(self.path))
+            size = struct.unpack('<Q', handle.read(8))[0]
+            self.header = json.loads(handle.read(size).decode('utf-8'))
+
+        if self.header.get('version') != ION_STORE_VERSION:
+            raise ValueError('Unsupported ion shard version! --> ' + str(self.path))
+
+        # get tables
+        self.massType = self.header['massType']
+        self.charges = self.header['charges']
+        self.adducts = self.header['adducts']
+        self.isotopes = self.header['isotopes']
+        self.coveredAdducts = self.header['coverage']['adducts']
+        self.coveredIsotopes = self.header['coverage']['isotopes']
+        self.count = self.header['count']
+        self.compoundsCount = self.header['compoundsCount']
+        self.elementsKey = self.header['elementsKey']
+        self.adductKeys = self.header['adductKeys']
+        self.isotopeKeys = self.header['isotopeKeys']
+
+        # map columns
+        self._columns = {}
+        for name, (dtype, offset, length) in self.header['columns'].items():
+            if length:
+                self._columns[name] = numpy.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=(length,))
+            else:
+                self._columns[name] = numpy.zeros(0, dtype=dtype)
+
+        # buffers
+        self._compoundIndex = None
+    # ----
+
+
+    def __len__(self):
+        return self.count
+    # ----
+
+
+    def column(self, name):
+        """Get mapped column by name."""
+        return self._columns[name]
+    # ----
+
+
+    def close(self):
+        """Release mapped columns."""
+
+        for column in self._columns.values():
+            if isinstance(column, numpy.memmap) and column._mmap is not None:
+                column._mmap.close()
+        self._columns = {}
+    # ----
+
+
+
+    # GETTERS
+
+    def compoundName(self, index):
+        """Get compound name for given compound id."""
+        return self._string('names', index)
+    # ----
+
+
+    def compoundExpression(self, index):
+        """Get compound expression for given compound id."""
+        return self._string('expressions', index)
+    # ----
+
+
+    def formula(self, index):
+        """Get ion formula for given row."""
+
+        blob = self._columns['formulas']
+        start = int(self._columns['formula'][index])
+
+        # formulas are terminated by zero byte
+        end = start
+        step = 128
+        while True:
+            chunk = numpy.asarray(blob[end:end+step])
+            stop = numpy.flatnonzero(chunk == 0)
+            if stop.size:
+                end += int(stop[0])
+                break
+            end += step
+
+        return bytes(blob[start:end]).decode('utf-8')
+    # ----
+
+
+    def compoundIndex(self):
+        """Get compound name to compound id map."""
+
+        if self._compoundIndex is None:
+            blob = bytes(self._columns['names'])
+            offsets = self._columns['namesOffsets'].tolist()
+            self._compoundIndex = {}
+            for x in range(self.compoundsCount):
+                self._compoundIndex[blob[offsets[x]:offsets[x+1]].decode('utf-8')] = x
+
+        return self._compoundIndex
+    # ----
+
+
+    def members(self, names, keys):
+        """Get ids of compounds stored with current formula.
+            names (list of str) - compound names
+            keys (array of uint64) - compound keys as made by compoundKey()
+        Returns array of compound ids, -1 for missing or edited compounds.
+        """
+
+        index = self.compoundIndex()
+        ids = numpy.array([index.get(name, -1) for name in names], dtype=numpy.int64)
+
+        found = numpy.flatnonzero(ids >= 0)
+        stored = numpy.asarray(self._columns['compoundKeys'])[ids[found]]
+        ids[found[stored != keys[found]]] = -1
+
+        return ids
+    # ----
+
+
+    def validAdducts(self):
+        """Get covered adducts whose definition did not change since the shard was built."""
+
+        if self.elementsKey != elementsFingerprint():
+            return []
+        return [a for a in self.coveredAdducts if self.adductKeys.get(a) == adductFingerprint(a)]
+    # ----
+
+
+    def validIsotopes(self):
+        """Get covered isotope labels whose definition did not change since the shard was built."""
+
+        if self.elementsKey != elementsFingerprint():
+            return []
+        return [i for i in self.coveredIsotopes if self.isotopeKeys.get(i) == isotopeFingerprint(i)]
+    # ----
+
+
+    def coverage(self, massType, charges, pairs):
+        """Get mask of configs computed for all shard compounds.
+            massType (0 or 1) - mass type
+            charges (list of int) - ion charges
+            pairs (list of (str, str)) - (adduct, isotope) configs
+        """
+
+        mask = numpy.zeros(len(pairs), dtype=bool)
+        if massType != self.massType or not set(charges) <= set(self.charges):
+            return mask
+
+        adducts = set(self.validAdducts())
+        isotopes = set(self.validIsotopes())
+        for x, (adduct, isotope) in enumerate(pairs):
+            mask[x] = adduct in adducts and (adduct == RADICAL or isotope in isotopes)
+
+        return mask
+    # ----
+
+
+    def range(self, minMZ, maxMZ):
+        """Get slice of rows within given m/z range."""
+
+        mz = self._columns['mz']
+        i1 = int(numpy.searchsorted(mz, minMZ, side='left'))
+        i2 = int(numpy.searchsorted(mz, maxMZ, side='right'))
+
+        return slice(i1, i2)
+    # ----
+
+
+    def select(self, compounds, charges, adducts, isotopes, rows=None):
+        """Get indexes of rows matching given configs.
+            compounds (list of int) - compound ids
+            charges (list of int) - ion charges
+            adducts (list of str) - adduct names
+            isotopes (list of str) - isotope labels, '' for plain ion
+            rows (slice or None) - restrict search to rows
+        """
+
+        if rows is None:
+            rows = slice(0, self.count)
+
+        # get table ids
+        adductIDs = [self.adducts.index(a) for a in adducts if a in self.adducts]
+        isotopeIDs = [self.isotopes.index(i) for i in isotopes if i in self.isotopes]
+
+        # make mask
+        mask = numpy.isin(self._columns['charge'][rows], charges)
+        mask &= numpy.isin(self._columns['adduct'][rows], adductIDs)
+        mask &= numpy.isin(self._columns['isotope'][rows], isotopeIDs)
+
+        # check compounds by lookup table
+        lookup = numpy.zeros(self.compoundsCount, dtype=bool)
+        lookup[numpy.asarray(compounds, dtype=numpy.int64)] = True
+        mask &= lookup[self._columns['compound'][rows]]
+
+        return numpy.flatnonzero(mask) + (rows.start or 0)
+    # ----
+
+
+    def formulas(self, indexes):
+        """Get ion formulas for given rows."""
+
+        blob = bytes(self._columns['formulas'])
+        starts = numpy.asarray(self._columns['formula'])[indexes].tolist()
+
+        return [blob[start:blob.index(b'\0', start)].decode('utf-8') for start in starts]
+    # ----
+
+
+    def records(self, indexes):
+        """Get (name, mz, charge, adduct, isotope, formula) for given rows."""
+
+        buff = []
+        for x in indexes:
+            isotope = self.isotopes[self._columns['isotope'][x]] or None
+            buff.append((
+                self.compoundName(self._columns['compound'][x]),
+                float(self._columns['mz'][x]),
+                int(self._columns['charge'][x]),
+                self.adducts[self._columns['adduct'][x]],
+                isotope,
+                self.formula(x),
+            ))
+
+        return buff
+    # ----
+
+
+
+    # HELPERS
+
+    def _string(self, table, index):
+        """Get string from given table."""
+
+        offsets = self._columns[table+'Offsets']
+        start = int(offsets[index])
+        end = int(offsets[index+1])
+
+        return bytes(self._columns[table][start:end]).decode('utf-8')
+    # ----
+
+
+
+class ionStoreBuilder:
+    """Collects ions and writes ion store shard.
+        massType (0 or 1) - mass type
+        charges (list of int) - ion charges
+        adducts (list of str) - adduct names computed for all compounds
+        isotopes (list of str) - isotope labels computed for all compounds
+    """
+
+    def __init__(self, massType, charges, adducts, isotopes):
+
+        self.massType = massType
+        self.charges = sorted(charges)
+        self.coveredAdducts = list(adducts)
+        self.coveredIsotopes = list(isotopes)
+
+        # tables
+        self.adducts = list(adducts)
+        self.isotopes = [''] + [i for i in isotopes if i]
+
+        self.names = []
+        self.expressions = []
+        self._compounds = {}
+
+        # ions are collected in chunks of columns
+        self._chunks = []
+        self._pending = []
+    # ----
+
+
+    def __len__(self):
+        self._flush()
+        return sum(len(chunk[0]) for chunk in self._chunks)
+    # ----
+
+
+    def addCompound(self, name, expression):
+        """Register compound and get its id."""
+
+        if name in self._compounds:
+            return self._compounds[name]
+
+        index = len(self.names)
+        self._compounds[name] = index
+        self.names.append(name)
+        self.expressions.append(expression)
+
+        return index
+    # ----
+
+
+    def hasCompound(self, name):
+        """Check whether compound is registered."""
+        return name in self._compounds
+    # ----
+
+
+    def addIon(self, compound, mz, charge, adduct, isotope, formula):
+        """Add single ion.
+            compound (int) - compound id as returned by addCompound
+            mz (float) - ion m/z
+            charge (int) - ion charge
+            adduct (str) - adduct name
+            isotope (str or None) - isotope label
+            formula (str) - ion formula
+        """
+
+        self._pending.append((mz, compound, self._adductID(adduct), charge, self._isotopeID(isotope), formula))
+    # ----
+
+
+    def addIons(self, compounds, mz, charges, adducts, isotopes, formulas, adductsTable, isotopesTable):
+        """Add ions from columns.
+            compounds (array of int) - compound ids as returned by addCompound
+            mz (array of float) - ions m/z
+            charges (array of int) - ions charge
+            adducts (array of int) - indexes into adductsTable
+            isotopes (array of int) - indexes into isotopesTable
+            formulas (list of str) - ions formula
+            adductsTable (list of str) - adduct names
+            isotopesTable (list of str) - isotope labels
+        """
+
+        if not len(mz):
+            return
+
+        # register used table entries only
+        adductMap = numpy.zeros(len(adductsTable), dtype='<i2')
+        for x in numpy.unique(adducts).tolist():
+            adductMap[x] = self._adductID(adductsTable[x])
+        isotopeMap = numpy.zeros(len(isotopesTable), dtype='<i2')
+        for x in numpy.unique(isotopes).tolist():
+            isotopeMap[x] = self._isotopeID(isotopesTable[x])
+
+        blob, offsets = self._packStrings(formulas, terminator=b'\0')
+
+        self._flush()
+        self._chunks.append((
+            numpy.asarray(mz, dtype='<f8'),
+            numpy.asarray(compounds, dtype='<i4'),
+            adductMap[numpy.asarray(adducts)],
+            numpy.asarray(charges, dtype='<i2'),
+            isotopeMap[numpy.asarray(isotopes)],
+            offsets[:-1],
+            blob,
+        ))
+    # ----
+
+
+    def save(self, path):
+        """Write sorted store into given path."""
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._flush()
+
+        # join chunks
+        blobs = []
+        formula = []
+        base = 0
+        for chunk in self._chunks:
+            formula.append(chunk[5] + base)
+            blobs.append(chunk[6])
+            base += len(chunk[6])
+
+        def join(i, dtype):
+            if not self._chunks:
+                return numpy.zeros(0, dtype=dtype)
+            return numpy.concatenate([chunk[i] for chunk in self._chunks]).astype(dtype)
+
+        mz = join(0, '<f8')
+        order = numpy.argsort(mz, kind='mergesort')
+
+        # make columns
+        columns = [
+            ('mz', mz[order]),
+            ('compound', join(1, '<i4')[order]),
+            ('adduct', join(2, '<i2')[order]),
+            ('charge', join(3, '<i2')[order]),
+            ('isotope', join(4, '<i2')[order]),
+            ('formula', (numpy.concatenate(formula) if formula else numpy.zeros(0)).astype('<i8')[order]),
+            ('formulas', numpy.concatenate(blobs).astype('u1') if blobs else numpy.zeros(0, dtype='u1')),
+        ]
+        for table, strings in (('names', self.names), ('expressions', self.expressions)):
+            blob, tableOffsets = self._packStrings(strings)
+            columns.append((table, blob))
+            columns.append((table+'Offsets', tableOffsets))
+        columns.append(('compoundKeys', numpy.array([compoundKey(e) for e in self.expressions], dtype='<u8')))
+
+        # make header
+        header = {
+            'version': ION_STORE_VERSION,
+            'massType': self.massType,
+            'charges': self.charges,
+            'adducts': self.adducts,
+            'isotopes': self.isotopes,
+            'coverage': {'adducts': self.coveredAdducts, 'isotopes': self.coveredIsotopes},
+            'count': len(order),
+            'compoundsCount': len(self.names),
+            'elementsKey': elementsFingerprint(),
+            'adductKeys': dict((a, adductFingerprint(a)) for a in self.adducts),
+            'isotopeKeys': dict((i, isotopeFingerprint(i)) for i in self.isotopes),
+            'columns': {},
+        }
+
+        # header size depends on column offsets so reserve space for them
+        headerSize = len(json.dumps(header).encode('utf-8')) + 64 * (len(columns) + 1)
+        headerSize += (-headerSize) % 8
+        offset = 16 + headerSize
+        for name, data in columns:
+            header['columns'][name] = (data.dtype.str, offset, len(data))
+            offset += data.nbytes
+            offset += (-offset) % 8
+
+        headerData = json.dumps(header).encode('utf-8')
+        headerData += b' ' * (headerSize - len(headerData))
+
+        # write to temporary file and replace
+        tmpPath = path.with_suffix(path.suffix + '.tmp')
+        with tmpPath.open('wb') as handle:
+            handle.write(ION_STORE_MAGIC)
+            handle.write(struct.pack('<Q', headerSize))
+            handle.write(headerData)
+            for name, data in columns:
+                handle.seek(header['columns'][name][1])
+                handle.write(data.tobytes())
+        os.replace(str(tmpPath), str(path))
+    # ----
+
+
+
+    # HELPERS
+
+    def _adductID(self, adduct):
+        """Get adduct table id."""
+
+        if not adduct in self.adducts:
+            self.adducts.append(adduct)
+        return self.adducts.index(adduct)
+    # ----
+
+
+    def _isotopeID(self, isotope):
+        """Get isotope table id."""
+
+        isotope = isotope or ''
+        if not isotope in self.isotopes:
+            self.isotopes.append(isotope)
+        return self.isotopes.index(isotope)
+    # ----
+
+
+    def _flush(self):
+        """Convert pending ions into columns chunk."""
+
+        if not self._pending:
+            return
+
+        mz, compound, adduct, charge, isotope, formulas = zip(*self._pending)
+        blob, offsets = self._packStrings(formulas, terminator=b'\0')
+        self._chunks.append((
+            numpy.array(mz, dtype='<f8'),
+            numpy.array(compound, dtype='<i4'),
+            numpy.array(adduct, dtype='<i2'),
+            numpy.array(charge, dtype='<i2'),
+            numpy.array(isotope, dtype='<i2'),
+            offsets[:-1],
+            blob,
+        ))
+        self._pending = []
+    # ----
+
+
+    def _packStrings(self, strings, terminator=b''):
+        """Pack strings into blob and offsets."""
+
+        encoded = [s.encode('utf-8') + terminator for s in strings]
+        offsets = numpy.zeros(len(encoded)+1, dtype='<i8')
+        if encoded:
+            offsets[1:] = numpy.cumsum([len(s) for s in encoded])
+        blob = numpy.frombuffer(b''.join(encoded), dtype='u1')
+
+        return blob, offsets
+    # ----
+
+
+
+class ionCache:
+    """Sharded append-only ion cache.
+        folder (str or Path) - cache folder
+    """
+
+    def __init__(self, folder=ION_CACHE_DIR):
+
+        self.folder = Path(folder)
+        self.manifestPath = self.folder / ION_MANIFEST_NAME
+        self.shards = []
+
+        # open listed shards
+        self.manifest = self._readManifest()
+        for item in self.manifest['shards']:
+            try:
+                self.shards.append(ionStore(self.folder / item['name']))
+            except Exception as e:
+                print('[cache] Skipping ion shard %s: %s' % (item['name'], e))
+    # ----
+
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+    # ----
+
+
+    def close(self):
+        """Release all shards."""
+
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+    # ----
+
+
+    def append(self, builder):
+        """Write collected ions as new shard and add it to manifest.
+            builder (ionStoreBuilder) - collected ions
+        Returns written shard or None if builder is empty.
+        """
+
+        if not builder.names:
+            return None
+
+        # write shard
+        self.folder.mkdir(parents=True, exist_ok=True)
+        name = self._shardName()
+        builder.save(self.folder / name)
+        shard = ionStore(self.folder / name)
+        self.shards.append(shard)
+
+        # update current manifest
+        with self._lock():
+            manifest = self._readManifest()
+            manifest['shards'].append(self._manifestItem(name, shard))
+            self._writeManifest(manifest)
+
+        # merge shards
+        if len(manifest['shards']) > ION_MAX_SHARDS and self._compactable(manifest):
+            self.compact()
+
+        return shard
+    # ----
+
+
+    def compact(self):
+        """Merge shards of the same valid coverage into single shard, rewrite
+        partly invalidated shards without stale ions and remove shards
+        invalidated by changed element, adduct or isotope definitions."""
+
+        # get shards of current manifest
+        manifest = self._readManifest()
+        stores = {}
+        items = {}
+        for item in manifest['shards']:
+            try:
+                stores[item['name']] = ionStore(self.folder / item['name'])
+                items[item['name']] = self._manifestItem(item['name'], stores[item['name']])
+            except Exception:
+                continue
+
+        # group shards by valid coverage, oldest first
+        groups = {}
+        dropped = []
+        for name, item in items.items():
+            coverage = self._validCoverage(item)
+            if coverage is None:
+                dropped.append(name)
+            else:
+                key = (item['massType'], tuple(item['charges'])) + coverage
+                groups.setdefault(key, []).append(name)
+
+        # merge groups and rewrite partly invalidated shards
+        merged = []
+        for key, names in groups.items():
+            adducts, isotopes = key[2:]
+            if len(names) > 1 or any(set(items[x]['adducts']) != set(adducts) or set(items[x]['isotopes']) != set(isotopes) for x in names):
+                name = self._shardName()
+                self._merge([stores[x] for x in names], adducts, isotopes).save(self.folder / name)
+                merged.append((names, name))
+
+        for shard in stores.values():
+            shard.close()
+
+        # refresh records made without coverage
+        stale = any(not 'elementsKey' in item for item in manifest['shards'])
+        if not merged and not dropped and not stale:
+            return
+
+        # replace merged shards in current manifest
+        removed = list(dropped)
+        with self._lock():
+            manifest = self._readManifest()
+            current = [item['name'] for item in manifest['shards']]
+            for names, name in merged:
+                if not all(x in current for x in names):
+                    os.remove(str(self.folder / name))
+                    continue
+                position = max(current.index(x) for x in names)
+                shard = ionStore(self.folder / name)
+                manifest['shards'][position] = self._manifestItem(name, shard)
+                shard.close()
+                current[position] = name
+                removed += names
+            manifest['shards'] = [items.get(item['name'], item) for item in manifest['shards'] if not item['name'] in removed]
+            self._writeManifest(manifest)
+
+        # reopen shards and delete unused files
+        self.close()
+        for item in manifest['shards']:
+            try:
+                self.shards.append(ionStore(self.folder / item['name']))
+            except Exception as e:
+                print('[cache] Skipping ion shard %s: %s' % (item['name'], e))
+        for name in removed:
+            try:
+                os.remove(str(self.folder / name))
+            except OSError:
+                pass
+    # ----
+
+
+    def lookup(self, compounds, massType, charges, adducts, isotopes, partial=False):
+        """Get cached ions of compounds fully covered by requested configs.
+            compounds (dict) - compound name to formula expression
+            massType (0 or 1) - mass type
+            charges (list of int) - ion charges
+            adducts (list of str) - adduct names
+            isotopes (list of str) - isotope labels, '' for plain ion
+            partial (bool) - get cached configs of partially covered compounds too
+        Returns list of (name, mz, charge, adduct, isotope, formula) and
+        list of compound names which have to be computed. Configs missing
+        for partially covered compounds can be found by plan().
+        """
+
+        names, pairs, members, cover, patterns, inverse = self._resolve(compounds, massType, charges, adducts, isotopes)
+        if not len(names):
+            return [], []
+
+        served = patterns.all(axis=1)[inverse]
+        missing = [names[x] for x in numpy.flatnonzero(~served)]
+        if partial:
+            served = numpy.ones(len(names), dtype=bool)
+
+        # select rows from all shards
+        found = []
+        for s, shard in enumerate(self.shards):
+            mask = served & (members[:, s] >= 0)
+            if not mask.any() or not cover[s].any():
+                continue
+
+            shardAdducts = [a for a in adducts if any(cover[s][x] for x, p in enumerate(pairs) if p[0] == a)]
+            shardIsotopes = [i for i in isotopes if any(cover[s][x] for x, p in enumerate(pairs) if p[1] == i)]
+            rows = shard.select(members[mask, s], charges, shardAdducts, shardIsotopes)
+            if not len(rows):
+                continue
+
+            # map shard tables to request
+            compoundMap = numpy.full(shard.compoundsCount, -1, dtype=numpy.int64)
+            compoundMap[members[mask, s]] = numpy.flatnonzero(mask)
+            adductMap = numpy.array([adducts.index(a) if a in adducts else -1 for a in shard.adducts], dtype=numpy.int64)
+            isotopeMap = numpy.array([isotopes.index(i) if i in isotopes else -1 for i in shard.isotopes], dtype=numpy.int64)
+
+            found.append((
+                numpy.full(len(rows), s, dtype=numpy.int64),
+                rows,
+                compoundMap[shard.column('compound')[rows]],
+                adductMap[shard.column('adduct')[rows]],
+                isotopeMap[shard.column('isotope')[rows]],
+                numpy.asarray(shard.column('charge')[rows], dtype=numpy.int64),
+            ))
+
+        if not found:
+            return [], missing
+
+        # use newest shard for ions found in several shards
+        shardIDs, rows, compoundIDs, adductIDs, isotopeIDs, chargeIDs = [numpy.concatenate(x) for x in zip(*found)]
+        order = numpy.lexsort((-shardIDs, chargeIDs, isotopeIDs, adductIDs, compoundIDs))
+        keys = numpy.stack((compoundIDs, adductIDs, isotopeIDs, chargeIDs))[:, order]
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = (keys[:, 1:] != keys[:, :-1]).any(axis=0)
+        order = order[first]
+
+        # get records
+        buff = []
+        for s, shard in enumerate(self.shards):
+            selected = numpy.sort(rows[order[shardIDs[order] == s]])
+            if len(selected):
+                buff += shard.records(selected)
+
+        return buff, missing
+    # ----
+
+
+    def plan(self, compounds, massType, charges, adducts, isotopes):
+        """Get configs missing in the cache.
+            compounds (dict) - compound name to formula expression
+            massType (0 or 1) - mass type
+            charges (list of int) - ion charges
+            adducts (list of str) - adduct names, RADICAL for radical ions
+            isotopes (list of str) - isotope labels, '' for plain ion
+        Returns list of (names, adducts, isotopes) jobs. Compounds of the
+        same job share the same missing configs.
+        """
+
+        names, pairs, members, cover, patterns, inverse = self._resolve(compounds, massType, charges, adducts, isotopes)
+
+        jobs = []
+        for p, pattern in enumerate(patterns):
+            missingPairs = [pair for pair, covered in zip(pairs, pattern) if not covered]
+            if not missingPairs:
+                continue
+
+            jobAdducts = [a for a in adducts if any(a == pair[0] for pair in missingPairs)]
+            jobIsotopes = [i for i in isotopes if any(i == pair[1] for pair in missingPairs if pair[0] != RADICAL)]
+            if RADICAL in jobAdducts and not '' in jobIsotopes:
+                jobIsotopes.insert(0, '')
+
+            jobNames = [names[x] for x in numpy.flatnonzero(inverse == p)]
+            jobs.append((jobNames, jobAdducts, jobIsotopes))
+
+        return jobs
+    # ----
+
+
+
+    # HELPERS
+
+    def _resolve(self, compounds, massType, charges, adducts, isotopes):
+        """Find shards holding current compounds and configs they cover.
+        Compounds are grouped by the set of shards holding them, so coverage
+        is resolved once per group instead of once per compound.
+        """
+
+        names = list(compounds)
+        pairs = ionPairs(adducts, isotopes)
+        keys = numpy.array([compoundKey(compounds[name]) for name in names], dtype=numpy.uint64)
+
+        # get compounds membership and coverage of each shard
+        members = numpy.full((len(names), len(self.shards)), -1, dtype=numpy.int64)
+        cover = numpy.zeros((len(self.shards), len(pairs)), dtype=bool)
+        for s, shard in enumerate(self.shards):
+            cover[s] = shard.coverage(massType, charges, pairs)
+            if cover[s].any():
+                members[:, s] = shard.members(names, keys)
+
+        # resolve coverage for each group of compounds
+        if not len(names):
+            return names, pairs, members, cover, numpy.zeros((0, len(pairs)), dtype=bool), numpy.zeros(0, dtype=numpy.int64)
+
+        groups, inverse = numpy.unique(members >= 0, axis=0, return_inverse=True)
+        patterns = numpy.zeros((len(groups), len(pairs)), dtype=bool)
+        for g, group in enumerate(groups):
+            patterns[g] = cover[group].any(axis=0)
+
+        return names, pairs, members, cover, patterns, inverse.reshape(-1)
+    # ----
+
+
+    def _compactable(self, manifest):
+        """Check whether compaction can merge, rewrite or drop any shard of
+        given manifest."""
+
+        keys = set()
+        for item in manifest['shards']:
+            if not 'elementsKey' in item:
+                return True
+
+            # invalidated shard
+            coverage = self._validCoverage(item)
+            if coverage is None or set(coverage[0]) != set(item['adducts']) or set(coverage[1]) != set(item['isotopes']):
+                return True
+
+            # shards of the same coverage
+            key = (item['massType'], tuple(item['charges'])) + coverage
+            if key in keys:
+                return True
+            keys.add(key)
+
+        return False
+    # ----
+
+
+    def _validCoverage(self, item):
+        """Get sorted (adducts, isotopes) of manifest record which are still
+        valid for current definitions, None if shard can't be used anymore."""
+
+        if item['elementsKey'] != elementsFingerprint():
+            return None
+
+        adducts = [a for a in item['adducts'] if item['adductKeys'].get(a) == adductFingerprint(a)]
+        isotopes = [i for i in item['isotopes'] if item['isotopeKeys'].get(i) == isotopeFingerprint(i)]
+
+        # radical ions are the only ones left without isotopes
+        if not isotopes:
+            adducts = [a for a in adducts if a == RADICAL]
+        if not adducts:
+            return None
+
+        return tuple(sorted(adducts)), tuple(sorted(isotopes))
+    # ----
+
+
+    def _merge(self, shards, adducts, isotopes):
+        """Collect ions of given shards into single builder of given coverage,
+        ions out of the coverage are skipped and newer shards take precedence
+        for repeated compounds."""
+
+        first = shards[0]
+        builder = ionStoreBuilder(first.massType, first.charges, adducts, isotopes)
+
+        for shard in reversed(shards):
+            mspy.mod_stopper.CHECK_FORCE_QUIT()
+
+            # register compounds not found in newer shards
+            compoundMap = numpy.full(shard.compoundsCount, -1, dtype=numpy.int64)
+            for name, x in shard.compoundIndex().items():
+                if not builder.hasCompound(name):
+                    compoundMap[x] = builder.addCompound(name, shard.compoundExpression(x))
+
+            # add ions within coverage, radical ions are never labelled
+            adductIDs = numpy.asarray(shard.column('adduct'))
+            isotopeIDs = numpy.asarray(shard.column('isotope'))
+            validAdducts = numpy.array([a in adducts for a in shard.adducts], dtype=bool)
+            radicals = numpy.array([a == RADICAL for a in shard.adducts], dtype=bool)
+            validIsotopes = numpy.array([i in isotopes for i in shard.isotopes], dtype=bool)
+            compounds = compoundMap[shard.column('compound')]
+            rows = numpy.flatnonzero((compounds >= 0) & validAdducts[adductIDs] & (validIsotopes[isotopeIDs] | radicals[adductIDs]))
+            builder.addIons(
+                compounds[rows],
+                shard.column('mz')[rows],
+                shard.column('charge')[rows],
+                shard.column('adduct')[rows],
+                shard.column('isotope')[rows],
+                shard.formulas(rows),
+                shard.adducts,
+                shard.isotopes,
+            )
+
+        return builder
+    # ----
+
+
+    def _shardName(self):
+        """Get name of new shard file."""
+
+        manifest = self._readManifest()
+        number = manifest['next']
+        for item in manifest['shards']:
+            number = max(number, int(item['name'].split('-')[1]) + 1)
+
+        while True:
+            name = ION_SHARD_NAME % (number, os.getpid())
+            if not (self.folder / name).exists():
+                return name
+            number += 1
+    # ----
+
+
+    def _manifestItem(self, name, shard):
+        """Make manifest record of given shard."""
+
+        return {
+            'name': name,
+            'count': len(shard),
+            'compounds': shard.compoundsCount,
+            'massType': shard.massType,
+            'charges': shard.charges,
+            'adducts': shard.coveredAdducts,
+            'isotopes': shard.coveredIsotopes,
+            'elementsKey': shard.elementsKey,
+            'adductKeys': dict((a, shard.adductKeys.get(a)) for a in shard.coveredAdducts),
+            'isotopeKeys': dict((i, shard.isotopeKeys.get(i)) for i in shard.coveredIsotopes),
+        }
+    # ----
+
+
+    @contextlib.contextmanager
+    def _lock(self):
+        """Hold manifest lock file, lock left by crashed writer is removed
+        after ION_LOCK_TIMEOUT."""
+
+        path = self.folder / ION_LOCK_NAME
+        start = time.time()
+
+        # create lock file
+        while True:
+            try:
+                handle = os.open(str(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - path.stat().st_mtime > ION_LOCK_TIMEOUT:
+                        path.unlink()
+                        continue
+                except OSError:
+                    continue
+                if time.time() - start > ION_LOCK_TIMEOUT:
+                    raise IOError('Ion cache manifest is locked! --> ' + str(path))
+                time.sleep(0.05)
+
+        # release lock
+        try:
+            os.write(handle, str(os.getpid()).encode('ascii'))
+            os.close(handle)
+            yield
+        finally:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    # ----
+
+
+    def _readManifest(self):
+        """Read current manifest."""
+
+        manifest = {'version': ION_STORE_VERSION, 'next': 0, 'shards': []}
+        if not self.manifestPath.exists():
+            return manifest
+
+        try:
+            with self.manifestPath.open('r', encoding='utf-8') as handle:
+                data = json.load(handle)
+        except Exception as e:
+            print('[cache] Failed to read ion cache manifest: %s' % e)
+            return manifest
+
+        if data.get('version') == ION_STORE_VERSION:
+            return data
+
+        return manifest
+    # ----
+
+
+    def _writeManifest(self, manifest):
+        """Replace manifest atomically, called with manifest lock held."""
+
+        # keep shard numbers unique
+        for item in manifest['shards']:
+            manifest['next'] = max(manifest['next'], int(item['name'].split('-')[1]) + 1)
+
+        tmpPath = self.manifestPath.with_suffix('.tmp')
+        with tmpPath.open('w', encoding='utf-8') as handle:
+            json.dump(manifest, handle, indent=1)
+        os.replace(str(tmpPath), str(self.manifestPath))
+        self.manifest = manifest
+    # ----
+
+
+
+def openIonCache(folder=None):
+    """Open ion cache if available, None otherwise."""
+
+    if folder is None:
+        folder = ION_CACHE_DIR
+
+    if not (Path(folder) / ION_MANIFEST_NAME).exists():
+        return None
+
+    try:
+        return ionCache(folder)
+    except Exception as e:
+        print('[cache] Failed to open ion cache %s: %s' % (folder, e))
+        return None
+# ----
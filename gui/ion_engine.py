@@ -0,0 +1,364 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import numpy
+
+# load modules
+import mspy
+
+
+# ADDUCTS AND ISOTOPE LABELS
+# --------------------------
+
+# $$
+FORMULAS = {
+    '[M+Li]+':'Li',
+    '[M-H2O+H]+':'H-2O-1',
+    '[M-H2O-H]-':'H-2O-1',
+    '[+ACN+H]+':'CH3CN',
+    '[+MeOH+H]+':'CH3OH',
+    '[M-H]-': 'H',
+    '[M+H]+': 'H',
+
+    '(13)C1':'C{13}C-1',
+    '(13)C2':'C{13}2C-2',
+    '(13)C3':'C{13}3C-3',
+    '(13)C4':'C{13}4C-4',
+    '(13)C5':'C{13}5C-5',
+    '(13)C6':'C{13}6C-6',
+    '(15)N1':'N{15}N-1',
+    '(15)N2':'N{15}2N-2',
+    '(15)N3':'N{15}3N-3',
+    '(15)N4':'N{15}4N-4',
+    '(15)N5':'N{15}5N-5',
+    '(15)N6':'N{15}6N-6',
+    '(15)N7':'N{15}7N-7',
+    '(15)N8':'N{15}8N-8',
+    '(15)N9':'N{15}9N-9',
+
+    '[M+Cl]-':'Cl',
+    '[M+Na-2H]-':'Na',
+    '[M+K-2H]-':'K',
+    '[M-CH3]-':'C-1H-3',
+    '[M-C3H10N]-':'C-3H-10N-1',
+    '[M-C5H12N]-':'C-5H-12N-1',
+
+    '[M+Na]+':'Na',
+    '[M+K]+':'K',
+    '[M+NH4]+':'NH4',
+
+    '[2M-H]-':'H',
+    '[2M+Cl]-':'Cl',
+    '[2M+Na-2H]-':'Na',
+    '[2M+K-2H]-':'K',
+
+    '[2M+H]+':'H',
+    '[2M+Na]+':'Na',
+    '[2M+K]+':'K',
+    '[2M+NH4]+':'NH4',
+
+    '[M+FMP10]+':'C20H13N',
+    '[M+2FMP10]+':'C40H26N2',
+    '[M+2FMP10-CH3]+':'C39H24N2',
+
+    '[M+AMPP]+':'C12H10N2O-1',
+    '[M+2AMPP]+':'C24H20N4O-2',
+    '[M+3AMPP]+':'C36H30N6O-3',
+};
+
+# adducts replacing charging proton, (M)(adduct)(H-1)
+ADDUCTS_PROTON_LOSS = ('[M+Li]+', '[M+Na-2H]-', '[M+K-2H]-', '[M+Na]+', '[M+K]+', '[M+NH4]+')
+
+# adducts keeping the proton, (M)(adduct)(H)
+ADDUCTS_PROTON_GAIN = ('[M+Cl]-', '[M-CH3]-', '[M-C3H10N]-', '[M-C5H12N]-')
+
+# dimers replacing charging proton, (2M)(adduct)(H-1)
+ADDUCTS_DIMER_PROTON_LOSS = ('[2M+Na]+', '[2M+K]+', '[2M+NH4]+', '[2M+H]+', '[2M-H]-')
+
+# dimers keeping the proton, (2M)(adduct)(H)
+ADDUCTS_DIMER_PROTON_GAIN = ('[2M+Cl]-', '[2M+Na-2H]-', '[2M+K-2H]-')
+
+# plain additions and losses, (M)(adduct)
+ADDUCTS_PLAIN = ('[M-H2O-H]-', '[M-H2O+H]+', '[+MeOH+H]+', '[+ACN+H]+', '[M+FMP10]+', '[M+2FMP10]+', '[M+2FMP10-CH3]+', '[M+AMPP]+', '[M+2AMPP]+', '[M+3AMPP]+')
+
+# isotope labels which can be combined
+ISOTOPES_C13 = ('(13)C1', '(13)C2', '(13)C3', '(13)C4', '(13)C5', '(13)C6')
+ISOTOPES_N15 = ('(15)N1', '(15)N2', '(15)N3', '(15)N4', '(15)N5', '(15)N6', '(15)N7', '(15)N8', '(15)N9')
+
+# radical ions label
+RADICAL = 'M*'
+
+
+# FORMULA HELPERS
+# ---------------
+
+def adductRule(adduct):
+    """Get (molecules count, formula suffix) used to make ion of given adduct."""
+
+    adductFormula = FORMULAS.get(adduct, '')
+
+    if adduct in ADDUCTS_PROTON_LOSS:
+        return 1, '(%s)(H-1)' % adductFormula
+    elif adduct in ADDUCTS_PROTON_GAIN:
+        return 1, '(%s)(H)' % adductFormula
+    elif adduct in ADDUCTS_DIMER_PROTON_LOSS:
+        return 2, '(%s)(H-1)' % adductFormula
+    elif adduct in ADDUCTS_DIMER_PROTON_GAIN:
+        return 2, '(%s)(H)' % adductFormula
+    elif adduct in ADDUCTS_PLAIN:
+        return 1, '(%s)' % adductFormula
+
+    return 1, ''
+# ----
+
+
+def adductFormula(expression, adduct):
+    """Make ion formula of given compound expression and adduct."""
+
+    count, suffix = adductRule(adduct)
+    return '%s%s' % (count * expression, suffix)
+# ----
+
+
+def isotopeLabels(isotopes):
+    """Get selected isotope labels including C/N combinations, '' stands for plain ion."""
+
+    labels = ['']
+    for iso in isotopes:
+        if iso in FORMULAS and not iso in labels:
+            labels.append(iso)
+
+    for iso1 in ISOTOPES_C13:
+        for iso2 in ISOTOPES_N15:
+            if iso1 in isotopes and iso2 in isotopes:
+                labels.append(iso1 + iso2)
+
+    return labels
+# ----
+
+
+def isotopeFormula(label):
+    """Get formula suffix of given isotope label."""
+
+    if not label:
+        return ''
+    elif label in FORMULAS:
+        return '(%s)' % FORMULAS[label]
+
+    for iso1 in ISOTOPES_C13:
+        if label.startswith(iso1) and label[len(iso1):] in ISOTOPES_N15:
+            return '(%s)(%s)' % (FORMULAS[iso1], FORMULAS[label[len(iso1):]])
+
+    raise ValueError('Unknown isotope label! --> ' + label)
+# ----
+
+
+def ionFormula(expression, adduct, isotope):
+    """Make ion formula string as shown in compounds search."""
+
+    if adduct == RADICAL:
+        return expression
+
+    return adductFormula(expression, adduct) + isotopeFormula(isotope)
+# ----
+
+
+
+# ION GENERATOR
+# -------------
+
+class ionGenerator:
+    """Generates ions of whole compound library by array operations.
+    Composition of each compound is parsed once into element-count vector,
+    adducts and isotope labels become delta vectors and ion masses for all
+    compounds are calculated by matrix operations."""
+
+    def __init__(self, compounds):
+
+        self.names = []
+        self.expressions = []
+        self.atoms = []
+        self._atoms = {}
+
+        # parse compositions
+        rows = []
+        for name, compound in compounds:
+            if not isinstance(compound, mspy.obj_compound.compound):
+                compound = mspy.obj_compound.compound(compound)
+
+            row = {}
+            for atom, count in compound.composition().items():
+                row[self._atomIndex(atom)] = count
+
+            self.names.append(name)
+            self.expressions.append(compound.expression)
+            rows.append(row)
+
+        # make composition matrix
+        self.matrix = numpy.zeros((len(rows), len(self.atoms)), dtype=numpy.int64)
+        for i, row in enumerate(rows):
+            for j, count in row.items():
+                self.matrix[i, j] = count
+
+        # compounds with negative counts are skipped
+        self.valid = (self.matrix >= 0).all(axis=1) if len(rows) else numpy.zeros(0, dtype=bool)
+    # ----
+
+
+    def __len__(self):
+        return len(self.names)
+    # ----
+
+
+    def generate(self, charges, adducts, isotopes, massType=0, radicals=False):
+        """Generate all valid ions.
+            charges (list of int) - ion charges
+            adducts (list of str) - adduct names
+            isotopes (list of str) - isotope labels as returned by isotopeLabels()
+            massType (0 or 1) - used mass type, 0 = monoisotopic, 1 = average
+            radicals (bool) - add radical ions
+        Returns dict of columns 'compound', 'mz', 'charge', 'adduct' and 'isotope'
+        where adduct and isotope are indexes into given lists.
+        """
+
+        # get deltas
+        deltas = self._deltas([adductRule(adduct)[1] for adduct in adducts] + [isotopeFormula(label) for label in isotopes])
+        adductDeltas = [(adductRule(adduct)[0], delta) for adduct, delta in zip(adducts, deltas)]
+        isotopeDeltas = deltas[len(adducts):]
+
+        # get atom masses and compounds masses
+        atomMasses = self._atomMasses(massType)
+        masses = self.matrix.dot(atomMasses)
+        valid = numpy.flatnonzero(self.valid)
+
+        columns = {'compound': [], 'mz': [], 'charge': [], 'adduct': [], 'isotope': []}
+
+        def append(compounds, mz, charge, adduct, isotope):
+            columns['compound'].append(compounds)
+            columns['mz'].append(mz)
+            columns['charge'].append(numpy.full(len(compounds), charge, dtype=numpy.int64))
+            columns['adduct'].append(numpy.full(len(compounds), adduct, dtype=numpy.int64))
+            columns['isotope'].append(numpy.full(len(compounds), isotope, dtype=numpy.int64))
+
+        # radical ions
+        if radicals:
+            adducts = list(adducts) + [RADICAL]
+            for charge in charges:
+                mz = mspy.mod_basics.mz(masses[valid], charge, agentFormula='e', agentCharge=-1, massType=massType)
+                append(valid, mz, charge, len(adducts)-1, 0)
+
+        # adduct ions
+        for a, (count, delta) in enumerate(adductDeltas):
+            mspy.mod_stopper.CHECK_FORCE_QUIT()
+
+            # check adduct ion composition
+            adductMatrix = count * self.matrix[valid] + delta
+            adductValid = valid[(adductMatrix >= 0).all(axis=1)]
+            adductMasses = count * masses[adductValid] + delta.dot(atomMasses)
+
+            for i, isoDelta in enumerate(isotopeDeltas):
+
+                # check isotope ion composition on changed atoms only
+                ions = adductValid
+                if isoDelta.any():
+                    touched = numpy.flatnonzero(isoDelta)
+                    counts = count * self.matrix[numpy.ix_(adductValid, touched)] + delta[touched] + isoDelta[touched]
+                    ions = adductValid[(counts >= 0).all(axis=1)]
+
+                ionMasses = count * masses[ions] + (delta + isoDelta).dot(atomMasses)
+                for charge in charges:
+                    mz = mspy.mod_basics.mz(ionMasses, charge, massType=massType)
+                    append(ions, mz, charge, a, i)
+
+        # join blocks
+        for key in columns:
+            if columns[key]:
+                columns[key] = numpy.concatenate(columns[key])
+            else:
+                columns[key] = numpy.zeros(0, dtype=numpy.float64 if key == 'mz' else numpy.int64)
+
+        # sort by compound, charge, adduct and isotope
+        chargeOrder = numpy.searchsorted(numpy.array(sorted(charges)), columns['charge'])
+        order = numpy.lexsort((columns['isotope'], columns['adduct'], chargeOrder, columns['compound']))
+        for key in columns:
+            columns[key] = columns[key][order]
+
+        columns['adducts'] = list(adducts)
+        columns['isotopes'] = list(isotopes)
+
+        return columns
+    # ----
+
+
+    def formulas(self, ions):
+        """Make formula strings of generated ions."""
+
+        adducts = ions['adducts']
+        isotopes = ions['isotopes']
+        expressions = self.expressions
+
+        return [ionFormula(expressions[c], adducts[a], isotopes[i]) for c, a, i in zip(ions['compound'].tolist(), ions['adduct'].tolist(), ions['isotope'].tolist())]
+    # ----
+
+
+
+    # HELPERS
+
+    def _atomIndex(self, atom):
+        """Get column index of given atom."""
+
+        if not atom in self._atoms:
+            self._atoms[atom] = len(self.atoms)
+            self.atoms.append(atom)
+
+            # extend existing matrix
+            if hasattr(self, 'matrix'):
+                self.matrix = numpy.hstack((self.matrix, numpy.zeros((len(self.matrix), 1), dtype=self.matrix.dtype)))
+
+        return self._atoms[atom]
+    # ----
+
+
+    def _deltas(self, formulas):
+        """Get element-count vectors of given formulas."""
+
+        # get compositions and register new atoms first
+        compositions = []
+        for formula in formulas:
+            composition = {}
+            if formula:
+                composition = mspy.obj_compound.compound(formula).composition()
+            compositions.append([(self._atomIndex(atom), count) for atom, count in composition.items()])
+
+        # make vectors
+        deltas = []
+        for composition in compositions:
+            delta = numpy.zeros(len(self.atoms), dtype=numpy.int64)
+            for j, count in composition:
+                delta[j] = count
+            deltas.append(delta)
+
+        return deltas
+    # ----
+
+
+    def _atomMasses(self, massType):
+        """Get masses of all atoms."""
+
+        return numpy.array([mspy.obj_compound.compound(atom).mass(massType) for atom in self.atoms], dtype=numpy.float64)
+    # ----
@@ -24,6 +24,7 @@ import copy
 
 # load modules
 from . import config
+from . import compounds_index
 import mspy
 
 
@@ -49,6 +50,18 @@ try: mspy.blocks.loadEnzymes(os.path.join(config.confdir,'enzymes.xml'), clear=F
 except: mspy.blocks.saveEnzymes(os.path.join(config.confdir,'enzymes.xml'))
 
 
+# KEEP ISOTOPIC PATTERNS ACROSS SESSIONS
+# --------------------------------------
+
+PATTERN_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.mmass', 'cache', 'patterns.sqlite')
+
+try:
+    os.makedirs(os.path.dirname(PATTERN_CACHE_PATH), exist_ok=True)
+    mspy.mod_pattern.PATTERN_CACHE.setstorage(PATTERN_CACHE_PATH)
+except Exception as e:
+    print('[patterns] Failed to open pattern cache: %s' % e)
+
+
 # INIT DEFAULT VALUES
 # -------------------
 
@@ -697,30 +710,10 @@ def loadReferences(path=os.path.join(config.confdir, 'references.xml'), clear=Tr
 
 
 def loadCompounds(path=os.path.join(config.confdir, 'compounds.xml'), clear=True):
-    """Parse compounds XML and get data."""
-    
-    container = {}
-    
-    # parse XML
-    document = xml.dom.minidom.parse(path)
+    """Parse compounds XML and get data. Compound objects are created on first access."""
     
-    # get references
-    groupTags = document.getElementsByTagName('group')
-    if groupTags:
-        for groupTag in groupTags:
-            groupName = groupTag.getAttribute('name')
-            container[groupName] = {}
-            
-            compoundTags = groupTag.getElementsByTagName('compound')
-            if compoundTags:
-                for compoundTag in compoundTags:
-                    try:
-                        name = compoundTag.getAttribute('name')
-                        compound = mspy.obj_compound.compound(compoundTag.getAttribute('formula'))
-                        compound.description = _getNodeText(compoundTag)
-                        container[groupName][name] = compound
-                    except:
-                        pass
+    # parse XML or read index
+    container = compounds_index.loadLibrary(path)
     
     # update current lib
     if container and clear:
@@ -938,8 +931,8 @@ def saveCompounds(path=os.path.join(config.confdir, 'compounds.xml')):
     
     for group in sorted(compounds.keys()):
         buff += '  <group name="%s">\n' % (_escape(group))
-        for name, compound in sorted(compounds[group].items()):
-            buff += '    <compound name="%s" formula="%s">%s</compound>\n' % (_escape(name), compound.expression, _escape(compound.description))
+        for name, expression, description in sorted(compounds_index.compoundRecords(compounds[group])):
+            buff += '    <compound name="%s" formula="%s">%s</compound>\n' % (_escape(name), expression, _escape(description))
         buff += '  </group>\n\n'
     
     buff += '</mMassCompounds>'
@@ -949,9 +942,14 @@ def saveCompounds(path=os.path.join(config.confdir, 'compounds.xml')):
         save = open(path, 'wb')
         save.write(buff.encode("utf-8"))
         save.close()
-        return True
     except:
         return False
+    
+    # update index so next load does not parse saved file again
+    try: compounds_index.writeIndex(path, compounds)
+    except: pass
+    
+    return True
 # ----
 
 
@@ -19,6 +19,7 @@
 from operator import add
 import threading
 import math
+import numpy
 import wx
 
 # load modules
@@ -29,6 +30,9 @@ from . import config
 from . import libs
 import mspy
 from . import doc
+from .compounds_index import compoundExpressions
+from .ion_cache import ionCache, ionStoreBuilder, openIonCache
+from .ion_engine import RADICAL, ionGenerator, isotopeLabels
 
 from gui.panel_match import panelMatch
 
@@ -36,133 +40,6 @@ from gui.panel_match import panelMatch
 # FLOATING PANEL WITH COUPOUND SEARCH TOOL
 # ----------------------------------------
 
-# $$
-FORMULAS = {
-    '[M+Li]+':'Li',
-    '[M-H2O+H]+':'H-2O-1',
-    '[M-H2O-H]-':'H-2O-1',
-    '[+ACN+H]+':'CH3CN',
-    '[+MeOH+H]+':'CH3OH',
-    '[M-H]-': 'H',
-    '[M+H]+': 'H',
-
-    '(13)C1':'C{13}C-1',
-    '(13)C2':'C{13}2C-2',
-    '(13)C3':'C{13}3C-3',
-    '(13)C4':'C{13}4C-4',
-    '(13)C5':'C{13}5C-5',
-    '(13)C6':'C{13}6C-6',
-    '(15)N1':'N{15}N-1',
-    '(15)N2':'N{15}2N-2',
-    '(15)N3':'N{15}3N-3',
-    '(15)N4':'N{15}4N-4',
-    '(15)N5':'N{15}5N-5',
-    '(15)N6':'N{15}6N-6',
-    '(15)N7':'N{15}7N-7',
-    '(15)N8':'N{15}8N-8',
-    '(15)N9':'N{15}9N-9',
-
-    '[M+Cl]-':'Cl',
-    '[M+Na-2H]-':'Na',
-    '[M+K-2H]-':'K',
-    '[M-CH3]-':'C-1H-3',
-    '[M-C3H10N]-':'C-3H-10N-1',
-    '[M-C5H12N]-':'C-5H-12N-1',
-
-    '[M+Na]+':'Na',
-    '[M+K]+':'K',
-    '[M+NH4]+':'NH4',
-
-    '[2M-H]-':'H',
-    '[2M+Cl]-':'Cl',
-    '[2M+Na-2H]-':'Na',
-    '[2M+K-2H]-':'K',
-
-    '[2M+H]+':'H',
-    '[2M+Na]+':'Na',
-    '[2M+K]+':'K',
-    '[2M+NH4]+':'NH4',
-
-    '[M+FMP10]+':'C20H13N',
-    '[M+2FMP10]+':'C40H26N2',
-    '[M+2FMP10-CH3]+':'C39H24N2',
-
-    '[M+AMPP]+':'C12H10N2O-1',
-    '[M+2AMPP]+':'C24H20N4O-2',
-    '[M+3AMPP]+':'C36H30N6O-3',
-};
-
-from pathlib import Path
-try:
-    import joblib
-    HAS_JOBLIB = True
-except ImportError:
-    HAS_JOBLIB = False
-import hashlib
-
-ION_CACHE_DIR = Path.home() / '.mmass' / 'cache' / 'ions'
-ION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
-
-def config_to_hash(name: str, adduct: str, charge: int, isotope: str, mass_type: int) -> str:
-    key = f"{name}|{adduct}|{charge}|{isotope or ''}|{mass_type}"
-    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
-
-def is_ion_cached(name, expression, adduct, charge, isotope, mass_type):
-    hash_id = config_to_hash(name, adduct, charge, isotope, mass_type)
-    folder = ION_CACHE_DIR / expression
-    return (folder / f"{hash_id}.joblib").exists() or (folder / f"{hash_id}.invalid").exists()
-
-def save_ions_to_cache(name, expression, adduct, charge, isotope, mass_type, ions):
-    if not HAS_JOBLIB:
-        return
-    hash_id = config_to_hash(name, adduct, charge, isotope, mass_type)
-    folder = ION_CACHE_DIR / expression
-    folder.mkdir(parents=True, exist_ok=True)
-    path = folder / f"{hash_id}.joblib"
-    joblib.dump(ions, path)
-
-def mark_config_invalid(name, expression, adduct, charge, isotope, mass_type):
-    if not HAS_JOBLIB:
-        return
-    hash_id = config_to_hash(name, adduct, charge, isotope, mass_type)
-    folder = ION_CACHE_DIR / expression
-    folder.mkdir(parents=True, exist_ok=True)
-    path = folder / f"{hash_id}.invalid"
-    path.touch()
-
-def load_compound_ions(name: str, adducts, charge, isotopes, mass_type, expression):
-    """Load matching ions from per-config cache files using hashed filenames."""
-
-    if not HAS_JOBLIB:
-        return None
-
-    folder = ION_CACHE_DIR / expression
-    if not folder.exists():
-        return None
-
-    ions = []
-
-    for adduct in adducts:
-        isotope_list = isotopes if isotopes else [""]
-        for isotope in isotope_list:
-            h = config_to_hash(name, adduct, charge, isotope, mass_type)
-            joblib_path = folder / f"{h}.joblib"
-            invalid_path = folder / f"{h}.invalid"
-
-            if invalid_path.exists():
-                print(f"[cache] Skipping {h}: marked invalid")
-                continue
-
-            if joblib_path.exists():
-                try:
-                    loaded = joblib.load(joblib_path)
-                    ions.extend(loaded)
-                except Exception as e:
-                    print(f"[{name}] Failed to load {joblib_path.name}: {e}")
-
-    return ions if ions else None
-
-
 # $$
 class CurrentCompound():
     # 0 name, 1 m/z, 2 z, 3 adduct, 4 formula, 5 error, 6 matches, 7 measured m/z
@@ -1013,37 +890,34 @@ class panelCompoundsSearch(wx.MiniFrame):
         self.match_butt.Enable(False)
         self.annotate_butt.Enable(False)
 
-        # Try loading from per-compound cache, filtering to match selected config
-        print("Loading ions from cache with filtering based on GUI settings...")
-
-        adducts = config.compoundsSearch['adducts']
-        charge = config.compoundsSearch['maxCharge']
-        isotopes = config.compoundsSearch['isotopes']
-        massType = config.compoundsSearch['massType']
-
-        # get max charge and polarity
+        # try loading from ion cache, filtering to match selected config
         polarity = -1 if config.compoundsSearch['maxCharge'] < 0 else 1
-        #maxCharge = abs(config.compoundsSearch['maxCharge']) + 1
+        charges = [z * polarity for z in range(1, abs(config.compoundsSearch['maxCharge']) + 1)]
         defaultAdduct = '[M-H]-' if polarity < 0 else '[M+H]+'
         adducts = config.compoundsSearch['adducts'][:]
         adducts.append(defaultAdduct) # always combine with the main ion
-
-        to_compute = {}
-
-        for name in compounds:
-            expression = compounds[name].expression
-            ions = load_compound_ions(name, adducts, polarity, isotopes, massType, expression)
-
-            if ions:
-                filtered = [
-                    ion for ion in ions
-                    if ion.adduct in adducts
-                    and ion.z == charge
-                    and (not isotopes or ion.isotope in isotopes or ion.isotope is None)
-                ]
-                self.currentCompounds.extend(filtered)
-            else:
-                to_compute[name] = compounds[name]
+        if config.compoundsSearch['radicals']:
+            adducts.append(RADICAL)
+        isotopes = isotopeLabels(config.compoundsSearch['isotopes'])
+
+        # single formulas are not cached
+        useCache = self.currentTool == 'compounds'
+        
+        expressions = compoundExpressions(compounds)
+        to_compute = [(expressions, adducts, isotopes)]
+        loaded = None
+        cache = openIonCache() if useCache else None
+        if cache:
+            print("Loading ions from cache with filtering based on GUI settings...")
+            records, missing = cache.lookup(expressions, config.compoundsSearch['massType'], charges, adducts, isotopes, partial=True)
+            for name, mz, z, adduct, isotope, formula in records:
+                self.currentCompounds.append(CurrentCompound(name=name, mz=mz, z=z, adduct=adduct, isotope=isotope, formula=formula))
+            
+            # compute configs missing in the cache only
+            missing = dict((name, expressions[name]) for name in missing)
+            to_compute = [(dict((name, missing[name]) for name in names), jobAdducts, jobIsotopes) for names, jobAdducts, jobIsotopes in cache.plan(missing, config.compoundsSearch['massType'], charges, adducts, isotopes)]
+            loaded = set((name, z, adduct, isotope) for name, mz, z, adduct, isotope, formula in records)
+            cache.close()
 
         # update list immediately if any cached results
         if self.currentCompounds:
@@ -1064,7 +938,7 @@ class panelCompoundsSearch(wx.MiniFrame):
             return
 
         # otherwise compute only the missing ones
-        self.processing = threading.Thread(target=self.runGenerateIons, kwargs={'compounds': to_compute})
+        self.processing = threading.Thread(target=self.runGenerateIons, kwargs={'jobs': to_compute, 'loaded': loaded, 'saveCache': useCache})
         self.processing.start()
         
         # pulse gauge while working
@@ -1389,87 +1263,51 @@ class panelCompoundsSearch(wx.MiniFrame):
             self.setMatchPanelData()
     # ----
     
-    def runGenerateIons(self, compounds):
-        """Calculate and cache compound ions."""
+    def runGenerateIons(self, jobs, loaded=None, saveCache=True):
+        """Calculate compound ions.
+            jobs (list of (compounds, adducts, isotopes)) - compounds and configs to compute
+            loaded (set or None) - (name, charge, adduct, isotope) of ions loaded from cache
+            saveCache (bool) - append computed ions to cache
+        """
 
         try:
             polarity = -1 if config.compoundsSearch['maxCharge'] < 0 else 1
-            maxCharge = abs(config.compoundsSearch['maxCharge']) + 1
-            defaultAdduct = '[M-H]-' if polarity < 0 else '[M+H]+'
-            adducts = config.compoundsSearch['adducts'][:]
-            adducts.append(defaultAdduct)
-            save_cache = config.compoundsSearch.get("saveCache", 1)
-
-            self.currentCompounds = []
-
-            for name, compound in sorted(compounds.items()):
-                if not compound.isvalid():
-                    continue
-
-                for z in range(1, maxCharge):
-                    mspy.mod_stopper.CHECK_FORCE_QUIT()
-
-                    if config.compoundsSearch['radicals']:
-                        mz = compound.mz(z * polarity, agentFormula='e', agentCharge=-1)[config.compoundsSearch['massType']]
-                        radical_ion = CurrentCompound(name=name, mz=mz, z=z * polarity, adduct='M*', formula=compound.expression)
-                        self.currentCompounds.append(radical_ion)
-
-                    for adduct in adducts:
+            charges = [z * polarity for z in range(1, abs(config.compoundsSearch['maxCharge']) + 1)]
+
+            for compounds, adducts, isotopes in jobs:
+
+                # generate all ions of the job at once
+                generator = ionGenerator(sorted(compounds.items()))
+                ions = generator.generate(
+                    charges = charges,
+                    adducts = [a for a in adducts if a != RADICAL],
+                    isotopes = isotopes,
+                    massType = config.compoundsSearch['massType'],
+                    radicals = RADICAL in adducts
+                )
+
+                # make compounds list, skip ions already loaded from cache
+                formulas = generator.formulas(ions)
+                for x, (c, mz, z, a, i) in enumerate(zip(ions['compound'].tolist(), ions['mz'].tolist(), ions['charge'].tolist(), ions['adduct'].tolist(), ions['isotope'].tolist())):
+                    if not x % 10000:
                         mspy.mod_stopper.CHECK_FORCE_QUIT()
-                        adductFormula = FORMULAS.get(adduct, '')
-
-                        if adduct in ('[M+Li]+', '[M+Na-2H]-', '[M+K-2H]-', '[M+Na]+', '[M+K]+', '[M+NH4]+'):
-                            formula = '%s(%s)(H-1)' % (compound.expression, adductFormula)
-                        elif adduct in ('[M+Cl]-', '[M-CH3]-', '[M-C3H10N]-', '[M-C5H12N]-'):
-                            formula = '%s(%s)(H)' % (compound.expression, adductFormula)
-                        elif adduct in ('[2M+Na]+', '[2M+K]+', '[2M+NH4]+', '[2M+H]+', '[2M-H]-'):
-                            formula = '%s(%s)(H-1)' % (2 * compound.expression, adductFormula)
-                        elif adduct in ('[2M+Cl]-', '[2M+Na-2H]-', '[2M+K-2H]-'):
-                            formula = '%s(%s)(H)' % (2 * compound.expression, adductFormula)
-                        elif adduct in ('[M-H2O-H]-', '[M-H2O+H]+', '[+MeOH+H]+', '[+ACN+H]+', '[M+FMP10]+', '[M+2FMP10]+', '[M+2FMP10-CH3]+', '[M+AMPP]+', '[M+2AMPP]+', '[M+3AMPP]+'):
-                            formula = '%s(%s)' % (compound.expression, adductFormula)
-                        else:
-                            formula = '%s' % (compound.expression)
-
-                        adductCompound = mspy.obj_compound.compound(formula)
-                        if not adductCompound.isvalid():
-                            if save_cache:
-                                mark_config_invalid(name, compound.expression, adduct, z * polarity, None, config.compoundsSearch['massType'])
-                            continue
-
-                        ions = []
-                        mz = adductCompound.mz(z * polarity)[config.compoundsSearch['massType']]
-                        base_ion = CurrentCompound(name=name, mz=mz, z=z * polarity, adduct=adduct, formula=adductCompound.expression)
-                        ions.append(base_ion)
-
-                        for iso in config.compoundsSearch['isotopes']:
-                            if iso not in FORMULAS:
-                                continue
-                            iso_formula = '%s(%s)' % (formula, FORMULAS[iso])
-                            iso_comp = mspy.obj_compound.compound(iso_formula)
-                            if not iso_comp.isvalid():
-                                continue
-                            mz = iso_comp.mz(z * polarity)[config.compoundsSearch['massType']]
-                            ion = CurrentCompound(name=name, mz=mz, z=z * polarity, adduct=adduct, isotope=iso, formula=iso_comp.expression)
-                            ions.append(ion)
-
-                        iso_pairs = [(i1, i2) for i1 in ('(13)C1', '(13)C2', '(13)C3', '(13)C4', '(13)C5', '(13)C6')
-                                            for i2 in ('(15)N1', '(15)N2', '(15)N3', '(15)N4', '(15)N5', '(15)N6', '(15)N7', '(15)N8', '(15)N9')
-                                            if i1 in config.compoundsSearch['isotopes'] and i2 in config.compoundsSearch['isotopes']]
-                        for iso1, iso2 in iso_pairs:
-                            combo_formula = '%s(%s)(%s)' % (formula, FORMULAS[iso1], FORMULAS[iso2])
-                            combo_comp = mspy.obj_compound.compound(combo_formula)
-                            if not combo_comp.isvalid():
-                                continue
-                            mz = combo_comp.mz(z * polarity)[config.compoundsSearch['massType']]
-                            ion = CurrentCompound(name=name, mz=mz, z=z * polarity, adduct=adduct,
-                                                isotope=iso1 + iso2, formula=combo_comp.expression)
-                            ions.append(ion)
-
-                        self.currentCompounds.extend(ions)
-
-                        if save_cache:
-                            save_ions_to_cache(name, compound.expression, adduct, z * polarity, None, config.compoundsSearch['massType'], ions)
+                    isotope = ions['isotopes'][i] or None
+                    if loaded and (generator.names[c], z, ions['adducts'][a], isotope) in loaded:
+                        continue
+                    ion = CurrentCompound(name=generator.names[c], mz=mz, z=z, adduct=ions['adducts'][a], isotope=isotope, formula=formulas[x])
+                    self.currentCompounds.append(ion)
+
+                # append computed ions to cache
+                if saveCache and config.compoundsSearch.get('saveCache', 1):
+                    builder = ionStoreBuilder(config.compoundsSearch['massType'], charges, ions['adducts'], ions['isotopes'])
+                    ids = numpy.array([builder.addCompound(name, expression) for name, expression in zip(generator.names, generator.expressions)], dtype=numpy.int64)
+                    builder.addIons(ids[ions['compound']], ions['mz'], ions['charge'], ions['adduct'], ions['isotope'], formulas, ions['adducts'], ions['isotopes'])
+                    try:
+                        cache = ionCache()
+                        cache.append(builder)
+                        cache.close()
+                    except Exception as e:
+                        print('[cache] Failed to append ions: %s' % e)
 
         except mspy.mod_stopper.ForceQuit:
             self.currentCompounds = []
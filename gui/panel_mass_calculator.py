@@ -930,13 +930,17 @@ class panelMassCalculator(wx.MiniFrame):
             mass = self.currentCompound.mass()
             self.currentIons = [(0, mass[0], mass[1], 0, '[M]')]
             
+            # get m/z of all possible charges at once
+            charges = [i*config.massCalculator['ionseriesPolarity']*abs(config.massCalculator['ionseriesAgentCharge']) for i in range(1, 101)]
+            mzs = self.currentCompound.mzs(charges, agentFormula=config.massCalculator['ionseriesAgent'], agentCharge=config.massCalculator['ionseriesAgentCharge']).tolist()
+            
             # get ions
             i = 0
-            while True:
+            while i < len(charges):
                 
                 # get charge
                 i += 1
-                charge = i*config.massCalculator['ionseriesPolarity']*abs(config.massCalculator['ionseriesAgentCharge'])
+                charge = charges[i-1]
                 
                 # check ion
                 if not self.currentCompound.isvalid(charge=charge, agentFormula=config.massCalculator['ionseriesAgent'], agentCharge=config.massCalculator['ionseriesAgentCharge']):
@@ -953,7 +957,7 @@ class panelMassCalculator(wx.MiniFrame):
                     iontype = '[M-%d%s] %d-' % (i, config.massCalculator['ionseriesAgent'], abs(charge))
                 
                 # get mz
-                mz = mspy.mod_basics.mz(mass, charge=charge, agentFormula=config.massCalculator['ionseriesAgent'], agentCharge=config.massCalculator['ionseriesAgentCharge'])
+                mz = mzs[i-1]
                 
                 # add to list
                 self.currentIons.append((abs(charge), mz[0], mz[1], charge, iontype))
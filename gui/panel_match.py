@@ -608,6 +608,7 @@ class panelMatch(wx.MiniFrame):
         try:
             
             # set columns
+            measuredCol = None
             if self.currentModule == 'massfilter':
                 massCol = 1
                 chargeCol = None
@@ -651,32 +652,43 @@ class panelMatch(wx.MiniFrame):
             self.currentErrors = []
             self.currentCalibrationPoints = []
             
+            peakCharges = None
+            itemCharges = None
+            if chargeCol != None and not config.match['ignoreCharge']:
+                peakCharges = [peak.charge for peak in self.currentPeaklist]
+                itemCharges = [item[chargeCol] for item in self.currentData]
+            
+            peakIndexes, itemIndexes, errors = mspy.mod_match.matchmasses(
+                peakMasses = [peak.mz for peak in self.currentPeaklist],
+                masses = [item[massCol] for item in self.currentData],
+                tolerance = config.match['tolerance'],
+                units = config.match['units'],
+                peakCharges = peakCharges,
+                charges = itemCharges
+            )
+            
             digits = '%0.' + str(config.main['mzDigits']) + 'f'
-            for pIndex, peak in enumerate(self.currentPeaklist):
-                for x, item in enumerate(self.currentData):
-                    
+            for i, (pIndex, x, error) in enumerate(zip(peakIndexes.tolist(), itemIndexes.tolist(), errors.tolist())):
+                
+                if not i % 1000:
                     mspy.mod_stopper.CHECK_FORCE_QUIT()
-                    
-                    # check charge
-                    if (chargeCol==None or peak.charge==None or config.match['ignoreCharge'] or peak.charge==item[chargeCol]):
-                        
-                        # check mass tolerance
-                        error = mspy.mod_basics.delta(peak.mz, item[massCol], config.match['units'])
-                        if abs(error) <= config.match['tolerance']:
-                            
-                            # create new match object
-                            match = matchObject(label='', mz=peak.mz, ai=peak.ai, base=peak.base, theoretical=item[massCol])
-                            match.peakIndex = pIndex
-                            # $$
-                            self.currentData[x][matchCol].append(match)
-                            # $$
-                            if measuredCol is not None:
-                                self.currentData[x][measuredCol] = peak.mz
-
-                            # errors and calibration points
-                            label = 'Peak ' + digits % peak.mz
-                            self.currentErrors.append([peak.mz, error])
-                            self.currentCalibrationPoints.append([label, item[massCol], peak.mz])
+                
+                peak = self.currentPeaklist[pIndex]
+                item = self.currentData[x]
+                
+                # create new match object
+                match = matchObject(label='', mz=peak.mz, ai=peak.ai, base=peak.base, theoretical=item[massCol])
+                match.peakIndex = pIndex
+                # $$
+                item[matchCol].append(match)
+                # $$
+                if measuredCol is not None:
+                    item[measuredCol] = peak.mz
+                
+                # errors and calibration points
+                label = 'Peak ' + digits % peak.mz
+                self.currentErrors.append([peak.mz, error])
+                self.currentCalibrationPoints.append([label, item[massCol], peak.mz])
             
             # show best error only
             for item in self.currentData:
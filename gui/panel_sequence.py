@@ -2804,12 +2804,14 @@ class panelSequence(wx.MiniFrame):
             
             # calculate mz and check limits
             buff = []
+            charges = [z*polarity for z in range(1, maxCharge)]
             for peptide in peptides:
+                mzs = peptide.mzs(charges)[:, config.sequence['digest']['massType']].tolist()
                 for z in range(1, maxCharge):
                     
                     mspy.mod_stopper.CHECK_FORCE_QUIT()
                     
-                    mz = peptide.mz(z*polarity)[config.sequence['digest']['massType']]
+                    mz = mzs[z-1]
                     if mz >= config.sequence['digest']['lowMass'] and mz <= config.sequence['digest']['highMass']:
                         buff.append([
                             peptide.history,
@@ -2936,22 +2938,25 @@ class panelSequence(wx.MiniFrame):
             
             # calculate mz and store fragments
             buff = []
+            charges = [z*polarity for z in range(1, maxCharge)]
             for fragment in fragments:
+                if config.sequence['fragment']['filterFragments'] and fragment.fragmentFiltered:
+                    continue
+                mzs = fragment.mzs(charges)[:, config.sequence['fragment']['massType']].tolist()
                 for z in range(1, maxCharge):
                     
                     mspy.mod_stopper.CHECK_FORCE_QUIT()
                     
-                    if not config.sequence['fragment']['filterFragments'] or not fragment.fragmentFiltered:
-                        buff.append([
-                            fragment.format('f'),
-                            fragment.history,
-                            fragment.mz(z*polarity)[config.sequence['fragment']['massType']],
-                            z*polarity,
-                            fragment.format(template),
-                            None,
-                            fragment,
-                            [],
-                        ])
+                    buff.append([
+                        fragment.format('f'),
+                        fragment.history,
+                        mzs[z-1],
+                        z*polarity,
+                        fragment.format(template),
+                        None,
+                        fragment,
+                        [],
+                    ])
             
             self.currentFragments = buff
         
@@ -29,12 +29,14 @@ from . import obj_sequence #import *
 from . import obj_peak #import *
 from . import obj_peaklist #import *
 from . import obj_scan #import *
+from . import obj_accumulator #import *
 
 # load modules
 from . import mod_basics #import *
 from . import mod_pattern #import *
 from . import mod_signal #import *
 from . import mod_calibration #import *
+from . import mod_match #import *
 from . import mod_peakpicking #import *
 from . import mod_proteo #import *
 from . import mod_formulator #import *
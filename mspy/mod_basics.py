@@ -18,6 +18,8 @@
 # load libs
 import math
 import re
+import functools
+import numpy
 
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
@@ -52,6 +54,16 @@ ELEMENT_PATTERN = re.compile(r'''
             ([\-]?[\d]*) # atom count
 ''', re.X)
 
+FORMULA_TOKEN_PATTERN = re.compile(r'''
+    ([A-Z][a-z]{0,2}) # atom symbol
+    (?:\{([\d]+)\})? # isotope
+    ([\-][\d]+|[\d]*) # atom count
+    |(\() # start parenthesis
+    |\)([\d]*) # end parenthesis and multiplier
+''', re.X)
+
+FORMULA_CACHE_SIZE = 65536
+
 
 # BASIC FUNCTIONS
 # ---------------
@@ -118,6 +130,77 @@ def mz(mass, charge, currentCharge=0, agentFormula='H', agentCharge=1, massType=
 # ----
 
 
+def mzarray(masses, charges, currentCharges=0, agentFormula='H', agentCharge=1, massType=0):
+    """Calculate m/z values for arrays of masses and charges in one pass.
+        masses (array of (Mo, Av) or array of floats) - current masses
+        charges (int or array of int) - final charges of ions
+        currentCharges (int or array of int) - current masses charges
+        agentFormula (str, mspy.compound or list of them) - charging agent formula, one for all or one per mass
+        agentCharge (int or array of int) - charging agent unit charge
+        massType (0 or 1) - used mass type if masses are floats, 0 = monoisotopic, 1 = average
+    Returns numpy array of the same shape as masses, zero charge gives neutral masses.
+    """
+    
+    masses = numpy.asarray(masses, dtype=numpy.float64)
+    charges = numpy.asarray(charges, dtype=numpy.float64)
+    currentCharges = numpy.asarray(currentCharges, dtype=numpy.float64)
+    agentCharge = numpy.asarray(agentCharge, dtype=numpy.float64)
+    
+    # get agent masses
+    agentMass = _agentmasses(agentFormula, agentCharge)
+    
+    # align per-ion values with (Mo, Av) columns
+    if masses.ndim == 2:
+        charges = charges[..., None]
+        currentCharges = currentCharges[..., None]
+        agentCharge = agentCharge[..., None]
+    else:
+        agentMass = agentMass[..., massType]
+    
+    # recalculate zero charge
+    masses = numpy.where(currentCharges != 0, masses*numpy.abs(currentCharges) - agentMass*(currentCharges/agentCharge), masses)
+    
+    # calculate final charge
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ions = (masses + agentMass*(charges/agentCharge)) / numpy.abs(charges)
+    
+    return numpy.where(charges != 0, ions, masses)
+# ----
+
+
+def _agentmasses(agentFormula, agentCharge):
+    """Get (Mo, Av) masses of charging agents without electrons."""
+    
+    # get unique formulas
+    if isinstance(agentFormula, (list, tuple, numpy.ndarray)):
+        formulas = list(agentFormula)
+    else:
+        formulas = [agentFormula]
+    
+    buff = {}
+    for formula in formulas:
+        key = formula.expression if isinstance(formula, obj_compound.compound) else formula
+        if key in buff:
+            continue
+        if formula == 'e':
+            buff[key] = (ELECTRON_MASS, ELECTRON_MASS, 0.)
+        else:
+            if not isinstance(formula, obj_compound.compound):
+                formula = obj_compound.compound(formula)
+            buff[key] = formula.mass() + (1.,)
+    
+    # get masses
+    agentMasses = numpy.array([buff[f.expression if isinstance(f, obj_compound.compound) else f] for f in formulas], dtype=numpy.float64)
+    if not isinstance(agentFormula, (list, tuple, numpy.ndarray)):
+        agentMasses = agentMasses[0]
+    
+    # remove electrons of agent charge
+    electrons = agentMasses[..., 2] * agentCharge * ELECTRON_MASS
+    
+    return agentMasses[..., :2] - electrons[..., None]
+# ----
+
+
 def md(mass, mdType='standard', kendrickFormula='CH2', rounding='floor'):
     """Calculate mass defect for given monoisotopic mass.
         mass (float) - monoisotopic mass
@@ -177,6 +260,69 @@ def nominalmass(mass, rounding='floor'):
 # FORMULA FUNCTIONS
 # -----------------
 
+@functools.lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def parseformula(expression):
+    """Check formula and get its composition in single pass.
+    Results are cached for the whole process, so repeated formulas are never
+    parsed twice. Returned composition is immutable tuple of (atom, count)
+    pairs in order of first appearance with zero counts removed.
+        expression (str) - formula
+    """
+    
+    stack = [{}]
+    previous = None
+    position = 0
+    
+    while position < len(expression):
+        
+        # get token
+        match = FORMULA_TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError('Wrong formula! --> ' + expression)
+        symbol, isotope, count, opening, multiplier = match.groups()
+        position = match.end()
+        
+        # add atom
+        if symbol:
+            if not symbol in blocks.elements:
+                raise ValueError('Unknown element in formula! --> ' + symbol + ' in ' + expression)
+            if isotope:
+                if not int(isotope) in blocks.elements[symbol].isotopes:
+                    raise ValueError('Unknown isotope in formula! --> ' + symbol + isotope + ' in ' + expression)
+                symbol = '%s{%s}' % (symbol, isotope)
+            
+            counts = stack[-1]
+            counts[symbol] = counts.get(symbol, 0) + (int(count) if count else 1)
+            previous = 'atom'
+        
+        # open brackets
+        elif opening:
+            stack.append({})
+            previous = '('
+        
+        # close brackets and multiply enclosed atoms
+        else:
+            if previous == '(' or previous is None:
+                raise ValueError('Wrong formula! --> ' + expression)
+            if len(stack) == 1:
+                raise ValueError('Wrong number of brackets in formula! --> ' + expression)
+            
+            enclosed = stack.pop()
+            counts = stack[-1]
+            multiplier = int(multiplier) if multiplier else 1
+            if multiplier:
+                for atom, count in enclosed.items():
+                    counts[atom] = counts.get(atom, 0) + count * multiplier
+            previous = ')'
+    
+    # check brackets
+    if len(stack) != 1:
+        raise ValueError('Wrong number of brackets in formula! --> ' + expression)
+    
+    return tuple((atom, count) for atom, count in stack[0].items() if count != 0)
+# ----
+
+
 def rdbe(compound):
     """Get RDBE (Range or Double Bonds Equivalents) of a given compound.
         compound (str or mspy.compound) - compound
@@ -0,0 +1,113 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import numpy
+
+# load stopper
+from .mod_stopper import CHECK_FORCE_QUIT
+
+
+# MASS MATCHING
+# -------------
+
+def matchmasses(peakMasses, masses, tolerance, units='ppm', peakCharges=None, charges=None):
+    """Find all pairs of measured and theoretical masses within given tolerance.
+    Theoretical masses are sorted once and tolerance window of each peak is
+    resolved by binary search, so matching costs O((P + I) log I).
+        peakMasses (list of floats) - measured masses
+        masses (list of floats) - theoretical masses
+        tolerance (float) - max error in specified units
+        units (Da, ppm or %) - error units
+        peakCharges (list of int or None) - measured charges, None to ignore charge
+        charges (list of int or None) - theoretical charges, None to ignore charge
+    Returns arrays of peak indexes, item indexes and errors, sorted by peak and item index.
+    """
+
+    # check units
+    if not units in ('Da', 'ppm', '%'):
+        raise ValueError('Unknown units for delta! -->' + units)
+    scale = {'Da': None, 'ppm': 1000000, '%': 100}[units]
+
+    peakMasses = numpy.asarray(peakMasses, dtype=numpy.float64)
+    masses = numpy.asarray(masses, dtype=numpy.float64)
+
+    empty = (numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.float64))
+    if not len(peakMasses) or not len(masses):
+        return empty
+
+    # sort theoretical masses
+    order = numpy.argsort(masses, kind='mergesort')
+    sortedMasses = masses[order]
+
+    # get search window of each peak
+    if scale is None:
+        lowMasses = peakMasses - tolerance
+        highMasses = peakMasses + tolerance
+    else:
+        relTolerance = float(tolerance) / scale
+        lowMasses = peakMasses / (1 + relTolerance)
+        if relTolerance < 1:
+            highMasses = peakMasses / (1 - relTolerance)
+        else:
+            highMasses = numpy.full(len(peakMasses), numpy.inf)
+
+    # widen windows for rounding errors, exact errors are checked later
+    margin = 1e-9 * numpy.maximum(numpy.abs(peakMasses), 1.)
+    lo = numpy.searchsorted(sortedMasses, lowMasses - margin, side='left')
+    hi = numpy.searchsorted(sortedMasses, highMasses + margin, side='right')
+
+    CHECK_FORCE_QUIT()
+
+    # expand windows into candidate pairs
+    counts = hi - lo
+    total = int(counts.sum())
+    if not total:
+        return empty
+
+    peakIndexes = numpy.repeat(numpy.arange(len(peakMasses)), counts)
+    starts = numpy.repeat(lo - numpy.concatenate(([0], numpy.cumsum(counts)[:-1])), counts)
+    itemIndexes = order[starts + numpy.arange(total)]
+
+    CHECK_FORCE_QUIT()
+
+    # calculate errors
+    measured = peakMasses[peakIndexes]
+    counted = masses[itemIndexes]
+    if scale is None:
+        errors = measured - counted
+    else:
+        errors = (measured - counted) / counted * scale
+
+    mask = numpy.abs(errors) <= tolerance
+
+    # check charges
+    if peakCharges is not None and charges is not None:
+        peakCharges = numpy.array([numpy.nan if z is None else z for z in peakCharges], dtype=numpy.float64)
+        charges = numpy.array([numpy.nan if z is None else z for z in charges], dtype=numpy.float64)
+        pz = peakCharges[peakIndexes]
+        mask &= numpy.isnan(pz) | (pz == charges[itemIndexes])
+
+    peakIndexes = peakIndexes[mask]
+    itemIndexes = itemIndexes[mask]
+    errors = errors[mask]
+
+    # sort by peak and item
+    order = numpy.lexsort((itemIndexes, peakIndexes))
+
+    return peakIndexes[order], itemIndexes[order], errors[order]
+# ----
@@ -17,7 +17,12 @@
 
 # load libs
 import math
+import time
 import numpy
+import sqlite3
+import hashlib
+import threading
+import collections
 
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
@@ -36,10 +41,18 @@ from . import mod_signal
 from . import mod_peakpicking
 
 
+# PATTERN CACHE SETTINGS
+# ----------------------
+
+PATTERN_CACHE_SIZE = 4096
+PATTERN_CACHE_DISK_SIZE = 200000
+PATTERN_CACHE_VERSION = 3
+
+
 # ISOTOPIC PATTERN FUNCTIONS
 # --------------------------
 
-def pattern(compound, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True, model='gaussian'):
+def pattern(compound, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True, model='gaussian', method='classic', cache=True):
     """Calculate isotopic pattern for given compound.
         compound (str or mspy.compound) - compound
         fwhm (float) - gaussian peak width
@@ -49,6 +62,8 @@ def pattern(compound, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agen
         agentCharge (int) - charging agent unit charge
         real (bool) - get real peaks from calculated profile
         model (gaussian, lorentzian, gausslorentzian) - peak shape function
+        method (classic or fast) - add atoms one by one or by element powers
+        cache (bool) - use pattern cache
     """
     
     # check compound
@@ -61,10 +76,8 @@ def pattern(compound, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agen
     
     # add charging agent to compound
     if charge and agentFormula != 'e':
-        formula = compound.formula()
-        for atom, count in agentFormula.composition().items():
-            formula += '%s%d' % (atom, count*(charge/agentCharge))
-        compound = obj_compound.compound(formula)
+        formula = ''.join(['%s%d' % (atom, count*(charge/agentCharge)) for atom, count in agentFormula.composition().items()])
+        compound = obj_compound.compound(compound.formula()) + formula
     
     # get composition and check for negative atom counts
     composition = compound.composition()
@@ -72,54 +85,34 @@ def pattern(compound, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agen
         if composition[atom] < 0:
             raise ValueError('Pattern cannot be calculated for this formula! --> ' + compound.formula())
     
+    # calculate pattern or get it from cache
+    if not cache:
+        return _calculate(composition, fwhm, threshold, charge, real, model, method)
+    
+    key = PATTERN_CACHE.key(composition, fwhm, threshold, charge, real, model, method)
+    finalPattern = PATTERN_CACHE.get(key)
+    if finalPattern is None:
+        finalPattern = _calculate(composition, fwhm, threshold, charge, real, model, method)
+        PATTERN_CACHE.set(key, finalPattern)
+    
+    return [list(peak) for peak in finalPattern]
+# ----
+
+
+def _calculate(composition, fwhm, threshold, charge, real, model, method):
+    """Calculate isotopic pattern for given composition."""
+    
     # set internal thresholds
     internalThreshold = threshold/100.
     groupingWindow = fwhm/4.
     
     # calculate pattern
-    finalPattern = []
-    for atom in composition:
-        
-        # get isotopic profile for current atom or specified isotope only
-        atomCount = composition[atom]
-        atomPattern = []
-        match = mod_basics.ELEMENT_PATTERN.match(atom)
-        symbol, massNumber, tmp = match.groups()
-        if massNumber:
-            isotope = blocks.elements[symbol].isotopes[int(massNumber)]
-            atomPattern.append([isotope[0], 1.]) # [mass, abundance]
-        else:
-            for massNumber, isotope in blocks.elements[atom].isotopes.items():
-                if isotope[1] > 0.:
-                    atomPattern.append(list(isotope)) # [mass, abundance]
-        
-        # add atoms
-        for i in range(atomCount):
-            
-            CHECK_FORCE_QUIT()
-            
-            # if pattern is empty (first atom) add current atom pattern
-            if len(finalPattern) == 0:
-                finalPattern = _normalize(atomPattern)
-                continue
-            
-            # add atom to each peak of final pattern
-            currentPattern = []
-            for patternIsotope in finalPattern:
-                
-                # skip peak under relevant abundance threshold
-                if patternIsotope[1] < internalThreshold:
-                    continue
-                
-                # add each isotope of current atom to peak
-                for atomIsotope in atomPattern:
-                    mass = patternIsotope[0] + atomIsotope[0]
-                    abundance = patternIsotope[1] * atomIsotope[1]
-                    currentPattern.append([mass, abundance])
-            
-            # group isotopes and normalize pattern
-            finalPattern = _consolidate(currentPattern, groupingWindow)
-            finalPattern = _normalize(finalPattern)
+    if method == 'classic':
+        finalPattern = _classic(composition, internalThreshold, groupingWindow)
+    elif method == 'fast':
+        finalPattern = _fast(composition, internalThreshold, groupingWindow)
+    else:
+        raise ValueError('Unknown pattern method! --> ' + method)
     
     # correct charge
     if charge:
@@ -301,6 +294,140 @@ def matchpattern(signal, pattern, pickingHeight=0.75, baseline=None):
 # ----
 
 
+def _classic(composition, internalThreshold, groupingWindow):
+    """Calculate isotopes by adding atoms one by one.
+        composition (dict) - atom counts
+        internalThreshold (float) - relative abundance of peaks to skip
+        groupingWindow (float) - isotopes grouping window
+    """
+    
+    finalPattern = []
+    for atom in composition:
+        
+        # get isotopic profile for current atom or specified isotope only
+        atomCount = composition[atom]
+        atomPattern = _isotopes(atom)
+        
+        # add atoms
+        for i in range(atomCount):
+            
+            CHECK_FORCE_QUIT()
+            
+            # if pattern is empty (first atom) add current atom pattern
+            if len(finalPattern) == 0:
+                finalPattern = _normalize(atomPattern)
+                continue
+            
+            # add atom to each peak of final pattern
+            currentPattern = []
+            for patternIsotope in finalPattern:
+                
+                # skip peak under relevant abundance threshold
+                if patternIsotope[1] < internalThreshold:
+                    continue
+                
+                # add each isotope of current atom to peak
+                for atomIsotope in atomPattern:
+                    mass = patternIsotope[0] + atomIsotope[0]
+                    abundance = patternIsotope[1] * atomIsotope[1]
+                    currentPattern.append([mass, abundance])
+            
+            # group isotopes and normalize pattern
+            finalPattern = _consolidate(currentPattern, groupingWindow)
+            finalPattern = _normalize(finalPattern)
+    
+    return finalPattern
+# ----
+
+
+def _fast(composition, internalThreshold, groupingWindow):
+    """Calculate isotopes by raising each element pattern to its atom count.
+    Powers are made by repeated squaring, so each element needs about
+    2*log2(count) convolutions of grouped isotopes instead of count.
+        composition (dict) - atom counts
+        internalThreshold (float) - relative abundance of peaks to skip
+        groupingWindow (float) - isotopes grouping window
+    """
+    
+    finalPattern = None
+    for atom in composition:
+        
+        atomCount = composition[atom]
+        atomPattern = numpy.array(_normalize(_isotopes(atom)), dtype=numpy.float64)
+        
+        # exponentiation by squaring
+        while atomCount:
+            
+            CHECK_FORCE_QUIT()
+            
+            if atomCount & 1:
+                if finalPattern is None:
+                    finalPattern = atomPattern
+                else:
+                    finalPattern = _convolve(finalPattern, atomPattern, internalThreshold, groupingWindow)
+            
+            atomCount >>= 1
+            if atomCount:
+                atomPattern = _convolve(atomPattern, atomPattern, internalThreshold, groupingWindow)
+    
+    if finalPattern is None:
+        return []
+    
+    return finalPattern.tolist()
+# ----
+
+
+def _isotopes(atom):
+    """Get isotopes of given atom as list of [mass, abundance].
+        atom (str) - element symbol, with mass number for specified isotope
+    """
+    
+    atomPattern = []
+    
+    match = mod_basics.ELEMENT_PATTERN.match(atom)
+    symbol, massNumber, tmp = match.groups()
+    if massNumber:
+        isotope = blocks.elements[symbol].isotopes[int(massNumber)]
+        atomPattern.append([isotope[0], 1.]) # [mass, abundance]
+    else:
+        for massNumber, isotope in blocks.elements[atom].isotopes.items():
+            if isotope[1] > 0.:
+                atomPattern.append(list(isotope)) # [mass, abundance]
+    
+    return atomPattern
+# ----
+
+
+def _convolve(pattern1, pattern2, internalThreshold, groupingWindow):
+    """Combine two normalized isotope arrays, group and normalize result.
+        pattern1, pattern2 (numpy array) - [mass, abundance] rows
+        internalThreshold (float) - relative abundance of peaks to skip
+        groupingWindow (float) - isotopes grouping window
+    """
+    
+    # skip peaks under relevant abundance threshold
+    pattern1 = pattern1[pattern1[:,1] >= internalThreshold]
+    pattern2 = pattern2[pattern2[:,1] >= internalThreshold]
+    
+    # combine all peaks
+    masses = numpy.add.outer(pattern1[:,0], pattern2[:,0]).ravel()
+    abundances = numpy.multiply.outer(pattern1[:,1], pattern2[:,1]).ravel()
+    
+    # group peaks closer than window
+    order = numpy.argsort(masses, kind='mergesort')
+    masses = masses[order]
+    abundances = abundances[order]
+    
+    starts = numpy.flatnonzero(numpy.diff(masses) > groupingWindow) + 1
+    starts = numpy.concatenate(([0], starts))
+    
+    abundance = numpy.add.reduceat(abundances, starts)
+    mass = numpy.add.reduceat(masses * abundances, starts) / abundance
+    
+    return numpy.column_stack((mass, abundance / abundance.max()))
+# ----
+
+
 def _consolidate(isotopes, window):
     """Group peaks within specified window.
         isotopes: (list of [mass, abundance]) isotopes list
@@ -349,3 +476,196 @@ def _normalize(data):
 # ----
 
 
+
+
+# PATTERN CACHE
+# -------------
+
+class patterncache():
+    """Isotopic pattern cache with in-memory LRU and optional disk storage.
+        size (int) - max number of patterns kept in memory
+        path (str) - SQLite file of disk storage, None to keep memory only
+        diskSize (int) - max number of patterns kept on disk
+    """
+    
+    def __init__(self, size=PATTERN_CACHE_SIZE, path=None, diskSize=PATTERN_CACHE_DISK_SIZE):
+        
+        self.size = size
+        self.diskSize = diskSize
+        self.path = None
+        
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._rows = 0
+        
+        if path:
+            self.setstorage(path)
+    # ----
+    
+    
+    def __len__(self):
+        return len(self._items)
+    # ----
+    
+    
+    def key(self, composition, fwhm, threshold, charge, real, model, method='classic'):
+        """Make cache key for pattern parameters.
+        Charging agent is already included in composition. Isotopes of
+        used elements are fingerprinted so that patterns calculated with
+        different element table are not reused."""
+        
+        composition = [item for item in sorted(composition.items()) if item[1]]
+        
+        # fingerprint isotopes of used elements
+        elements = [mod_basics.ELECTRON_MASS]
+        for symbol in sorted(set(mod_basics.ELEMENT_PATTERN.match(atom).group(1) for atom, count in composition)):
+            elements.append((symbol, sorted(blocks.elements[symbol].isotopes.items())))
+        elements = hashlib.sha1(repr(elements).encode('utf-8')).hexdigest()[:16]
+        
+        composition = ''.join(['%s%d' % item for item in composition])
+        return '%s|%r|%r|%r|%d|%s|%s|%s' % (composition, float(fwhm), float(threshold), float(charge), bool(real), model, method, elements)
+    # ----
+    
+    
+    def get(self, key):
+        """Get cached pattern or None."""
+        
+        with self._lock:
+            
+            # memory
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+            
+            # disk
+            if self._db is None:
+                return None
+            
+            try:
+                row = self._db.execute('SELECT data FROM patterns WHERE key=?', (key,)).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE patterns SET used=? WHERE key=?', (time.time(), key))
+                    self._db.commit()
+            except sqlite3.Error:
+                return None
+            
+            if row is None:
+                return None
+            
+            data = numpy.frombuffer(row[0], dtype=numpy.float64).reshape(-1, 2)
+            self._remember(key, tuple(tuple(peak) for peak in data.tolist()))
+            return self._items[key]
+    # ----
+    
+    
+    def set(self, key, pattern):
+        """Store pattern in memory and on disk."""
+        
+        pattern = tuple(tuple(peak) for peak in pattern)
+        
+        with self._lock:
+            self._remember(key, pattern)
+            
+            if self._db is None:
+                return
+            
+            data = numpy.array(pattern, dtype=numpy.float64).reshape(-1, 2).tobytes()
+            try:
+                self._db.execute('INSERT OR REPLACE INTO patterns (key, data, used) VALUES (?, ?, ?)', (key, data, time.time()))
+                self._db.commit()
+                self._rows += 1
+                if self._rows > self.diskSize:
+                    self._trim()
+            except sqlite3.Error:
+                pass
+    # ----
+    
+    
+    def clear(self, disk=False):
+        """Clear memory patterns and optionally disk storage."""
+        
+        with self._lock:
+            self._items.clear()
+            
+            if disk and self._db is not None:
+                try:
+                    self._db.execute('DELETE FROM patterns')
+                    self._db.commit()
+                    self._rows = 0
+                except sqlite3.Error:
+                    pass
+    # ----
+    
+    
+    def setstorage(self, path):
+        """Set disk storage file, None to disable it."""
+        
+        with self._lock:
+            
+            # close current
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+                self.path = None
+            
+            if not path:
+                return
+            
+            # open storage, rebuild it if made by different version
+            db = sqlite3.connect(path, timeout=5., check_same_thread=False)
+            try:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('PRAGMA synchronous=NORMAL')
+                db.execute('CREATE TABLE IF NOT EXISTS info (version INTEGER)')
+                row = db.execute('SELECT version FROM info').fetchone()
+                if row is None or row[0] != PATTERN_CACHE_VERSION:
+                    db.execute('DROP TABLE IF EXISTS patterns')
+                    db.execute('DELETE FROM info')
+                    db.execute('INSERT INTO info (version) VALUES (?)', (PATTERN_CACHE_VERSION,))
+                db.execute('CREATE TABLE IF NOT EXISTS patterns (key TEXT PRIMARY KEY, data BLOB, used REAL)')
+                db.execute('CREATE INDEX IF NOT EXISTS patterns_used ON patterns (used)')
+                db.commit()
+                self._rows = db.execute('SELECT COUNT(*) FROM patterns').fetchone()[0]
+            except sqlite3.Error:
+                db.close()
+                raise
+            
+            self._db = db
+            self.path = path
+            
+            # apply size limit
+            if self._rows > self.diskSize:
+                self._trim()
+    # ----
+    
+    
+    def _remember(self, key, pattern):
+        """Store pattern in memory, drop least recently used."""
+        
+        self._items[key] = pattern
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+    # ----
+    
+    
+    def _trim(self):
+        """Drop least recently used patterns from disk storage.
+        Tenth of the limit is freed at once to keep trimming rare."""
+        
+        # rows may be added by other processes
+        self._rows = self._db.execute('SELECT COUNT(*) FROM patterns').fetchone()[0]
+        excess = self._rows - self.diskSize
+        if excess <= 0:
+            return
+        
+        excess += self.diskSize // 10
+        self._db.execute('DELETE FROM patterns WHERE key IN (SELECT key FROM patterns ORDER BY used LIMIT ?)', (excess,))
+        self._db.commit()
+        self._rows = self._db.execute('SELECT COUNT(*) FROM patterns').fetchone()[0]
+    # ----
+    
+
+
+PATTERN_CACHE = patterncache()
@@ -17,6 +17,7 @@
 
 # load libs
 import copy
+import collections
 import math
 import numpy
 import time
@@ -43,6 +44,14 @@ from . import mod_signal
 ISOTOPE_DISTANCE = 1.00287
 AVERAGE_AMINO = {'C':4.9384, 'H':7.7583, 'N':1.3577, 'O':1.4773, 'S':0.0417}
 AVERAGE_BASE = {'C':9.75, 'H':12.25, 'N':3.75, 'O':6, 'P':1}
+LABELSCAN_CHUNK = 10000
+
+AVERAGINE_STEP = 10 # Da per averagine pattern bin
+AVERAGINE_MAX_MASS = 100000
+AVERAGINE_THRESHOLD = 0.001
+
+# calculated averagine bins
+_AVERAGINE_BINS = {}
 
 
 # PEAK PICKING FUNCTIONS
@@ -227,118 +236,105 @@ def labelscan(signal, minX=None, maxX=None, pickingHeight=0.75, absThreshold=0.,
         return obj_peaklist.peaklist([])
     
     # get local maxima
-    buff = []
     basepeak = mod_signal.basepeak(signal)
     threshold = max(signal[basepeak][1] * relThreshold, absThreshold)
-    for peak in mod_signal.maxima(signal):
-        if peak[1] >= threshold:
-            buff.append( [peak[0], peak[1], 0., None, None] ) # mz, ai, base, sn, fwhm
+    maxima = mod_signal.maxima(signal).reshape(-1, 2)
+    maxima = maxima[maxima[:,1] >= threshold]
+    
+    mzs = maxima[:,0].copy()
+    ais = maxima[:,1].copy()
     
     CHECK_FORCE_QUIT()
     
     # get peaks baseline and s/n
-    basepeak = 0.0
-    if not isinstance(baseline, type(None)):
-        for peak in buff:
-            idx = mod_signal.locate(baseline, peak[0])
-            if (idx > 0) and (idx < len(baseline)):
-                p1 = baseline[idx-1]
-                p2 = baseline[idx]
-                peak[2] = mod_signal.interpolate( (p1[0], p1[1]), (p2[0], p2[1]), x=peak[0])
-                noise = mod_signal.interpolate( (p1[0], p1[2]), (p2[0], p2[2]), x=peak[0])
-                intens = peak[1] - peak[2]
-                if noise:
-                    peak[3] = intens / noise
-                if intens > basepeak:
-                    basepeak = intens
+    bases = numpy.zeros(len(mzs))
+    sns = numpy.full(len(mzs), numpy.nan) # NaN for unknown s/n
+    basepeak = _labelbase(mzs, ais, bases, sns, baseline)
     
     CHECK_FORCE_QUIT()
     
     # remove peaks bellow threshold
     threshold = max(basepeak * relThreshold, absThreshold)
-    candidates = []
-    for peak in buff:
-        if peak[0] > 0 and (peak[1] - peak[2]) >= threshold and (not peak[3] or peak[3] >= snThreshold):
-            candidates.append(peak)
+    keep = (mzs > 0) & ((ais - bases) >= threshold) & (numpy.isnan(sns) | (sns == 0) | (sns >= snThreshold))
+    mzs = mzs[keep]
+    ais = ais[keep]
+    bases = bases[keep]
+    sns = sns[keep]
     
     # make centroides
-    if pickingHeight < 1.:
-        buff = []
-        previous = None
-        for peak in candidates:
+    if pickingHeight < 1. and len(mzs):
+        
+        # get centroids and intensities in chunks
+        lefts = numpy.zeros(len(mzs))
+        rights = numpy.zeros(len(mzs))
+        keep = numpy.zeros(len(mzs), dtype=bool)
+        for i in range(0, len(mzs), LABELSCAN_CHUNK):
             
             CHECK_FORCE_QUIT()
             
-            # calc peak height
-            h = ((peak[1]-peak[2]) * pickingHeight) + peak[2]
-            
-            # get centroid indexes
-            idx = mod_signal.locate(signal, peak[0])
-            if (idx == 0) or (idx == len(signal)):
-                continue
-            
-            ileft = idx-1
-            while (ileft > 0) and (signal[ileft][1] > h):
-                ileft -= 1
-            
-            iright = idx
-            while (iright < len(signal)-1) and (signal[iright][1] > h):
-                iright += 1
-            
-            # calculate peak mz
-            leftMZ = mod_signal.interpolate(signal[ileft], signal[ileft+1], y=h)
-            rightMZ = mod_signal.interpolate(signal[iright-1], signal[iright], y=h)
-            peak[0] = (leftMZ + rightMZ)/2.
-            
-            # get peak intensity
-            intens = mod_signal.intensity(signal, peak[0])
-            if intens and intens <= peak[1]:
-                peak[1] = intens
-            else:
-                continue
+            chunk = slice(i, i+LABELSCAN_CHUNK)
+            heights = ((ais[chunk] - bases[chunk]) * pickingHeight) + bases[chunk]
+            valid, lefts[chunk], rights[chunk] = _labeledges(signal, mzs[chunk], heights)
+            mzs[chunk] = (lefts[chunk] + rights[chunk])/2.
             
-            # try to group with previous peak
-            if previous is not None and leftMZ < previous:
-                if peak[1] > buff[-1][1]:
-                    buff[-1] = peak
-                    previous = rightMZ
+            intens = _labelintensity(signal, mzs[chunk])
+            keep[chunk] = valid & (intens != 0) & (intens <= ais[chunk])
+            ais[chunk] = numpy.where(keep[chunk], intens, ais[chunk])
+        
+        CHECK_FORCE_QUIT()
+        
+        # group overlapping peaks, keep the highest one
+        indexes = []
+        previous = None
+        leftMZs = lefts.tolist()
+        rightMZs = rights.tolist()
+        intensities = ais.tolist()
+        for i in numpy.flatnonzero(keep).tolist():
+            if previous is not None and leftMZs[i] < previous:
+                if intensities[i] > intensities[indexes[-1]]:
+                    indexes[-1] = i
+                    previous = rightMZs[i]
             else:
-                buff.append(peak)
-                previous = rightMZ
+                indexes.append(i)
+                previous = rightMZs[i]
         
         # store as candidates
-        candidates = buff
+        mzs = mzs[indexes]
+        ais = ais[indexes]
+        bases = bases[indexes]
+        sns = sns[indexes]
     
     CHECK_FORCE_QUIT()
     
     # get peaks baseline and s/n
-    basepeak = 0.0
-    if not isinstance(baseline, type(None)):
-        for peak in candidates:
-            idx = mod_signal.locate(baseline, peak[0])
-            if (idx > 0) and (idx < len(baseline)):
-                p1 = baseline[idx-1]
-                p2 = baseline[idx]
-                peak[2] = mod_signal.interpolate( (p1[0], p1[1]), (p2[0], p2[1]), x=peak[0])
-                noise = mod_signal.interpolate( (p1[0], p1[2]), (p2[0], p2[2]), x=peak[0])
-                intens = peak[1] - peak[2]
-                if noise:
-                    peak[3] = intens / noise
-                if intens > basepeak:
-                    basepeak = intens
+    basepeak = _labelbase(mzs, ais, bases, sns, baseline)
     
     CHECK_FORCE_QUIT()
     
-    # remove peaks bellow threshold and calculate fwhm
+    # remove peaks bellow threshold
     threshold = max(basepeak * relThreshold, absThreshold)
-    centroides = []
-    for peak in candidates:
-        if peak[0] > 0 and (peak[1] - peak[2]) >= threshold and (not peak[3] or peak[3] >= snThreshold):
-            peak[4] = mod_signal.width(signal, peak[0], (peak[2] + ((peak[1] - peak[2]) * 0.5)))
-            centroides.append(obj_peak.peak(mz=peak[0], ai=peak[1], base=peak[2], sn=peak[3], fwhm=peak[4]))
+    keep = (mzs > 0) & ((ais - bases) >= threshold) & (numpy.isnan(sns) | (sns == 0) | (sns >= snThreshold))
+    mzs = mzs[keep]
+    ais = ais[keep]
+    bases = bases[keep]
+    sns = sns[keep]
+    
+    # calculate fwhm
+    fwhms = numpy.zeros(len(mzs))
+    for i in range(0, len(mzs), LABELSCAN_CHUNK):
+        
+        CHECK_FORCE_QUIT()
+        
+        chunk = slice(i, i+LABELSCAN_CHUNK)
+        heights = bases[chunk] + ((ais[chunk] - bases[chunk]) * 0.5)
+        valid, leftMZs, rightMZs = _labeledges(signal, mzs[chunk], heights)
+        fwhms[chunk] = numpy.where(valid, numpy.abs(rightMZs - leftMZs), 0.)
+    
+    # make peaklist
+    centroides = numpy.column_stack((mzs, ais, bases, sns, fwhms))
     
     # return peaklist object
-    return obj_peaklist.peaklist(centroides)
+    return obj_peaklist.peaklist(centroides, columns=('mz', 'ai', 'base', 'sn', 'fwhm'))
 # ----
 
 
@@ -483,11 +479,6 @@ def deisotope(peaklist, maxCharge=1, mzTolerance=0.15, intTolerance=0.5, isotope
     if not isinstance(peaklist, obj_peaklist.peaklist):
         raise TypeError("Peak list must be mspy.peaklist object!")
     
-    # clear previous results
-    for peak in peaklist:
-        peak.setcharge(None)
-        peak.setisotope(None)
-    
     # get charges
     if maxCharge < 0:
         charges = [-x for x in range(1, abs(maxCharge)+1)]
@@ -495,79 +486,66 @@ def deisotope(peaklist, maxCharge=1, mzTolerance=0.15, intTolerance=0.5, isotope
         charges = [x for x in range(1, maxCharge+1)]
     charges.reverse()
     
-    # walk in a peaklist
-    maxIndex = len(peaklist)
-    for x, parent in enumerate(peaklist):
+    # get peaks data
+    mzs = peaklist.values('mz')
+    intensities = peaklist.intensities()
+    
+    # get next isotope candidate of each peak for all charges at once
+    successors = _successors(mzs, charges, mzTolerance, isotopeShift)
+    
+    # get neutral masses of all peaks for all charges
+    masses = mod_basics.mzarray(numpy.tile(mzs, len(charges)), charges=0, currentCharges=numpy.repeat(charges, len(mzs)))
+    masses = masses.reshape(len(charges), len(mzs))
+    
+    # score isotope clusters of all peaks, one charge at a time
+    valid = []
+    members = []
+    for c, z in enumerate(charges):
         
         CHECK_FORCE_QUIT()
         
-        # skip assigned peaks
-        if parent.isotope is not None:
+        chargeValid, clusters, matched = _isotopeclusters(intensities, numpy.array(successors[c]), masses[c], z, intTolerance)
+        valid.append(chargeValid)
+        
+        # get matching isotopes of valid clusters as (peak, isotope, member)
+        matched &= chargeValid[clusters[:,0]][:,None]
+        parents, isotopes = numpy.nonzero(matched)
+        members.append(collections.defaultdict(list))
+        for x, isotope, member in zip(clusters[parents,0].tolist(), (isotopes+1).tolist(), clusters[:,1:][matched].tolist()):
+            members[c][x].append((isotope, member))
+    
+    # get first valid charge of each peak
+    first = [-1] * len(mzs)
+    if charges:
+        valid = numpy.array(valid)
+        first = numpy.where(valid.any(axis=0), valid.argmax(axis=0), -1).tolist()
+    
+    # init results
+    peakCharges = [None] * len(mzs)
+    peakIsotopes = [None] * len(mzs)
+    
+    # walk in a peaklist
+    for x in range(len(mzs)):
+        
+        if not x % 1000:
+            CHECK_FORCE_QUIT()
+        
+        # skip assigned peaks and peaks without valid cluster
+        c = first[x]
+        if peakIsotopes[x] is not None or c == -1:
             continue
         
-        # try all charge states
-        for z in charges:
-            cluster = [parent]
-            
-            # search for next isotope within m/z tolerance
-            difference = (ISOTOPE_DISTANCE + isotopeShift)/abs(z)
-            y = 1
-            while x+y < maxIndex:
-                mzError = (peaklist[x+y].mz - cluster[-1].mz - difference)
-                if abs(mzError) <= mzTolerance:
-                    cluster.append(peaklist[x+y])
-                elif mzError > mzTolerance:
-                    break
-                y += 1
-            
-            # no isotope found
-            if len(cluster) == 1:
-                continue
-            
-            # get theoretical isotopic pattern
-            mass = min(15000, int( mod_basics.mz( parent.mz, 0, z))) / 200
-            pattern = patternLookupTable[mass]
-            
-            # check minimal number of isotopes in the cluster
-            limit = 0
-            for p in pattern:
-                if p >= 0.33:
-                    limit += 1
-            if len(cluster) < limit and abs(z) > 1:
-                continue
-            
-            # check peak intensities in cluster
-            valid = True
-            isotope = 1
-            limit = min(len(pattern), len(cluster))
-            while (isotope < limit):
-                
-                # calc theoretical intensity from previous peak and current error
-                intTheoretical = (cluster[isotope-1].intensity / pattern[isotope-1]) * pattern[isotope]
-                intError = cluster[isotope].intensity - intTheoretical
-                
-                # intensity in tolerance
-                if abs(intError) <= (intTheoretical * intTolerance):
-                    cluster[isotope].setisotope(isotope)
-                    cluster[isotope].setcharge(z)
-                
-                # intensity is higher (overlap)
-                elif intError > 0:
-                    pass
-                
-                # intensity is lower and first isotope is checked (nonsense)
-                elif (intError < 0 and isotope == 1):
-                    valid = False
-                    break
-                
-                # try next peak
-                isotope += 1
-            
-            # cluster is OK, set parent peak and skip other charges
-            if valid:
-                parent.setisotope(0)
-                parent.setcharge(z)
-                break
+        # set cluster peaks, skip other charges
+        z = charges[c]
+        for isotope, member in members[c][x]:
+            peakIsotopes[member] = isotope
+            peakCharges[member] = z
+        peakIsotopes[x] = 0
+        peakCharges[x] = z
+    
+    # store results
+    peaklist.setvalues('charge', peakCharges)
+    peaklist.setvalues('isotope', peakIsotopes)
 # ----
 
 
@@ -577,9 +555,15 @@ def deconvolute(peaklist, massType=0):
         massType (0 or 1) - mass type used for m/z re-calculation, 0 = monoisotopic, 1 = average
     """
     
+    # recalculate m/z of all peaks to single charge
+    peaks = copy.deepcopy(peaklist)
+    charges = numpy.array([peak.charge or 0 for peak in peaks], dtype=numpy.float64)
+    mzs = numpy.array([peak.mz for peak in peaks], dtype=numpy.float64)
+    newMzs = mod_basics.mzarray(mzs, numpy.sign(charges), currentCharges=charges, massType=massType)
+    
     # recalculate peaks
     buff = []
-    for peak in copy.deepcopy(peaklist):
+    for x, peak in enumerate(peaks):
         
         CHECK_FORCE_QUIT()
         
@@ -600,14 +584,8 @@ def deconvolute(peaklist, massType=0):
                 peak.setfwhm(newFwhm)
             
             # set m/z and charge
-            if peak.charge < 0:
-                newMz = mod_basics.mz(mass=peak.mz, charge=-1, currentCharge=peak.charge, massType=massType)
-                peak.setmz(newMz)
-                peak.setcharge(-1)
-            else:
-                newMz = mod_basics.mz(mass=peak.mz, charge=1, currentCharge=peak.charge, massType=massType)
-                peak.setmz(newMz)
-                peak.setcharge(1)
+            peak.setmz(float(newMzs[x]))
+            peak.setcharge(int(numpy.sign(peak.charge)))
             
             # store peak
             buff.append(peak)
@@ -661,99 +639,290 @@ def averagine(mz, charge=0, composition=AVERAGE_AMINO):
 # ----
 
 
-def _gentable(highmass, step=200, composition=AVERAGE_AMINO, table='tuple'):
-    """Print pattern lookup table."""
+def averaginepattern(mass):
+    """Get relative isotope abundances of averagine of given neutral mass.
+    Patterns are calculated lazily for AVERAGINE_STEP mass bins and
+    interpolated between neighbouring bins.
+        mass (float) - neutral mass
+    """
+    
+    patterns, sizes, limits = _averaginepatterns(numpy.array([mass], dtype=numpy.float64))
+    return tuple(patterns[0,:sizes[0]].tolist())
+# ----
+
+
+# HELPERS
+# -------
+
+def _isotopeclusters(intensities, following, masses, charge, intTolerance):
+    """Score isotope clusters starting at each peak for single charge.
+    Returns validity of each peak cluster, peak indexes of scored clusters
+    (parent first, -1 padded) and mask of their isotopes within intensity
+    tolerance (starting from isotope 1). Peaks without isotope candidate
+    are not scored.
+        intensities (numpy array) - peaks intensity
+        following (numpy array) - next isotope candidate of each peak, -1 if none
+        masses (numpy array) - neutral mass of each peak
+        charge (int) - current charge
+        intTolerance (float) - relative intensity tolerance for isotopes and model (in %/100)
+    """
+    
+    valid = numpy.zeros(len(masses), dtype=bool)
+    
+    # get peaks having isotope candidate
+    parents = numpy.flatnonzero(following != -1)
+    if not len(parents):
+        return valid, numpy.zeros((0, 2), dtype=numpy.int64), numpy.zeros((0, 1), dtype=bool)
+    
+    # get theoretical isotopic patterns
+    patterns, sizes, limits = _averaginepatterns(masses[parents])
+    if patterns.shape[1] < 2:
+        patterns = numpy.pad(patterns, ((0, 0), (0, 2-patterns.shape[1])))
+    
+    # follow isotopes chains up to pattern size
+    clusters = numpy.full(patterns.shape, -1, dtype=numpy.int64)
+    clusters[:,0] = parents
+    for isotope in range(1, patterns.shape[1]):
+        previous = clusters[:,isotope-1]
+        clusters[:,isotope] = numpy.where(previous != -1, following[previous], -1)
+    lengths = (clusters != -1).sum(axis=1)
+    
+    # calc theoretical intensities from previous peaks and current errors
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        intTheoretical = (intensities[clusters[:,:-1]] / patterns[:,:-1]) * patterns[:,1:]
+        intError = intensities[clusters[:,1:]] - intTheoretical
+        inside = numpy.arange(1, patterns.shape[1]) < numpy.minimum(sizes, lengths)[:,None]
+        matched = inside & (numpy.abs(intError) <= (intTheoretical * intTolerance))
+    
+    # intensity is lower and first isotope is checked (nonsense)
+    nonsense = inside[:,0] & ~matched[:,0] & (intError[:,0] < 0)
+    
+    # check minimal number of isotopes in the cluster
+    scored = ~nonsense
+    if abs(charge) > 1:
+        scored &= (lengths >= limits)
+    valid[parents] = scored
+    
+    return valid, clusters, matched
+# ----
+
+
+def _averaginepatterns(masses):
+    """Get relative isotope abundances of averagine for array of neutral masses.
+    Returns patterns padded by zeros, their sizes and number of isotopes
+    above 0.33 relative abundance.
+        masses (numpy array) - neutral masses
+    """
+    
+    # get neighbouring bins
+    position = numpy.clip(masses, 0., AVERAGINE_MAX_MASS) / AVERAGINE_STEP
+    lower = position.astype(numpy.int64)
+    fraction = position - lower
+    upper = numpy.where(fraction > 0, lower+1, lower)
+    
+    # get bins table
+    indexes = numpy.unique(numpy.concatenate((lower, upper)))
+    bins = [_averaginebin(index) for index in indexes.tolist()]
+    table = numpy.zeros((len(bins), max(len(x) for x in bins)))
+    for i, pattern in enumerate(bins):
+        table[i,:len(pattern)] = pattern
+    
+    # interpolate patterns
+    lower = table[numpy.searchsorted(indexes, lower)]
+    upper = table[numpy.searchsorted(indexes, upper)]
+    patterns = (1.-fraction)[:,None] * lower + fraction[:,None] * upper
+    patterns /= patterns.max(axis=1)[:,None]
+    
+    # remove isotopes under threshold
+    above = patterns >= AVERAGINE_THRESHOLD
+    starts = above.argmax(axis=1)
+    sizes = table.shape[1] - above[:,::-1].argmax(axis=1) - starts
+    columns = numpy.arange(table.shape[1])
+    patterns = numpy.take_along_axis(patterns, numpy.minimum(starts[:,None] + columns, table.shape[1]-1), axis=1)
+    patterns[columns >= sizes[:,None]] = 0.
+    
+    limits = (patterns >= 0.33).sum(axis=1)
+    
+    return patterns, sizes, limits
+# ----
+
+
+def _averaginebin(index):
+    """Get isotope abundances of averagine bin by nominal isotope from monoisotope."""
+    
+    if index in _AVERAGINE_BINS:
+        return _AVERAGINE_BINS[index]
+    
+    # calculate pattern, grouped by isotope index
+    mass = index * AVERAGINE_STEP
+    formula = averagine(mass, charge=0)
+    monoisotope = formula.mass(0)
+    
+    pattern = numpy.zeros(1)
+    for mz, abundance in formula.pattern(fwhm=0.1, threshold=AVERAGINE_THRESHOLD/10., real=False, method='fast'):
+        isotope = int(round((mz - monoisotope) / ISOTOPE_DISTANCE))
+        if isotope >= len(pattern):
+            pattern = numpy.pad(pattern, (0, isotope+1-len(pattern)))
+        pattern[isotope] += abundance
+    
+    pattern /= pattern.max()
+    pattern.setflags(write=False)
+    _AVERAGINE_BINS[index] = pattern
+    
+    return pattern
+# ----
+
+
+def _successors(mzs, charges, mzTolerance, isotopeShift):
+    """Get index of next isotope candidate for each peak and charge, -1 if none.
+    First peak after current one within distance - tolerance is the candidate,
+    valid if it is also within distance + tolerance.
+        mzs (numpy array) - sorted peaks m/z
+        charges (list of int) - charges to search
+        mzTolerance (float) - absolute m/z tolerance for isotopes distance
+        isotopeShift (float) - isotope distance correction (neutral mass)
+    """
+    
+    indexes = numpy.arange(len(mzs))
     
-    for mass in range(0, highmass, step):
-        formula = averagine(mass, charge=0, composition=composition)
+    successors = []
+    for z in charges:
+        difference = (ISOTOPE_DISTANCE + isotopeShift)/abs(z)
+        following = numpy.searchsorted(mzs, mzs + difference - mzTolerance, side='left')
+        following = numpy.maximum(following, indexes+1)
         
-        pattern = ''
-        for mz, abundance in formula.pattern(fwhm=0.1, threshold=0.001):
-            pattern += '%.3f, ' % abundance
+        valid = following < len(mzs)
+        following[~valid] = -1
+        errors = mzs[following[valid]] - mzs[valid] - difference
+        following[numpy.flatnonzero(valid)[numpy.abs(errors) > mzTolerance]] = -1
         
-        if table == 'tuple':
-            print ('(%s), #%d' % (pattern[:-2], mass))
-        elif table == 'dict':
-            print ('%d: (%s),' % (mass, pattern[:-2]))
+        successors.append(following.tolist())
+    
+    return successors
 # ----
 
 
-# pattern lookup table for amino building block
-patternLookupTable = (
-    (1.000, 0.059, 0.003), #0
-    (1.000, 0.122, 0.013), #200
-    (1.000, 0.241, 0.040, 0.005), #400
-    (1.000, 0.303, 0.059, 0.008), #600
-    (1.000, 0.426, 0.109, 0.020, 0.003), #800
-    (1.000, 0.533, 0.166, 0.038, 0.006), #1000
-    (1.000, 0.655, 0.244, 0.066, 0.014, 0.002), #1200
-    (1.000, 0.786, 0.388, 0.143, 0.042, 0.009, 0.001), #1400
-    (1.000, 0.845, 0.441, 0.171, 0.053, 0.013, 0.002), #1600
-    (1.000, 0.967, 0.557, 0.236, 0.080, 0.021, 0.005), #1800
-    (0.921, 1.000, 0.630, 0.291, 0.107, 0.032, 0.007, 0.001), #2000
-    (0.828, 1.000, 0.687, 0.343, 0.136, 0.044, 0.011, 0.002), #2200
-    (0.752, 1.000, 0.744, 0.400, 0.171, 0.060, 0.017, 0.004), #2400
-    (0.720, 1.000, 0.772, 0.428, 0.188, 0.068, 0.020, 0.005), #2600
-    (0.667, 1.000, 0.825, 0.487, 0.228, 0.088, 0.028, 0.007), #2800
-    (0.616, 1.000, 0.884, 0.556, 0.276, 0.113, 0.039, 0.010, 0.002), #3000
-    (0.574, 1.000, 0.941, 0.628, 0.330, 0.143, 0.052, 0.015, 0.003), #3200
-    (0.536, 0.999, 1.000, 0.706, 0.392, 0.179, 0.069, 0.022, 0.005), #3400
-    (0.506, 0.972, 1.000, 0.725, 0.412, 0.193, 0.077, 0.025, 0.006), #3600
-    (0.449, 0.919, 1.000, 0.764, 0.457, 0.226, 0.094, 0.033, 0.009, 0.001), #3800
-    (0.392, 0.853, 1.000, 0.831, 0.543, 0.295, 0.136, 0.053, 0.017, 0.004), #4000
-    (0.353, 0.812, 1.000, 0.869, 0.593, 0.336, 0.162, 0.067, 0.023, 0.006), #4200
-    (0.321, 0.776, 1.000, 0.907, 0.644, 0.379, 0.190, 0.082, 0.030, 0.009), #4400
-    (0.308, 0.760, 1.000, 0.924, 0.669, 0.401, 0.205, 0.090, 0.033, 0.011, 0.001), #4600
-    (0.282, 0.729, 1.000, 0.962, 0.723, 0.451, 0.239, 0.110, 0.042, 0.014, 0.003), #4800
-    (0.258, 0.699, 1.000, 1.000, 0.780, 0.504, 0.277, 0.132, 0.053, 0.018, 0.004), #5000
-    (0.228, 0.645, 0.962, 1.000, 0.809, 0.542, 0.308, 0.153, 0.065, 0.023, 0.007), #5200
-    (0.203, 0.598, 0.927, 1.000, 0.839, 0.581, 0.343, 0.176, 0.078, 0.029, 0.010), #5400
-    (0.192, 0.577, 0.911, 1.000, 0.854, 0.602, 0.361, 0.189, 0.086, 0.033, 0.011), #5600
-    (0.171, 0.536, 0.880, 1.000, 0.884, 0.644, 0.399, 0.216, 0.102, 0.040, 0.014, 0.003), #5800
-    (0.154, 0.501, 0.851, 1.000, 0.912, 0.686, 0.439, 0.244, 0.120, 0.050, 0.018, 0.004), #6000
-    (0.139, 0.468, 0.823, 1.000, 0.942, 0.730, 0.482, 0.278, 0.141, 0.062, 0.023, 0.007), #6200
-    (0.126, 0.441, 0.799, 1.000, 0.969, 0.772, 0.524, 0.310, 0.162, 0.073, 0.028, 0.009), #6400
-    (0.121, 0.427, 0.787, 1.000, 0.983, 0.794, 0.547, 0.328, 0.174, 0.080, 0.031, 0.011), #6600
-    (0.104, 0.381, 0.732, 0.971, 1.000, 0.848, 0.614, 0.390, 0.219, 0.109, 0.045, 0.016, 0.004), #6800
-    (0.092, 0.349, 0.691, 0.944, 1.000, 0.872, 0.648, 0.422, 0.244, 0.125, 0.054, 0.020, 0.006), #7000
-    (0.082, 0.321, 0.654, 0.919, 1.000, 0.894, 0.682, 0.456, 0.270, 0.143, 0.063, 0.024, 0.008), #7200
-    (0.073, 0.296, 0.620, 0.895, 1.000, 0.917, 0.718, 0.492, 0.299, 0.162, 0.077, 0.030, 0.011), #7400
-    (0.069, 0.284, 0.604, 0.884, 1.000, 0.929, 0.735, 0.509, 0.313, 0.172, 0.084, 0.033, 0.012), #7600
-    (0.062, 0.262, 0.573, 0.861, 1.000, 0.952, 0.772, 0.548, 0.345, 0.195, 0.098, 0.040, 0.015, 0.003), #7800
-    (0.056, 0.243, 0.544, 0.839, 1.000, 0.976, 0.811, 0.589, 0.380, 0.220, 0.114, 0.049, 0.019, 0.005), #8000
-    (0.051, 0.227, 0.521, 0.821, 1.000, 0.997, 0.846, 0.628, 0.413, 0.244, 0.130, 0.058, 0.022, 0.007), #8200
-    (0.045, 0.206, 0.486, 0.786, 0.980, 1.000, 0.869, 0.660, 0.444, 0.268, 0.147, 0.070, 0.027, 0.010), #8400
-    (0.042, 0.196, 0.468, 0.767, 0.968, 1.000, 0.879, 0.676, 0.460, 0.281, 0.156, 0.075, 0.030, 0.011), #8600
-    (0.038, 0.179, 0.437, 0.733, 0.947, 1.000, 0.899, 0.705, 0.491, 0.307, 0.173, 0.086, 0.036, 0.013, 0.002), #8800
-    (0.033, 0.163, 0.408, 0.701, 0.926, 1.000, 0.919, 0.736, 0.524, 0.335, 0.193, 0.099, 0.043, 0.016, 0.004), #9000
-    (0.030, 0.149, 0.382, 0.670, 0.906, 1.000, 0.938, 0.768, 0.558, 0.364, 0.215, 0.113, 0.051, 0.020, 0.006), #9200
-    (0.026, 0.132, 0.348, 0.629, 0.877, 1.000, 0.971, 0.823, 0.620, 0.420, 0.258, 0.143, 0.069, 0.028, 0.010), #9400
-    (0.024, 0.126, 0.337, 0.616, 0.868, 1.000, 0.981, 0.839, 0.638, 0.437, 0.271, 0.153, 0.074, 0.031, 0.011), #9600
-    (0.022, 0.116, 0.317, 0.592, 0.851, 1.000, 1.000, 0.872, 0.676, 0.472, 0.298, 0.172, 0.087, 0.037, 0.014, 0.002), #9800
-    (0.020, 0.106, 0.294, 0.561, 0.822, 0.983, 1.000, 0.888, 0.700, 0.498, 0.320, 0.188, 0.099, 0.043, 0.017, 0.004), #10000
-    (0.017, 0.096, 0.272, 0.529, 0.790, 0.965, 1.000, 0.905, 0.727, 0.526, 0.346, 0.207, 0.113, 0.050, 0.020, 0.006), #10200
-    (0.015, 0.087, 0.251, 0.499, 0.761, 0.946, 1.000, 0.922, 0.755, 0.556, 0.373, 0.227, 0.126, 0.061, 0.024, 0.008), #10400
-    (0.014, 0.083, 0.242, 0.486, 0.747, 0.937, 1.000, 0.930, 0.768, 0.570, 0.385, 0.237, 0.134, 0.065, 0.026, 0.009), #10600
-    (0.013, 0.075, 0.225, 0.459, 0.720, 0.920, 1.000, 0.947, 0.796, 0.602, 0.415, 0.260, 0.149, 0.075, 0.032, 0.012, 0.001), #10800
-    (0.012, 0.069, 0.208, 0.435, 0.695, 0.904, 1.000, 0.963, 0.824, 0.633, 0.443, 0.284, 0.165, 0.085, 0.037, 0.015, 0.002), #11000
-    (0.010, 0.063, 0.194, 0.412, 0.669, 0.888, 1.000, 0.980, 0.852, 0.667, 0.475, 0.309, 0.184, 0.098, 0.044, 0.018, 0.005), #11200
-    (0.009, 0.057, 0.180, 0.391, 0.646, 0.872, 1.000, 0.997, 0.882, 0.702, 0.509, 0.336, 0.204, 0.113, 0.052, 0.021, 0.006), #11400
-    (0.009, 0.054, 0.173, 0.379, 0.631, 0.861, 0.995, 1.000, 0.892, 0.717, 0.523, 0.350, 0.214, 0.119, 0.057, 0.023, 0.008), #11600
-    (0.008, 0.049, 0.160, 0.355, 0.602, 0.834, 0.980, 1.000, 0.906, 0.739, 0.548, 0.373, 0.231, 0.132, 0.066, 0.026, 0.010), #11800
-    (0.007, 0.042, 0.141, 0.321, 0.557, 0.791, 0.953, 1.000, 0.931, 0.781, 0.596, 0.417, 0.268, 0.158, 0.082, 0.037, 0.014, 0.002), #12000
-    (0.006, 0.038, 0.130, 0.301, 0.531, 0.767, 0.939, 1.000, 0.945, 0.805, 0.624, 0.443, 0.289, 0.174, 0.093, 0.043, 0.017, 0.004), #12200
-    (0.005, 0.035, 0.120, 0.283, 0.507, 0.744, 0.925, 1.000, 0.960, 0.830, 0.653, 0.470, 0.312, 0.191, 0.106, 0.051, 0.020, 0.006), #12400
-    (0.005, 0.033, 0.115, 0.274, 0.495, 0.732, 0.918, 1.000, 0.967, 0.842, 0.668, 0.485, 0.324, 0.200, 0.112, 0.054, 0.023, 0.007), #12600
-    (0.004, 0.030, 0.107, 0.257, 0.472, 0.710, 0.904, 1.000, 0.982, 0.868, 0.699, 0.515, 0.351, 0.219, 0.126, 0.063, 0.027, 0.010), #12800
-    (0.004, 0.027, 0.098, 0.242, 0.450, 0.689, 0.890, 1.000, 0.997, 0.894, 0.731, 0.547, 0.378, 0.241, 0.141, 0.072, 0.032, 0.012, 0.002), #13000
-    (0.003, 0.025, 0.090, 0.224, 0.426, 0.661, 0.867, 0.989, 1.000, 0.911, 0.756, 0.574, 0.402, 0.260, 0.155, 0.082, 0.037, 0.014, 0.003), #13200
-    (0.003, 0.022, 0.082, 0.208, 0.402, 0.633, 0.843, 0.975, 1.000, 0.925, 0.777, 0.598, 0.425, 0.279, 0.169, 0.092, 0.043, 0.017, 0.005), #13400
-    (0.003, 0.021, 0.079, 0.202, 0.392, 0.621, 0.833, 0.969, 1.000, 0.930, 0.786, 0.609, 0.435, 0.288, 0.176, 0.097, 0.046, 0.018, 0.006), #13600
-    (0.003, 0.019, 0.073, 0.188, 0.370, 0.595, 0.810, 0.955, 1.000, 0.943, 0.808, 0.634, 0.460, 0.309, 0.191, 0.108, 0.053, 0.022, 0.007), #13800
-    (0.002, 0.017, 0.067, 0.175, 0.350, 0.570, 0.787, 0.942, 1.000, 0.956, 0.831, 0.662, 0.487, 0.331, 0.209, 0.121, 0.062, 0.026, 0.010), #14000
-    (0.002, 0.016, 0.061, 0.163, 0.330, 0.547, 0.765, 0.929, 1.000, 0.968, 0.855, 0.690, 0.515, 0.356, 0.227, 0.135, 0.070, 0.031, 0.012, 0.002), #14200
-    (0.002, 0.014, 0.056, 0.151, 0.312, 0.524, 0.743, 0.916, 1.000, 0.982, 0.878, 0.718, 0.544, 0.382, 0.247, 0.149, 0.079, 0.037, 0.014, 0.003), #14400
-    (0.002, 0.013, 0.054, 0.146, 0.304, 0.514, 0.733, 0.909, 1.000, 0.989, 0.890, 0.733, 0.559, 0.395, 0.257, 0.156, 0.084, 0.039, 0.016, 0.004), #14600
-    (0.001, 0.012, 0.047, 0.131, 0.276, 0.478, 0.697, 0.881, 0.989, 1.000, 0.920, 0.777, 0.605, 0.437, 0.292, 0.182, 0.102, 0.051, 0.022, 0.007), #14800
-    (0.001, 0.010, 0.043, 0.121, 0.259, 0.454, 0.671, 0.859, 0.977, 1.000, 0.932, 0.797, 0.629, 0.460, 0.312, 0.197, 0.114, 0.058, 0.025, 0.008, 0.001), #15000
-)
+def _labelbase(mzs, ais, bases, sns, baseline):
+    """Interpolate baseline and s/n of peaks within baseline range in place.
+    Highest intensity above baseline is returned.
+        mzs (numpy array) - peaks m/z
+        ais (numpy array) - peaks intensities
+        bases (numpy array) - peaks baseline
+        sns (numpy array) - peaks s/n
+        baseline (numpy array) - signal baseline
+    """
+    
+    basepeak = 0.0
+    
+    if baseline is None or not len(mzs):
+        return basepeak
+    
+    # get baseline segments
+    idx = numpy.searchsorted(baseline[:,0], mzs, side='right')
+    valid = (idx > 0) & (idx < len(baseline))
+    p1 = baseline[idx[valid]-1]
+    p2 = baseline[idx[valid]]
+    x = mzs[valid]
+    
+    # interpolate level and noise
+    bases[valid] = _interpolatey(p1[:,0], p1[:,1], p2[:,0], p2[:,1], x)
+    noise = _interpolatey(p1[:,0], p1[:,2], p2[:,0], p2[:,2], x)
+    intens = ais[valid] - bases[valid]
+    
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sns[valid] = numpy.where(noise != 0, intens / noise, sns[valid])
+    
+    if len(intens):
+        basepeak = max(basepeak, float(numpy.fmax.reduce(intens)))
+    
+    return basepeak
+# ----
+
+
+def _labeledges(signal, mzs, heights):
+    """Find left and right x-values where peaks cross given heights.
+        signal (numpy array) - signal data points
+        mzs (numpy array) - peaks m/z
+        heights (numpy array) - crossing heights
+    Returns valid flags and left and right x-values.
+    """
+    
+    x = signal[:,0]
+    y = signal[:,1]
+    
+    # check data points
+    if len(signal) < 2:
+        empty = numpy.zeros(len(mzs))
+        return numpy.zeros(len(mzs), dtype=bool), empty, empty
+    
+    # locate peaks
+    idx = numpy.searchsorted(x, mzs, side='right')
+    valid = (idx > 0) & (idx < len(signal))
+    idx = numpy.where(valid, idx, 1)
+    
+    # walk down to left
+    ileft = idx - 1
+    active = numpy.flatnonzero((ileft > 0) & (y[ileft] > heights))
+    while len(active):
+        ileft[active] -= 1
+        current = ileft[active]
+        active = active[(current > 0) & (y[current] > heights[active])]
+    
+    # walk down to right
+    iright = idx.copy()
+    active = numpy.flatnonzero((iright < len(signal)-1) & (y[iright] > heights))
+    while len(active):
+        iright[active] += 1
+        current = iright[active]
+        active = active[(current < len(signal)-1) & (y[current] > heights[active])]
+    
+    # interpolate crossings
+    ileft = numpy.minimum(ileft, len(signal)-2)
+    iright = numpy.maximum(iright, 1)
+    leftMZs = _interpolatex(x[ileft], y[ileft], x[ileft+1], y[ileft+1], heights)
+    rightMZs = _interpolatex(x[iright-1], y[iright-1], x[iright], y[iright], heights)
+    
+    return valid, leftMZs, rightMZs
+# ----
+
+
+def _labelintensity(signal, mzs):
+    """Interpolate signal intensities at given x-values, 0 outside signal."""
+    
+    if len(signal) < 2:
+        return numpy.zeros(len(mzs))
+    
+    idx = numpy.searchsorted(signal[:,0], mzs, side='right')
+    valid = (idx > 0) & (idx < len(signal))
+    idx = numpy.where(valid, idx, 1)
+    
+    p1 = signal[idx-1]
+    p2 = signal[idx]
+    intens = _interpolatey(p1[:,0], p1[:,1], p2[:,0], p2[:,1], mzs)
+    
+    return numpy.where(valid, intens, 0.)
+# ----
+
+
+def _interpolatex(x1, y1, x2, y2, y):
+    """Vectorized mod_signal.interpolate for x-values."""
+    
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        a = (y2 - y1)/(x2 - x1)
+        b = y1 - a * x1
+        x = (y - b) / a
+    
+    return numpy.where(x1 == x2, x1, x)
+# ----
+
+
+def _interpolatey(x1, y1, x2, y2, x):
+    """Vectorized mod_signal.interpolate for y-values."""
+    
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        a = (y2 - y1)/(x2 - x1)
+        b = y1 - a * x1
+        y = a*x + b
+    
+    return numpy.where(y1 == y2, y1, y)
+# ----
@@ -17,6 +17,7 @@
 
 # load libs
 import numpy
+import functools
 
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
@@ -25,6 +26,23 @@ from .mod_stopper import CHECK_FORCE_QUIT
 from . import calculations
 
 
+# BASELINE CONSTANTS
+# ------------------
+
+BASELINE_OVERLAP = 8 # rolling windows covering each point
+BASELINE_BLOCKS = 20 # median blocks per window for SNIP and ALS
+BASELINE_MAX_BLOCKS = 5000 # max median blocks for SNIP and ALS
+ALS_ASYMMETRY = 0.01
+ALS_ITERATIONS = 10
+
+
+# SMOOTHING CONSTANTS
+# -------------------
+
+SMOOTH_KERNEL_CACHE_SIZE = 64
+SMOOTH_FFT_KERNEL = 255 # longer kernels are applied by FFT
+SMOOTH_CHUNK = 1000000 # points per chunk of in-place smoothing
+
 # SIGNAL PROCESSING FUNCTIONS
 # ---------------------------
 
@@ -284,11 +302,12 @@ def noise(signal, minX=None, maxX=None, x=None, window=0.1):
 # ----
 
 
-def baseline(signal, window=0.1, offset=0.):
+def baseline(signal, window=0.1, offset=0., method='raster'):
     """Return baseline data.
         signal (numpy array) - signal data points
         window (float or None) - noise calculation window (%/100)
         offset (float) - baseline offset, relative to noise width (in %/100)
+        method (raster, rolling, snip or als) - baseline estimation method
     """
     
     # check signal type
@@ -307,6 +326,22 @@ def baseline(signal, window=0.1, offset=0.):
         noiseLevel -= noiseWidth*offset
         return numpy.array([ [signal[0][0], noiseLevel, noiseWidth], [signal[-1][0], noiseLevel, noiseWidth] ])
     
+    # use running median
+    if method == 'rolling':
+        return _rollingbase(signal, window, offset)
+    
+    # use SNIP clipping
+    elif method == 'snip':
+        return _clippedbase(signal, window, offset, _snip)
+    
+    # use asymmetric least squares
+    elif method == 'als':
+        return _clippedbase(signal, window, offset, _als)
+    
+    # unknown baseline method
+    elif method != 'raster':
+        raise KeyError("Unknown baseline method! -->", method)
+    
     # make raster
     raster = []
     minimum = max(0, signal[0][0])
@@ -435,12 +470,13 @@ def normalize(signal):
 # ----
 
 
-def smooth(signal, method, window, cycles=1):
+def smooth(signal, method, window, cycles=1, inplace=False):
     """Smooth signal by moving average filter. New array is returned.
         signal (numpy array) - signal data points
         method (MA GA SG) - smoothing method: MA - moving average, GA - Gaussian, SG - Savitzky-Golay
         window (float) - m/z window size for smoothing
         cycles (int) - number of repeating cycles
+        inplace (bool) - smooth given array by chunks instead of making new one
     """
     
     # check signal type
@@ -455,15 +491,15 @@ def smooth(signal, method, window, cycles=1):
     
     # apply moving average filter
     if method == 'MA':
-        return movaver(signal, window, cycles, style='flat')
+        return movaver(signal, window, cycles, style='flat', inplace=inplace)
     
     # apply gaussian filter
     elif method == 'GA':
-        return movaver(signal, window, cycles, style='gaussian')
+        return movaver(signal, window, cycles, style='gaussian', inplace=inplace)
     
     # apply savitzky-golay filter
     elif method == 'SG':
-        return savgol(signal, window, cycles)
+        return savgol(signal, window, cycles, inplace=inplace)
     
     # unknown smoothing method
     else:
@@ -471,105 +507,50 @@ def smooth(signal, method, window, cycles=1):
 # ----
 
 
-def movaver(signal, window, cycles=1, style='flat'):
+def movaver(signal, window, cycles=1, style='flat', inplace=False):
     """Smooth signal by moving average filter. New array is returned.
         signal (numpy array) - signal data points
         window (float) - m/z window size for smoothing
         cycles (int) - number of repeating cycles
+        style (flat, gaussian or numpy window function name) - filter weights
+        inplace (bool) - smooth given array by chunks instead of making new one
     """
     
     # approximate number of points within window
     window = int(window*len(signal)/(signal[-1][0]-signal[0][0]))
     window = min(window, len(signal))
     if window < 3:
-        return signal.copy()
+        return signal if inplace else signal.copy()
     if not window % 2:
         window -= 1
     
-    # unpack mz and intensity
-    xAxis, yAxis = numpy.hsplit(signal,2)
-    xAxis = xAxis.flatten()
-    yAxis = yAxis.flatten()
+    # get cached filter weights
+    kernel = _movaverkernel(window, style)
     
-    # smooth the points
-    while cycles:
-        
-        CHECK_FORCE_QUIT()
-        
-        if style == 'flat':
-            w = numpy.ones(window,'f')
-        elif style == 'gaussian':
-            r = numpy.array([(i-(window-1)/2.) for i in range(window)])
-            w = numpy.exp(-(r**2/(window/4.)**2))
-        else:
-            w = eval('numpy.'+style+'(window)')
-        
-        s = numpy.r_[yAxis[window-1:0:-1], yAxis, yAxis[-2:-window-1:-1]]
-        y = numpy.convolve(w/w.sum(), s, mode='same')
-        yAxis = y[window-1:-window+1]
-        cycles -=1
-    
-    # return smoothed data
-    xAxis.shape = (-1,1)
-    yAxis.shape = (-1,1)
-    data = numpy.concatenate((xAxis,yAxis), axis=1)
-    
-    return data.copy()
+    # smooth the points, edges are mirrored
+    return _smoothsignal(signal, kernel, 'reflect', cycles, inplace)
 # ----
 
 
-def savgol(signal, window, cycles=1, order=3):
+def savgol(signal, window, cycles=1, order=3, inplace=False):
     """Smooth signal by Savitzky-Golay filter. New array is returned.
         signal (numpy array) - signal data points
         window (float) - m/z window size for smoothing
         cycles (int) - number of repeating cycles
         order (int) - order of polynom used
+        inplace (bool) - smooth given array by chunks instead of making new one
     """
     
     # approximate number of points within window
     window = int(window*len(signal)/(signal[-1][0]-signal[0][0]))
     if window <= order:
-        return signal.copy()
-    
-    # unpack axes
-    xAxis, yAxis = numpy.hsplit(signal,2)
-    yAxis = yAxis.flatten()
+        return signal if inplace else signal.copy()
     
-    # coeficients
-    orderRange = range(order+1)
-    halfWindow = (window-1) // 2
-    b = numpy.mat([[k**i for i in orderRange] for k in range(-halfWindow, halfWindow+1)])
-    m = numpy.linalg.pinv(b).A[0]
-    window = len(m)
-    halfWindow = (window-1) // 2
+    # get cached coeficients
+    kernel = _savgolkernel(window, order)
     
-    # precompute the offset values for better performance
-    offsets = range(-halfWindow, halfWindow+1)
-    offsetData = zip(offsets, m)
-    
-    # smooth the data
-    while cycles:
-        smoothData = list()
-        
-        yAxis = numpy.concatenate((numpy.zeros(halfWindow)+yAxis[0], yAxis, numpy.zeros(halfWindow)+yAxis[-1]))
-        for i in range(halfWindow, len(yAxis) - halfWindow):
-            
-            CHECK_FORCE_QUIT()
-            
-            value = 0.0
-            for offset, weight in offsetData:
-                value += weight * yAxis[i + offset]
-            smoothData.append(value)
-        
-        yAxis = smoothData
-        cycles -=1
-    
-    # return smoothed data
-    yAxis = numpy.array(yAxis)
-    yAxis.shape = (-1,1)
-    data = numpy.concatenate((xAxis,yAxis), axis=1)
-    
-    return data.copy()
+    # smooth the points, edges are extended by end values
+    return _smoothsignal(signal, kernel, 'edge', cycles, inplace)
 # ----
 
 
@@ -665,3 +646,335 @@ def subbase(signal, baseline):
 # ----
 
 
+
+# BASELINE HELPERS
+# ----------------
+
+def _rollingbase(signal, window, offset):
+    """Make baseline by running median and MAD of points within x +- window.
+    Windows are evaluated every few points so each point is used by
+    BASELINE_OVERLAP windows only and the total work stays linear.
+        signal (numpy array) - signal data points
+        window (float) - noise calculation window (%/100)
+        offset (float) - baseline offset, relative to noise width (in %/100)
+    """
+    
+    xAxis = signal[:,0]
+    
+    # get window edges of each point
+    lows = numpy.searchsorted(xAxis, xAxis - xAxis*window, side='right')
+    highs = numpy.searchsorted(xAxis, xAxis + xAxis*window, side='right')
+    
+    # calc noise for evaluated points
+    buff = []
+    i = 0
+    while i < len(signal):
+        
+        if not len(buff) % 100:
+            CHECK_FORCE_QUIT()
+        
+        i1 = lows[i]
+        i2 = highs[i]
+        if i2 - i1 < 2:
+            noiseLevel = signal[i][1]
+            noiseWidth = 0.0
+        else:
+            noiseLevel, noiseWidth = calculations.signal_noise(signal[i1:i2])
+        buff.append([xAxis[i], noiseLevel, abs(noiseWidth)])
+        
+        # make sure last point is evaluated
+        step = max(1, (i2 - i1) // BASELINE_OVERLAP)
+        if i < len(signal)-1:
+            i = min(i + step, len(signal)-1)
+        else:
+            break
+    
+    # apply offset
+    data = numpy.array(buff)
+    data[:,1] = numpy.maximum(0, data[:,1] - data[:,2]*offset)
+    
+    return data
+# ----
+
+
+def _clippedbase(signal, window, offset, fit):
+    """Make baseline by fitting function on signal block medians.
+        signal (numpy array) - signal data points
+        window (float) - noise calculation window (%/100)
+        offset (float) - baseline offset, relative to noise width (in %/100)
+        fit (function) - baseline fitting function for block medians
+    """
+    
+    xAxis = signal[:,0]
+    yAxis = signal[:,1]
+    
+    # get block size, about BASELINE_BLOCKS blocks within window at spectrum center
+    center = abs(xAxis[0] + xAxis[-1]) / 2.
+    span = max(xAxis[-1] - xAxis[0], 1e-10)
+    size = int(2 * center * window * len(signal) / span / BASELINE_BLOCKS)
+    size = max(1, size, int(numpy.ceil(len(signal) / float(BASELINE_MAX_BLOCKS))))
+    size = min(size, len(signal))
+    
+    # use single segment if signal is too short for blocks
+    if size == len(signal):
+        noiseLevel, noiseWidth = noise(signal)
+        noiseLevel = max(0, noiseLevel - noiseWidth*offset)
+        return numpy.array([ [xAxis[0], noiseLevel, noiseWidth], [xAxis[-1], noiseLevel, noiseWidth] ])
+    
+    # get block positions and medians
+    count = int(numpy.ceil(len(signal) / float(size)))
+    padding = count*size - len(signal)
+    blocksX = numpy.concatenate((xAxis, numpy.full(padding, numpy.nan))).reshape(count, size)
+    blocksY = numpy.concatenate((yAxis, numpy.full(padding, numpy.nan))).reshape(count, size)
+    positions = numpy.nanmean(blocksX, axis=1)
+    medians = numpy.nanmedian(blocksY, axis=1)
+    
+    CHECK_FORCE_QUIT()
+    
+    # fit baseline
+    levels = fit(medians)
+    
+    CHECK_FORCE_QUIT()
+    
+    # calc noise width from residuals
+    residuals = yAxis - numpy.interp(xAxis, positions, levels)
+    residuals = numpy.concatenate((residuals, numpy.full(padding, numpy.nan))).reshape(count, size)
+    deviations = numpy.abs(residuals - numpy.nanmedian(residuals, axis=1)[:,None])
+    widths = 2 * numpy.nanmedian(deviations, axis=1)
+    
+    # smooth noise width
+    if count > 2:
+        swindow = BASELINE_BLOCKS * (positions[-1] - positions[0]) / count
+        widths = smooth(numpy.column_stack((positions, widths)), 'GA', swindow, 2)[:,1]
+    
+    # make baseline and apply offset
+    widths = numpy.abs(widths)
+    levels = numpy.maximum(0, levels - widths*offset)
+    data = numpy.column_stack((positions, levels, widths))
+    
+    # cover whole signal range
+    first = [xAxis[0], levels[0], widths[0]]
+    last = [xAxis[-1], levels[-1], widths[-1]]
+    
+    return numpy.concatenate(([first], data, [last]))
+# ----
+
+
+def _snip(data):
+    """Fit baseline by SNIP clipping of log-log-sqrt transformed data.
+        data (numpy array) - block medians
+    """
+    
+    if len(data) < 3:
+        return data.copy()
+    
+    # transform data
+    minimum = data.min()
+    v = numpy.log(numpy.log(numpy.sqrt(data - minimum + 1) + 1) + 1)
+    
+    # clip peaks by increasing window
+    for k in range(1, min(BASELINE_BLOCKS // 2, (len(data)-1) // 2) + 1):
+        means = (v[:-2*k] + v[2*k:]) / 2.
+        v[k:-k] = numpy.minimum(v[k:-k], means)
+    
+    # transform back
+    return (numpy.exp(numpy.exp(v) - 1) - 1)**2 - 1 + minimum
+# ----
+
+
+def _als(data):
+    """Fit baseline by asymmetric least squares smoothing.
+        data (numpy array) - block medians
+    """
+    
+    n = len(data)
+    if n < 3:
+        return data.copy()
+    
+    # second differences penalty, smoothing length about BASELINE_BLOCKS
+    penalty = (BASELINE_BLOCKS / 2.)**4
+    diag = numpy.full(n, 6.)
+    diag[[0, -1]] = 1.
+    diag[[1, -2]] = 5.
+    off1 = numpy.full(n-1, -4.)
+    off1[[0, -1]] = -2.
+    off2 = numpy.ones(n-2)
+    if n == 3:
+        diag[1] = 4.
+    
+    # iterate weights
+    weights = numpy.ones(n)
+    z = data
+    for i in range(ALS_ITERATIONS):
+        
+        CHECK_FORCE_QUIT()
+        
+        z = _solvepenta(weights + penalty*diag, penalty*off1, penalty*off2, weights*data)
+        weights = numpy.where(data > z, ALS_ASYMMETRY, 1. - ALS_ASYMMETRY)
+    
+    return z
+# ----
+
+
+def _solvepenta(diag, off1, off2, rhs):
+    """Solve symmetric positive definite pentadiagonal system by LDL decomposition.
+        diag (numpy array) - main diagonal
+        off1 (numpy array) - first off-diagonal
+        off2 (numpy array) - second off-diagonal
+        rhs (numpy array) - right-hand side
+    """
+    
+    n = len(diag)
+    d = diag.tolist()
+    e = off1.tolist()
+    f = off2.tolist()
+    b = rhs.tolist()
+    
+    D = [0.]*n
+    L1 = [0.]*n
+    L2 = [0.]*n
+    z = [0.]*n
+    
+    # decompose and solve lower system
+    for i in range(n):
+        D[i] = d[i]
+        z[i] = b[i]
+        if i >= 2:
+            L2[i] = f[i-2] / D[i-2]
+            D[i] -= L2[i]*L2[i]*D[i-2]
+            z[i] -= L2[i]*z[i-2]
+        if i >= 1:
+            L1[i] = (e[i-1] - L2[i]*L1[i-1]*D[i-2]) / D[i-1] if i >= 2 else e[i-1] / D[i-1]
+            D[i] -= L1[i]*L1[i]*D[i-1]
+            z[i] -= L1[i]*z[i-1]
+    
+    # solve diagonal and upper system
+    x = [0.]*n
+    for i in range(n-1, -1, -1):
+        x[i] = z[i] / D[i]
+        if i+1 < n:
+            x[i] -= L1[i+1]*x[i+1]
+        if i+2 < n:
+            x[i] -= L2[i+2]*x[i+2]
+    
+    return numpy.array(x)
+# ----
+
+
+
+# SMOOTHING HELPERS
+# -----------------
+
+@functools.lru_cache(maxsize=SMOOTH_KERNEL_CACHE_SIZE)
+def _movaverkernel(window, style):
+    """Get normalized moving average weights for window size in points."""
+    
+    if style == 'flat':
+        weights = numpy.ones(window)
+    elif style == 'gaussian':
+        r = numpy.arange(window) - (window-1)/2.
+        weights = numpy.exp(-(r**2/(window/4.)**2))
+    else:
+        weights = getattr(numpy, style)(window)
+    
+    kernel = weights / weights.sum()
+    kernel.setflags(write=False)
+    
+    return kernel
+# ----
+
+
+@functools.lru_cache(maxsize=SMOOTH_KERNEL_CACHE_SIZE)
+def _savgolkernel(window, order):
+    """Get Savitzky-Golay smoothing coeficients for window size in points."""
+    
+    halfWindow = (window-1) // 2
+    b = numpy.array([[k**i for i in range(order+1)] for k in range(-halfWindow, halfWindow+1)], dtype=numpy.float64)
+    
+    kernel = numpy.linalg.pinv(b)[0]
+    kernel.setflags(write=False)
+    
+    return kernel
+# ----
+
+
+def _smoothsignal(signal, kernel, edges, cycles, inplace):
+    """Apply smoothing kernel to signal intensities.
+        signal (numpy array) - signal data points
+        kernel (numpy array) - symmetric filter weights of odd length
+        edges (reflect or edge) - numpy padding mode for signal ends
+        cycles (int) - number of repeating cycles
+        inplace (bool) - smooth given array by chunks instead of making new one
+    """
+    
+    # smooth given array by chunks
+    if inplace:
+        yAxis = signal[:,1]
+        while cycles:
+            _smoothchunks(yAxis, kernel, edges, SMOOTH_CHUNK)
+            cycles -= 1
+        return signal
+    
+    # smooth copy of intensities
+    yAxis = signal[:,1].copy()
+    halfWindow = len(kernel) // 2
+    while cycles:
+        
+        CHECK_FORCE_QUIT()
+        
+        yAxis = _convolve(numpy.pad(yAxis, halfWindow, mode=edges), kernel)
+        cycles -= 1
+    
+    # return smoothed data
+    return numpy.column_stack((signal[:,0], yAxis))
+# ----
+
+
+def _smoothchunks(yAxis, kernel, edges, chunkSize):
+    """Smooth intensities in place, one chunk at a time. Only the original
+    values overlapping previous chunk are kept aside, so memory use does not
+    depend on signal size."""
+    
+    halfWindow = len(kernel) // 2
+    chunkSize = max(chunkSize, 2*halfWindow+1)
+    length = len(yAxis)
+    
+    previous = yAxis[0:0].copy()
+    for start in range(0, length, chunkSize):
+        
+        CHECK_FORCE_QUIT()
+        
+        end = min(length, start + chunkSize)
+        stop = min(length, end + halfWindow)
+        
+        # get original values around chunk
+        data = numpy.concatenate((previous, yAxis[start:stop]))
+        padding = (halfWindow if start == 0 else 0, end + halfWindow - stop)
+        if padding != (0, 0):
+            data = numpy.pad(data, padding, mode=edges)
+        
+        # keep original values needed by next chunk
+        previous = yAxis[end-halfWindow:end].copy()
+        
+        # smooth chunk
+        yAxis[start:end] = _convolve(data, kernel)
+# ----
+
+
+def _convolve(data, kernel):
+    """Convolve padded data with symmetric kernel, keeping valid points only.
+    Long kernels are applied by FFT."""
+    
+    # direct convolution
+    if len(kernel) <= SMOOTH_FFT_KERNEL or len(data) <= SMOOTH_FFT_KERNEL:
+        return numpy.convolve(data, kernel, mode='valid')
+    
+    # fft convolution
+    size = 1
+    while size < len(data) + len(kernel) - 1:
+        size *= 2
+    
+    result = numpy.fft.irfft(numpy.fft.rfft(data, size) * numpy.fft.rfft(kernel, size), size)
+    
+    return result[len(kernel)-1:len(data)]
+# ----
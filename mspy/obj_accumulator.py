@@ -0,0 +1,216 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+#load libs
+import math
+import numpy
+
+# load stopper
+from .mod_stopper import CHECK_FORCE_QUIT
+
+# load objects
+from . import obj_scan
+
+
+# ACCUMULATOR OBJECT DEFINITION
+# -----------------------------
+
+class accumulator:
+    """Accumulate many spectra on one fixed m/z raster.
+    Each added signal is resampled onto the raster by linear interpolation
+    and added into preallocated buffer, so the cost is linear in the total
+    number of points regardless of the number of spectra.
+        minX (float) - raster start
+        maxX (float) - raster end
+        spacing (float) - raster spacing in given units
+        units (Da or ppm) - raster spacing units
+        raster (numpy array) - explicit m/z raster, used instead of range
+    """
+    
+    def __init__(self, minX=None, maxX=None, spacing=0.01, units='Da', raster=None):
+        
+        # use given raster
+        if raster is not None:
+            raster = numpy.array(raster, dtype=numpy.float64).flatten()
+            if len(raster) < 2 or numpy.any(numpy.diff(raster) <= 0):
+                raise ValueError("Raster must be sorted and contain at least two points!")
+        
+        # make raster
+        else:
+            if minX is None or maxX is None or maxX <= minX or spacing <= 0:
+                raise ValueError("Invalid raster range or spacing!")
+            
+            if units == 'Da':
+                count = int(math.floor((maxX - minX) / spacing)) + 1
+                raster = minX + numpy.arange(count) * spacing
+            
+            elif units == 'ppm':
+                if minX <= 0:
+                    raise ValueError("Raster with ppm spacing must start above zero!")
+                step = math.log1p(spacing / 1e6)
+                count = int(math.floor(math.log(maxX / minX) / step)) + 1
+                raster = minX * numpy.exp(numpy.arange(count) * step)
+            
+            else:
+                raise ValueError("Unknown units for raster spacing! -->" + units)
+        
+        self.raster = raster
+        self.count = 0
+        
+        # buffers
+        self._data = numpy.zeros(len(raster), dtype=numpy.float64)
+        self._coverage = numpy.zeros(len(raster), dtype=numpy.int32)
+        self._maximum = None
+    # ----
+    
+    
+    def __len__(self):
+        return self.count
+    # ----
+    
+    
+    
+    # SETTERS
+    
+    def add(self, signal, weight=1.):
+        """Add signal to accumulated data.
+            signal (numpy array or mspy.scan) - signal data points
+            weight (float) - signal multiplier
+        """
+        
+        i1, i2, y = self._resample(signal)
+        if y is not None:
+            if weight != 1.:
+                y *= weight
+            self._data[i1:i2] += y
+            self._coverage[i1:i2] += 1
+        
+        self.count += 1
+    # ----
+    
+    
+    def subtract(self, signal):
+        """Subtract signal from accumulated data.
+            signal (numpy array or mspy.scan) - signal data points
+        """
+        
+        i1, i2, y = self._resample(signal)
+        if y is not None:
+            self._data[i1:i2] -= y
+    # ----
+    
+    
+    def overlay(self, signal):
+        """Keep maximum of accumulated overlaid signals.
+            signal (numpy array or mspy.scan) - signal data points
+        """
+        
+        if self._maximum is None:
+            self._maximum = numpy.zeros(len(self.raster), dtype=numpy.float64)
+        
+        i1, i2, y = self._resample(signal)
+        if y is not None:
+            numpy.maximum(self._maximum[i1:i2], y, out=self._maximum[i1:i2])
+    # ----
+    
+    
+    def reset(self):
+        """Clear accumulated data."""
+        
+        self.count = 0
+        self._data[:] = 0.
+        self._coverage[:] = 0
+        self._maximum = None
+    # ----
+    
+    
+    
+    # GETTERS
+    
+    def profile(self, average=False, overlaid=False, crop=True):
+        """Get accumulated signal as new array.
+            average (bool) - divide sums by number of signals covering each point
+            overlaid (bool) - get maximum of overlaid signals instead of sums
+            crop (bool) - remove raster points not covered by any signal
+        """
+        
+        # get data
+        if overlaid:
+            if self._maximum is None:
+                data = numpy.zeros(len(self.raster), dtype=numpy.float64)
+            else:
+                data = self._maximum.copy()
+        elif average:
+            data = self._data / numpy.maximum(self._coverage, 1)
+        else:
+            data = self._data.copy()
+        
+        # remove uncovered points
+        if crop and not overlaid:
+            covered = numpy.flatnonzero(self._coverage)
+            if len(covered) == 0:
+                return numpy.zeros((0, 2), dtype=numpy.float64)
+            i1 = covered[0]
+            i2 = covered[-1] + 1
+            return numpy.column_stack((self.raster[i1:i2], data[i1:i2]))
+        
+        return numpy.column_stack((self.raster, data))
+    # ----
+    
+    
+    def scan(self, average=False, overlaid=False, crop=True):
+        """Get accumulated signal as new scan.
+            average (bool) - divide sums by number of signals covering each point
+            overlaid (bool) - get maximum of overlaid signals instead of sums
+            crop (bool) - remove raster points not covered by any signal
+        """
+        
+        return obj_scan.scan(profile=self.profile(average=average, overlaid=overlaid, crop=crop))
+    # ----
+    
+    
+    
+    # HELPERS
+    
+    def _resample(self, signal):
+        """Interpolate signal intensities at raster points within signal range."""
+        
+        CHECK_FORCE_QUIT()
+        
+        # get profile
+        if isinstance(signal, obj_scan.scan):
+            signal = signal.profile
+        if not isinstance(signal, numpy.ndarray):
+            raise TypeError("Signal must be NumPy array!")
+        
+        # check signal data
+        if len(signal) == 0:
+            return 0, 0, None
+        
+        # get covered raster
+        i1 = numpy.searchsorted(self.raster, signal[0][0], side='left')
+        i2 = numpy.searchsorted(self.raster, signal[-1][0], side='right')
+        if i1 >= i2:
+            return i1, i2, None
+        
+        # interpolate intensities
+        y = numpy.interp(self.raster[i1:i2], signal[:,0], signal[:,1])
+        
+        return i1, i2, y
+    # ----
+
+
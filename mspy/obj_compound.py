@@ -15,6 +15,9 @@
 #     main directory of the program.
 # -------------------------------------------------------------------------
 
+# load libs
+import numpy
+
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
 
@@ -51,18 +54,38 @@ class compound:
     # ----
     
     
+    def __add__(self, other):
+        """Get new compound of both formulas.
+        Compositions are merged directly so joined formula is never parsed.
+        """
+        
+        # check value
+        if not isinstance(other, compound):
+            other = compound(other)
+        
+        # make compound
+        result = compound('')
+        result.expression = self.expression + other.expression
+        result._composition = self._mergeComposition(other)
+        
+        return result
+    # ----
+    
+    
     def __iadd__(self, other):
         """Append formula."""
         
-        # check and append value
-        if isinstance(other, compound):
-            self.expression += other.expression
-        else:
-            self._checkFormula(other)
-            self.expression += other
+        # check value
+        if not isinstance(other, compound):
+            other = compound(other)
+        
+        # append value and merge compositions
+        composition = self._mergeComposition(other)
+        self.expression += other.expression
         
         # clear buffers
         self.reset()
+        self._composition = composition
         
         return self
     # ----
@@ -144,35 +167,8 @@ class compound:
         if self._composition is not None:
             return self._composition
         
-        # unfold brackets
-        unfoldedFormula = self._unfoldBrackets(self.expression)
-        
-        # group elements
-        self._composition = {}
-        for symbol, isotop, count in mod_basics.ELEMENT_PATTERN.findall(unfoldedFormula):
-            
-            # make atom
-            if isotop:
-                atom = '%s{%s}' % (symbol, isotop)
-            else:
-                atom = symbol
-            
-            # convert counting
-            if count:
-                count = int(count)
-            else:
-                count = 1
-            
-            # add atom
-            if atom in self._composition:
-                self._composition[atom] += count
-            else:
-                self._composition[atom] = count
-        
-        # remove zeros
-        for atom in list(self._composition.keys()):
-            if self._composition[atom] == 0:
-                del self._composition[atom]
+        # get cached composition
+        self._composition = dict(mod_basics.parseformula(self.expression))
         
         return self._composition
     # ----
@@ -264,7 +260,24 @@ class compound:
     # ----
     
     
-    def pattern(self, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True):
+    def mzs(self, charges, agentFormula='H', agentCharge=1):
+        """Get ion m/z for several charges at once.
+            charges (list of int) - ion charges
+        Returns numpy array of (Mo, Av) m/z for each charge.
+        """
+        
+        charges = numpy.asarray(charges)
+        masses = numpy.tile(self.mass(), (len(charges), 1))
+        
+        return mod_basics.mzarray(masses,
+            charges = charges,
+            agentFormula = agentFormula,
+            agentCharge = agentCharge
+        )
+    # ----
+    
+    
+    def pattern(self, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True, method='classic'):
         """Get isotopic pattern."""
         
         return mod_pattern.pattern(
@@ -274,7 +287,8 @@ class compound:
             charge = charge,
             agentFormula = agentFormula,
             agentCharge = agentCharge,
-            real = real
+            real = real,
+            method = method
         )
     # ----
     
@@ -295,12 +309,10 @@ class compound:
         
         # make ion compound
         if charge and agentFormula != 'e':
-            ionFormula = self.expression
-            for atom, count in agentFormula.composition().items():
-                ionFormula += '%s%d' % (atom, count*(charge/agentCharge))
-            ion = compound(ionFormula)
+            agentFormula = ''.join(['%s%d' % (atom, count*(charge/agentCharge)) for atom, count in agentFormula.composition().items()])
+            ion = self + agentFormula
         else:
-            ion = compound(self.expression)
+            ion = self
         
         # get composition
         for atom, count in ion.composition().items():
@@ -350,68 +362,20 @@ class compound:
     def _checkFormula(self, formula):
         """Check given formula."""
         
-        # check formula
-        if not mod_basics.FORMULA_PATTERN.match(formula):
-            raise ValueError('Wrong formula! --> ' + formula)
-        
-        # check elements and isotopes
-        for atom in mod_basics.ELEMENT_PATTERN.findall(formula):
-            if not atom[0] in blocks.elements:
-                raise ValueError('Unknown element in formula! --> ' + atom[0] + ' in ' + formula)
-            elif atom[1] and not int(atom[1]) in blocks.elements[atom[0]].isotopes:
-                raise ValueError('Unknown isotope in formula! --> ' + atom[0] + atom[1] + ' in ' + formula)
-        
-        # check brackets
-        if formula.count(')') != formula.count('('):
-            raise ValueError('Wrong number of brackets in formula! --> ' + formula)
+        # formula is checked by cached parser
+        mod_basics.parseformula(formula)
     # ----
     
     
-    def _unfoldBrackets(self, string):
-        """Unfold formula and count each atom."""
+    def _mergeComposition(self, other):
+        """Get composition of both compounds."""
         
-        unfoldedFormula = ''
-        brackets = [0,0]
-        enclosedFormula = ''
+        composition = dict(self.composition())
+        for atom, count in other.composition().items():
+            composition[atom] = composition.get(atom, 0) + count
+            if composition[atom] == 0:
+                del composition[atom]
         
-        i = 0
-        while i < len(string):
-            
-            # handle brackets
-            if string[i] == '(':
-                brackets[0] += 1
-            elif string[i] == ')':
-                brackets[1] += 1
-            
-            # part outside brackets
-            if brackets == [0,0]:
-                unfoldedFormula += string[i]
-            
-            # part within brackets
-            else:
-                enclosedFormula += string[i]
-                
-                # unfold part within brackets
-                if brackets[0] == brackets[1]:
-                    enclosedFormula = self._unfoldBrackets(enclosedFormula[1:-1])
-                    
-                    # multiply part within brackets
-                    count = ''
-                    while len(string)>(i+1) and string[i+1].isdigit():
-                        count += string[i+1]
-                        i += 1
-                    if count:
-                        enclosedFormula = enclosedFormula * int(count)
-                    
-                    # add and clear
-                    unfoldedFormula += enclosedFormula
-                    enclosedFormula = ''
-                    brackets = [0,0]
-            
-            i += 1
-            
-        return unfoldedFormula
+        return composition
     # ----
     
-    
-
@@ -15,6 +15,9 @@
 #     main directory of the program.
 # -------------------------------------------------------------------------
 
+# load libs
+import copy
+
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
 
@@ -25,14 +28,70 @@ from . import blocks
 from . import mod_basics
 
 
+# names of peak values stored in peaklist arrays
+PEAK_VALUES = ('mz', 'ai', 'base', 'sn', 'charge', 'isotope', 'fwhm', 'group', 'ri')
+
+
+# PEAK VALUE DESCRIPTOR
+# ---------------------
+
+class _value:
+    """Peak value stored in peak itself or in owning peaklist arrays."""
+    
+    def __init__(self, name):
+        self.name = name
+        self.local = '_' + name
+    # ----
+    
+    
+    def __get__(self, peak, cls):
+        
+        if peak is None:
+            return self
+        
+        if peak._owner is None:
+            return getattr(peak, self.local)
+        
+        return peak._owner._getvalue(self.name, peak._row)
+    # ----
+    
+    
+    def __set__(self, peak, value):
+        
+        if peak._owner is None:
+            setattr(peak, self.local, value)
+        else:
+            peak._owner._setvalue(self.name, peak._row, value)
+    # ----
+
+
+
 # PEAK OBJECT DEFINITION
 # ----------------------
 
 class peak:
-    """Peak object definition."""
+    """Peak object definition.
+    Peaks stored in peaklist are views of peaklist arrays, values of
+    standalone peaks are kept in peak itself."""
+    
+    mz = _value('mz')
+    ai = _value('ai')
+    base = _value('base')
+    sn = _value('sn')
+    charge = _value('charge')
+    isotope = _value('isotope')
+    fwhm = _value('fwhm')
+    group = _value('group')
+    ri = _value('ri')
+    
+    __slots__ = ('_owner', '_row', '_mz', '_ai', '_base', '_sn', '_charge', '_isotope', '_fwhm', '_group', '_ri', '_childScanNumber', '_mass', '_attributes', '__weakref__')
     
     def __init__(self, mz, ai=0., base=0., sn=None, charge=None, isotope=None, fwhm=None, group='', **attr):
         
+        # set owner
+        self._owner = None
+        self._row = None
+        
         self.mz = float(mz)
         self.ai = float(ai)
         self.base = float(base)
@@ -44,44 +103,113 @@ class peak:
         
         self.childScanNumber = None
         
-        # set intensity
+        # set relative intensity
         self.ri = 1.
-        self.intensity = self.ai - self.base
-        
-        # set resolution
-        self.resolution = None
-        if self.fwhm:
-            self.resolution = self.mz/self.fwhm
         
         # set buffers
         self._mass = None
         
         # get additional attributes
-        self.attributes = {}
-        for name, value in attr.items():
-            self.attributes[name] = value
+        self._attributes = None
+        if attr:
+            self._attributes = dict(attr)
+    # ----
+    
+    
+    def __copy__(self):
+        """Get standalone copy of peak sharing additional attributes."""
+        
+        dupl = peak.__new__(peak)
+        dupl._owner = None
+        dupl._row = None
+        dupl._mz, dupl._ai, dupl._base, dupl._sn, dupl._charge, dupl._isotope, dupl._fwhm, dupl._group, dupl._ri = self._values()
+        dupl._childScanNumber = self._childScanNumber
+        dupl._mass = self._mass
+        dupl._attributes = self._attributes
+        
+        return dupl
+    # ----
+    
+    
+    def __deepcopy__(self, memo):
+        """Get standalone copy of peak."""
+        
+        dupl = self.__copy__()
+        if self._attributes:
+            dupl._attributes = copy.deepcopy(self._attributes, memo)
+        
+        return dupl
+    # ----
+    
+    
+    @property
+    def attributes(self):
+        """Get additional attributes, created on first access."""
+        
+        if self._attributes is None:
+            self.attributes = {}
+        
+        return self._attributes
+    # ----
+    
+    
+    @attributes.setter
+    def attributes(self, value):
+        self._attributes = value
+        
+        # make owning peaklist keep the view
+        if value is not None and self._owner is not None:
+            self._owner._keep(self)
+    # ----
+    
+    
+    @property
+    def childScanNumber(self):
+        """Get number of fragmentation scan."""
+        return self._childScanNumber
+    # ----
+    
+    
+    @childScanNumber.setter
+    def childScanNumber(self, value):
+        self._childScanNumber = value
+        
+        # make owning peaklist keep the view
+        if value is not None and self._owner is not None:
+            self._owner._keep(self)
     # ----
     
     
     def reset(self):
-        """Clear peak buffers and set intensity and resolution."""
+        """Clear peak buffers."""
         
         # clear mass buffer
         self._mass = None
-        
-        # update intensity
-        self.intensity = self.ai - self.base
-        
-        # update resolution
-        self.resolution = None
-        if self.fwhm:
-            self.resolution = self.mz/self.fwhm
     # ----
     
     
     
     # GETTERS
     
+    @property
+    def intensity(self):
+        """Get peak intensity above baseline."""
+        return self.ai - self.base
+    # ----
+    
+    
+    @property
+    def resolution(self):
+        """Get peak resolution."""
+        
+        fwhm = self.fwhm
+        if fwhm:
+            return self.mz/fwhm
+        
+        return None
+    # ----
+    
+    
     def mass(self):
         """Get neutral peak mass."""
         
@@ -109,11 +237,6 @@ class peak:
         # update value
         self.mz = mz
         
-        # update resolution
-        self.resolution = None
-        if self.fwhm:
-            self.resolution = self.mz/self.fwhm
-        
         # clear mass buffer
         self._mass = None
     # ----
@@ -121,23 +244,13 @@ class peak:
     
     def setai(self, ai):
         """Set new a.i. value."""
-        
-        # update value
         self.ai = ai
-        
-        # update intensity
-        self.intensity = self.ai - self.base
     # ----
     
     
     def setbase(self, base):
         """Set new baseline value."""
-        
-        # update value
         self.base = base
-        
-        # update intensity
-        self.intensity = self.ai - self.base
     # ----
     
     
@@ -166,14 +279,7 @@ class peak:
     
     def setfwhm(self, fwhm):
         """Set new fwhm value."""
-        
-        # update value
         self.fwhm = fwhm
-        
-        # update resolution
-        self.resolution = None
-        if self.fwhm:
-            self.resolution = self.mz/self.fwhm
     # ----
     
     
@@ -193,4 +299,37 @@ class peak:
     # ----
     
     
+    
+    # HELPERS
+    
+    def _attach(self, owner, row):
+        """Make peak a view of given peaklist row."""
+        
+        self._owner = owner
+        self._row = row
+    # ----
+    
+    
+    def _detach(self):
+        """Copy values from owning peaklist and make peak standalone."""
+        
+        if self._owner is None:
+            return
+        
+        self._mz, self._ai, self._base, self._sn, self._charge, self._isotope, self._fwhm, self._group, self._ri = self._values()
+        self._owner = None
+        self._row = None
+    # ----
+    
+    
+    def _values(self):
+        """Get all stored values in PEAK_VALUES order."""
+        
+        if self._owner is None:
+            return (self._mz, self._ai, self._base, self._sn, self._charge, self._isotope, self._fwhm, self._group, self._ri)
+        
+        return tuple(self._owner._getvalue(name, self._row) for name in PEAK_VALUES)
+    # ----
+
+
 
@@ -19,6 +19,8 @@
 import numpy
 import re
 import copy
+import operator
+import weakref
 
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
@@ -27,28 +29,48 @@ from .mod_stopper import CHECK_FORCE_QUIT
 from . import obj_peak
 
 # load modules
+from . import mod_basics
 from . import mod_peakpicking
 
 
+# value used for unset charge and isotope in peaklist arrays
+PEAKLIST_NONE = numpy.iinfo(numpy.int32).min
+
+
 # PEAKLIST OBJECT DEFINITION
 # --------------------------
 
 class peaklist:
-    """Peaklist object definition."""
-    
-    def __init__(self, peaks=[]):
+    """Peaklist object definition.
+    Peak values are stored as contiguous arrays, peak objects are created
+    on demand as views of single rows. Unset s/n and fwhm are stored as NaN,
+    unset charge and isotope as PEAKLIST_NONE, group names are interned.
+        peaks (list of peaks, list of [#, #] or numpy array) - initial peaks
+        columns (list or tuple) - value names of numpy array columns
+    """
+    
+    def __init__(self, peaks=[], columns=None):
+        
+        # init data
+        self._resize(0)
+        self._groups = ['']
+        self._groupCodes = {'': 0}
+        self._views = weakref.WeakValueDictionary()
+        self._kept = {}
+        self.basepeak = None
         
-        # check data
-        self.peaks = []
-        for item in peaks:
-            item = self._checkPeak(item)
-            self.peaks.append(item)
+        # store data
+        if isinstance(peaks, numpy.ndarray):
+            self._insertarray(peaks, columns)
+        elif isinstance(peaks, peaklist):
+            self.combine(peaks)
+        else:
+            self._insert(peaks)
         
         # sort peaklist by m/z
         self.sort()
         
         # set basepeak
-        self.basepeak = None
         self._setbasepeak()
         
         # set relative intensities
@@ -57,35 +79,42 @@ class peaklist:
     
     
     def __len__(self):
-        return len(self.peaks)
+        return len(self._mz)
     # ----
     
     
     def __setitem__(self, i, item):
         
         # check item
+        i = self._checkIndex(i)
         item = self._checkPeak(item)
         
+        # release current peak
+        isBasepeak = self.basepeak is not None and self.basepeak is self._views.get(i)
+        current = self._views.pop(i, None)
+        self._kept.pop(i, None)
+        if current is not None:
+            current._detach()
+        
+        # store values
+        self._write(i, item)
+        
         # basepeak is edited - set new
-        if self.peaks[i] is self.basepeak:
-            self.peaks[i] = item
+        if isBasepeak:
             self._setbasepeak()
             self._setRelativeIntensities()
         
         # new basepeak set
-        elif self.basepeak and item.intensity > self.basepeak.intensity:
-            self.peaks[i] = item
-            self.basepeak = item
+        elif self.basepeak and self.intensities(i) > self.basepeak.intensity:
+            self.basepeak = self._view(i)
             self._setRelativeIntensities()
         
         # lower than basepeak
-        elif self.basepeak:
-            item.ri = item.intensity / self.basepeak.intensity
-            self.peaks[i] = item
+        elif self.basepeak and self.basepeak.intensity != 0:
+            self._setvalue('ri', i, self.intensities(i) / self.basepeak.intensity)
         
         # no basepeak set
         else:
-            self.peaks[i] = item
             self._setbasepeak()
             self._setRelativeIntensities()
         
@@ -95,21 +124,17 @@ class peaklist:
     
     
     def __getitem__(self, i):
-        return self.peaks[i]
+        
+        # get slice
+        if isinstance(i, slice):
+            return [self._view(x) for x in range(*i.indices(len(self)))]
+        
+        return self._view(self._checkIndex(i))
     # ----
     
     
     def __delitem__(self, i):
-        
-        # delete basepeak
-        if self.peaks[i] is self.basepeak:
-            del self.peaks[i]
-            self._setbasepeak()
-            self._setRelativeIntensities()
-        
-        # delete others
-        else:
-            del self.peaks[i]
+        self.delete([self._checkIndex(i)])
     # ----
     
     
@@ -137,50 +162,54 @@ class peaklist:
     # ----
     
     
+    def __deepcopy__(self, memo):
+        return self.duplicate()
+    # ----
+    
+    
     def next(self):
         
-        if self._index < len(self.peaks):
+        if self._index < len(self):
             self._index += 1
-            return self.peaks[self._index-1]
+            return self._view(self._index-1)
         else:
             raise StopIteration
     # ----
-
+    
     def __next__(self):  # added gy
-        
+    
         return self.next()
     
     # ----
-        
+    
     
     def append(self, item):
         """Append new peak.
             item (peak or [#, #] or (#,#)) - peak to be added
         """
         
-        # check peak
-        item = self._checkPeak(item)
-        
-        # add peak and sort peaklist
-        if self.peaks and self.peaks[-1].mz > item.mz:
-            self.peaks.append(item)
-            self.sort()
-        else:
-            self.peaks.append(item)
+        # add peak
+        i = len(self)
+        self._insert([item])
+        intensity = self.intensities(i)
         
         # new basepeak set
-        if self.basepeak and item.intensity > self.basepeak.intensity:
-            self.basepeak = item
+        if self.basepeak and intensity > self.basepeak.intensity:
+            self.basepeak = self._view(i)
             self._setRelativeIntensities()
         
         # lower than basepeak
         elif self.basepeak and self.basepeak.intensity != 0:
-            item.ri = item.intensity / self.basepeak.intensity
+            self._setvalue('ri', i, intensity / self.basepeak.intensity)
         
         # no basepeak set
         else:
-            item.ri = 1.
+            self._setvalue('ri', i, 1.)
             self._setbasepeak()
+        
+        # sort peaklist
+        if i and self._mz[i-1] > self._mz[i]:
+            self.sort()
     # ----
     
     
@@ -198,7 +227,78 @@ class peaklist:
     
     def duplicate(self):
         """Return copy of current peaklist."""
-        return copy.deepcopy(self)
+        return self._copy(share=False)
+    # ----
+    
+    
+    def snapshot(self):
+        """Return copy of current peaklist sharing value arrays with original.
+        Shared arrays are made read-only and copied before first change."""
+        return self._copy(share=True)
+    # ----
+    
+    
+    def nbytes(self):
+        """Return sizes of value arrays as dict of buffer ID and size."""
+        
+        buff = {}
+        for name in obj_peak.PEAK_VALUES:
+            owner = getattr(self, '_'+name)
+            while isinstance(owner.base, numpy.ndarray):
+                owner = owner.base
+            buff[id(owner)] = owner.nbytes
+        
+        return buff
+    # ----
+    
+    
+    def values(self, name):
+        """Get copy of selected values of all peaks as numpy array.
+            name (mz, ai, base, sn, charge, isotope, fwhm, ri, intensity) - value name
+        Returns float array with NaN for unset values.
+        """
+        
+        # get intensities
+        if name == 'intensity':
+            return self._ai - self._base
+        
+        # check name
+        if not name in obj_peak.PEAK_VALUES or name == 'group':
+            raise KeyError("Unknown peak value! --> " + name)
+        
+        # get values
+        values = getattr(self, '_'+name).astype(numpy.float64)
+        if name in ('charge', 'isotope'):
+            values[getattr(self, '_'+name) == PEAKLIST_NONE] = numpy.nan
+        
+        return values
+    # ----
+    
+    
+    def intensities(self, i=None):
+        """Get peak intensity of given row or intensities of all peaks.
+            i (int or None) - peak index
+        """
+        
+        if i is None:
+            return self._ai - self._base
+        
+        return float(self._ai[i] - self._base[i])
+    # ----
+    
+    
+    def masses(self, massType=0):
+        """Get neutral masses of all peaks in one pass.
+            massType (0 or 1) - mass type used for agent mass, 0 = monoisotopic, 1 = average
+        Returns numpy array, NaN for peaks without charge.
+        """
+        
+        charges = numpy.where(self._charge == PEAKLIST_NONE, 0, self._charge).astype(numpy.float64)
+        
+        masses = mod_basics.mzarray(self._mz, 0, currentCharges=charges, massType=massType)
+        masses[charges == 0] = numpy.nan
+        
+        return masses
     # ----
     
     
@@ -206,10 +306,8 @@ class peaklist:
         """Get available group name."""
         
         # get used names
-        used = []
-        for peak in self.peaks:
-            if peak.group is not None and not peak.group in used:
-                used.append(peak.group)
+        used = [self._groups[code] for code in numpy.unique(self._group).tolist()]
+        used = [name for name in used if name is not None]
         
         # generate new name
         size = 1
@@ -227,14 +325,44 @@ class peaklist:
     def sort(self):
         """Sort peaks according to m/z."""
         
-        buff = []
-        for item in self.peaks:
-            buff.append((item.mz, item))
-        buff.sort()
+        # check order
+        if numpy.all(self._mz[1:] >= self._mz[:-1]):
+            return
+        
+        # reorder rows
+        self._take(numpy.argsort(self._mz, kind='mergesort'))
+    # ----
+    
+    
+    def setvalues(self, name, values):
+        """Set selected values of all peaks at once.
+            name (mz, ai, base, sn, charge, isotope, fwhm, group) - value name
+            values (list or numpy array) - new values, None or NaN for unset
+        """
         
-        self.peaks = []
-        for item in buff:
-            self.peaks.append(item[1])
+        # check name
+        if not name in obj_peak.PEAK_VALUES or name == 'ri':
+            raise KeyError("Unknown peak value! --> " + name)
+        
+        # check values
+        if len(values) != len(self):
+            raise ValueError("Number of values doesn't match peaklist!")
+        
+        # convert values
+        if name == 'group':
+            values = numpy.array([self._intern(value) for value in values], dtype=numpy.int32)
+        elif name in ('charge', 'isotope'):
+            values = numpy.array([PEAKLIST_NONE if value is None or value != value else value for value in values], dtype=numpy.int32)
+        else:
+            values = numpy.array([numpy.nan if value is None else value for value in values], dtype=numpy.float64)
+        
+        # store values
+        setattr(self, '_'+name, values)
+        self._clearbuffers()
+        
+        # update peaklist
+        if name in ('mz', 'ai', 'base'):
+            self.reset()
     # ----
     
     
@@ -244,18 +372,16 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self) or not len(indexes):
             return
         
         # delete peaks
-        relint = False
-        for i in sorted(indexes, reverse=True):
-            if self.peaks[i] is self.basepeak:
-                relint = True
-            del self.peaks[i]
+        keep = numpy.ones(len(self), dtype=bool)
+        keep[numpy.asarray(indexes, dtype=numpy.intp)] = False
+        self._take(numpy.flatnonzero(keep))
         
         # recalculate basepeak and relative intensities
-        if relint:
+        if self.basepeak is not None and self.basepeak._owner is not self:
             self._setbasepeak()
             self._setRelativeIntensities()
     # ----
@@ -264,7 +390,7 @@ class peaklist:
     def empty(self):
         """Remove all peaks."""
         
-        del self.peaks[:]
+        self._take(numpy.zeros(0, dtype=numpy.intp))
         self.basepeak = None
     # ----
     
@@ -276,17 +402,11 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
-        # get indexes to delete
-        indexes = []
-        for x, peak in enumerate(self.peaks):
-            if peak.mz < minX or peak.mz > maxX:
-                indexes.append(x)
-        
         # delete peaks
-        self.delete(indexes)
+        self.delete(numpy.flatnonzero((self._mz < minX) | (self._mz > maxX)))
     # ----
     
     
@@ -296,13 +416,12 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
         # multiply all peaks
-        for peak in self.peaks:
-            peak.setai(peak.ai * y)
-            peak.setbase(peak.base * y)
+        self._ai = self._ai * y
+        self._base = self._base * y
         
         # update peaklist
         self._setbasepeak()
@@ -313,14 +432,23 @@ class peaklist:
     def combine(self, other):
         """Add data from given peaklist."""
         
-        # check peaks
-        buff = []
-        for peak in copy.deepcopy(other):
-            peak = self._checkPeak(peak)
-            buff.append(peak)
-        
-        # store peaks
-        self.peaks += buff
+        # add peaks from list
+        if not isinstance(other, peaklist):
+            self._insert([copy.deepcopy(peak) for peak in other])
+        
+        # add peaklist arrays
+        elif len(other):
+            count = len(self)
+            codes = numpy.array([self._intern(name) for name in other._groups], dtype=numpy.int32)
+            for name in obj_peak.PEAK_VALUES:
+                values = getattr(other, '_'+name)
+                if name == 'group':
+                    values = codes[values]
+                setattr(self, '_'+name, numpy.concatenate((getattr(self, '_'+name), values)))
+            
+            # copy additional peak data
+            for row, view in other._kept.items():
+                self._copyextra(count + row, view)
         
         # update peaklist
         self.sort()
@@ -336,12 +464,12 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
         # apply calibration
-        for peak in self.peaks:
-            peak.setmz( fn(params, peak.mz) )
+        self._mz = numpy.array(fn(params, self._mz), dtype=numpy.float64)
+        self._clearbuffers()
     # ----
     
     
@@ -354,7 +482,7 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
         # find isotopes
@@ -374,7 +502,7 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
         # deconvolute peaklist
@@ -384,12 +512,8 @@ class peaklist:
         )
         
         # store data
-        self.peaks[:] = peaks.peaks[:]
-        
-        # update peaklist
-        self.sort()
-        self._setbasepeak()
-        self._setRelativeIntensities()
+        self.empty()
+        self.combine(peaks)
     # ----
     
     
@@ -400,50 +524,59 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
+        # get data
+        mzs = self._mz.tolist()
+        ais = self._ai.tolist()
+        bases = self._base.tolist()
+        fwhms = numpy.nan_to_num(self._fwhm).tolist()
+        
         # group peaks
-        buff = []
-        buff.append(self.peaks[0])
-        for current in self.peaks[1:]:
-            previous = buff[-1]
+        buff = [0]
+        for x in range(1, len(mzs)):
+            p = buff[-1]
             
             # set window
             win = window
-            if not forceWindow and previous.fwhm and current.fwhm:
-                win = (previous.fwhm + current.fwhm) / 8.
+            if not forceWindow and fwhms[p] and fwhms[x]:
+                win = (fwhms[p] + fwhms[x]) / 8.
             
             # group with previous peak
-            if (previous.mz + win) > current.mz:
+            if (mzs[p] + win) > mzs[x]:
                 
                 # get intensity
-                intensity = previous.intensity + current.intensity
-                ai = intensity + previous.base
+                previousIntensity = ais[p] - bases[p]
+                intensity = previousIntensity + ais[x] - bases[x]
                 
                 # get m/z
-                mz = (previous.mz*previous.intensity + current.mz*current.intensity) / intensity
+                mz = (mzs[p]*previousIntensity + mzs[x]*(ais[x] - bases[x])) / intensity
                 
                 # get fwhm
-                fwhm = previous.fwhm
-                if previous.fwhm and current.fwhm:
-                    fwhm = (previous.fwhm*previous.intensity + current.fwhm*current.intensity) / intensity
+                if fwhms[p] and fwhms[x]:
+                    fwhms[p] = (fwhms[p]*previousIntensity + fwhms[x]*(ais[x] - bases[x])) / intensity
                 
                 # update previous peak
-                buff[-1].setmz(mz)
-                buff[-1].setai(ai)
-                buff[-1].setfwhm(fwhm)
+                mzs[p] = mz
+                ais[p] = intensity + bases[p]
             
             # add new peak
             else:
-                buff.append(current)
+                buff.append(x)
         
-        # remove group names
-        for peak in buff:
-            peak.setgroup('')
+        # update grouped peaks
+        fwhms = numpy.array(fwhms)
+        self._mz = numpy.array(mzs)
+        self._ai = numpy.array(ais)
+        self._fwhm = numpy.where(numpy.isnan(self._fwhm), numpy.nan, fwhms)
+        self._clearbuffers()
         
-        # store data
-        self.peaks[:] = buff[:]
+        # remove grouped peaks
+        self._take(numpy.array(buff, dtype=numpy.intp))
+        
+        # remove group names
+        self._group = numpy.full(len(self), self._intern(''), dtype=numpy.int32)
         
         # update peaklist
         self.sort()
@@ -460,21 +593,17 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
         # get absolute threshold
         threshold = self.basepeak.intensity * relThreshold
         threshold = max(threshold, absThreshold)
         
-        # get indexes to delete
-        indexes = []
-        for x, peak in enumerate(self.peaks):
-            if peak.intensity < threshold or (peak.sn is not None and peak.sn < snThreshold):
-                indexes.append(x)
-        
         # delete peaks
-        self.delete(indexes)
+        with numpy.errstate(invalid='ignore'):
+            indexes = (self.intensities() < threshold) | (self._sn < snThreshold)
+        self.delete(numpy.flatnonzero(indexes))
     # ----
     
     
@@ -486,41 +615,32 @@ class peaklist:
         """
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
         # get possible parent peaks
-        candidates = []
-        for peak in self.peaks:
-            if not peak.sn or peak.sn*relThreshold > 3:
-                candidates.append(peak)
-            
+        sns = numpy.nan_to_num(self._sn)
+        candidates = numpy.flatnonzero((sns == 0) | (sns*relThreshold > 3))
+        
+        # get shoulder windows
+        widths = numpy.nan_to_num(self._fwhm[candidates])
+        widths[widths == 0] = fwhm or 0.
+        candidates = candidates[widths != 0]
+        widths = widths[widths != 0] * window
+        lowIndexes = numpy.searchsorted(self._mz, self._mz[candidates] - widths, side='right')
+        highIndexes = numpy.searchsorted(self._mz, self._mz[candidates] + widths, side='left')
+        
+        # get intensity thresholds
+        intensities = self.intensities()
+        thresholds = intensities[candidates] * relThreshold
+        
         # filter shoulder peaks
-        indexes = []
-        for parent in candidates:
-            
-            # get shoulder window
-            if parent.fwhm:
-                lowMZ = parent.mz - parent.fwhm * window
-                highMZ = parent.mz + parent.fwhm * window
-            elif fwhm:
-                lowMZ = parent.mz - fwhm * window
-                highMZ = parent.mz + fwhm * window
-            else:
-                continue
-            
-            # get intensity threshold
-            intThreshold = parent.intensity * relThreshold
-            
-            # get indexes to delete
-            for x, peak in enumerate(self.peaks):
-                if (lowMZ < peak.mz < highMZ) and (peak.intensity < intThreshold) and (not x in indexes):
-                    indexes.append(x)
-                if peak.mz > highMZ:
-                    break
+        indexes = numpy.zeros(len(self), dtype=bool)
+        for i1, i2, threshold in zip(lowIndexes.tolist(), highIndexes.tolist(), thresholds.tolist()):
+            indexes[i1:i2] |= intensities[i1:i2] < threshold
         
         # delete peaks
-        self.delete(indexes)
+        self.delete(numpy.flatnonzero(indexes))
     # ----
     
     
@@ -528,17 +648,11 @@ class peaklist:
         """Remove isotopes."""
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
-        # get indexes to delete
-        indexes = []
-        for x, peak in enumerate(self.peaks):
-            if peak.isotope != 0 and peak.charge is not None:
-                indexes.append(x)
-        
         # delete peaks
-        self.delete(indexes)
+        self.delete(numpy.flatnonzero((self._isotope != 0) & (self._charge != PEAKLIST_NONE)))
     # ----
     
     
@@ -546,17 +660,11 @@ class peaklist:
         """Remove uncharged peaks."""
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
-        # get indexes to delete
-        indexes = []
-        for x, peak in enumerate(self.peaks):
-            if peak.charge is None:
-                indexes.append(x)
-        
         # delete peaks
-        self.delete(indexes)
+        self.delete(numpy.flatnonzero(self._charge == PEAKLIST_NONE))
     # ----
     
     
@@ -564,11 +672,11 @@ class peaklist:
     # HELPERS
     def _checkPeak(self, item):
         """Check item to be a valid peak with strict float values."""
-
+        
         # already a peak instance
         if isinstance(item, obj_peak.peak):
             return item
-
+        
         # create peak from list/tuple of exactly two floats
         elif isinstance(item, (list, tuple)) and len(item) == 2:
             mz, ai = item
@@ -576,26 +684,274 @@ class peaklist:
                 return obj_peak.peak(mz, ai)
             else:
                 raise TypeError("Both values in item must be floats (not int, str, or other types).")
-
+        
         # fallback
         raise TypeError("Item must be a peak object or a list/tuple of two floats.")
     
     
+    def _copy(self, share):
+        """Return copy of current peaklist, shared or with own arrays."""
+        
+        # copy arrays
+        dupl = peaklist()
+        for name in obj_peak.PEAK_VALUES:
+            values = getattr(self, '_'+name)
+            if share:
+                values.flags.writeable = False
+            else:
+                values = values.copy()
+            setattr(dupl, '_'+name, values)
+        dupl._groups = self._groups[:]
+        dupl._groupCodes = self._groupCodes.copy()
+        
+        # copy additional peak data
+        for row, view in self._kept.items():
+            dupl._copyextra(row, view)
+        
+        # set basepeak
+        if self.basepeak is not None:
+            dupl.basepeak = dupl._view(self.basepeak._row)
+        
+        return dupl
+    # ----
+    
+    
+    def _checkIndex(self, i):
+        """Check peak index and make it positive."""
+        
+        i = operator.index(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Peaklist index out of range!")
+        
+        return i
+    # ----
+    
+    
+    def _view(self, row):
+        """Get peak object of given row. Views are held weakly unless they
+        carry additional data, so walking big peaklist doesn't keep all of them."""
+        
+        peak = self._views.get(row)
+        if peak is None:
+            peak = obj_peak.peak(0.)
+            self._addview(row, peak)
+        
+        return peak
+    # ----
+    
+    
+    def _addview(self, row, peak):
+        """Make peak a view of given row."""
+        
+        peak._attach(self, row)
+        self._views[row] = peak
+        if peak._attributes is not None or peak._childScanNumber is not None:
+            self._kept[row] = peak
+    # ----
+    
+    
+    def _keep(self, peak):
+        """Keep view carrying additional data."""
+        self._kept[peak._row] = peak
+    # ----
+    
+    
+    def _copyextra(self, row, peak):
+        """Copy additional data of given peak to view of given row."""
+        
+        if peak._attributes or peak._childScanNumber is not None:
+            view = self._view(row)
+            view.childScanNumber = peak._childScanNumber
+            view.attributes = copy.deepcopy(peak._attributes)
+    # ----
+    
+    
+    def _getvalue(self, name, row):
+        """Get single value of given row."""
+        
+        value = getattr(self, '_'+name)[row]
+        
+        if name == 'group':
+            return self._groups[value]
+        elif name in ('charge', 'isotope'):
+            return None if value == PEAKLIST_NONE else int(value)
+        elif name in ('sn', 'fwhm'):
+            return None if numpy.isnan(value) else float(value)
+        
+        return float(value)
+    # ----
+    
+    
+    def _setvalue(self, name, row, value):
+        """Set single value of given row."""
+        
+        if name == 'group':
+            value = self._intern(value)
+        elif value is None:
+            value = PEAKLIST_NONE if name in ('charge', 'isotope') else numpy.nan
+        
+        # copy shared array before change
+        values = getattr(self, '_'+name)
+        if not values.flags.writeable:
+            values = values.copy()
+            setattr(self, '_'+name, values)
+        
+        values[row] = value
+    # ----
+    
+    
+    def _resize(self, count):
+        """Make empty arrays for given number of peaks."""
+        
+        self._mz = numpy.zeros(count, dtype=numpy.float64)
+        self._ai = numpy.zeros(count, dtype=numpy.float64)
+        self._base = numpy.zeros(count, dtype=numpy.float64)
+        self._sn = numpy.full(count, numpy.nan)
+        self._charge = numpy.full(count, PEAKLIST_NONE, dtype=numpy.int32)
+        self._isotope = numpy.full(count, PEAKLIST_NONE, dtype=numpy.int32)
+        self._fwhm = numpy.full(count, numpy.nan)
+        self._group = numpy.zeros(count, dtype=numpy.int32)
+        self._ri = numpy.ones(count, dtype=numpy.float64)
+    # ----
+    
+    
+    def _arrays(self):
+        """Get current value arrays by value name."""
+        return dict((name, getattr(self, '_'+name)) for name in obj_peak.PEAK_VALUES)
+    # ----
+    
+    
+    def _insert(self, items):
+        """Append peaks at the end of arrays without sorting.
+        Standalone peak objects become views of new rows."""
+        
+        # check peaks
+        peaks = [self._checkPeak(item) for item in items]
+        if not peaks:
+            return
+        
+        # append values
+        count = len(self)
+        for name in obj_peak.PEAK_VALUES:
+            if name == 'group':
+                values = numpy.array([self._intern(peak.group) for peak in peaks], dtype=numpy.int32)
+            elif name in ('charge', 'isotope'):
+                values = numpy.array([PEAKLIST_NONE if v is None else v for v in [getattr(peak, name) for peak in peaks]], dtype=numpy.int32)
+            else:
+                values = numpy.array([numpy.nan if v is None else v for v in [getattr(peak, name) for peak in peaks]], dtype=numpy.float64)
+            setattr(self, '_'+name, numpy.concatenate((getattr(self, '_'+name), values)))
+        
+        # use standalone peaks as views, copy additional data of owned peaks
+        for x, peak in enumerate(peaks):
+            if peak._owner is None:
+                self._addview(count + x, peak)
+            else:
+                self._copyextra(count + x, peak)
+    # ----
+    
+    
+    def _insertarray(self, data, columns):
+        """Append peaks from numpy array at the end of arrays without sorting."""
+        
+        # check data
+        data = numpy.asarray(data, dtype=numpy.float64)
+        if data.size == 0:
+            return
+        if data.ndim != 2 or data.shape[1] < 2:
+            raise TypeError("Peaks array must have at least two columns!")
+        
+        # check columns
+        if columns is None:
+            columns = ('mz', 'ai', 'base')[:data.shape[1]]
+        if len(columns) != data.shape[1]:
+            raise ValueError("Number of column names doesn't match peaks array!")
+        for name in columns:
+            if not name in obj_peak.PEAK_VALUES or name == 'group':
+                raise KeyError("Unknown peak value! --> " + name)
+        
+        # append values
+        current = self._arrays()
+        self._resize(len(data))
+        for x, name in enumerate(columns):
+            values = data[:,x]
+            if name in ('charge', 'isotope'):
+                values = numpy.where(numpy.isnan(values), PEAKLIST_NONE, values).astype(numpy.int32)
+            setattr(self, '_'+name, values.copy())
+        for name, values in current.items():
+            setattr(self, '_'+name, numpy.concatenate((values, getattr(self, '_'+name))))
+    # ----
+    
+    
+    def _write(self, row, peak):
+        """Store values of given peak to existing row."""
+        
+        for name in obj_peak.PEAK_VALUES:
+            self._setvalue(name, row, getattr(peak, name))
+        
+        if peak._owner is None:
+            self._addview(row, peak)
+        else:
+            self._copyextra(row, peak)
+    # ----
+    
+    
+    def _take(self, rows):
+        """Keep given rows in given order."""
+        
+        # map old rows to new
+        mapping = numpy.full(len(self), -1, dtype=numpy.intp)
+        mapping[rows] = numpy.arange(len(rows))
+        mapping = mapping.tolist()
+        
+        # release removed peaks
+        views = weakref.WeakValueDictionary()
+        for row, peak in list(self._views.items()):
+            if mapping[row] == -1:
+                peak._detach()
+            else:
+                peak._row = mapping[row]
+                views[peak._row] = peak
+        self._views = views
+        self._kept = dict((peak._row, peak) for row, peak in self._kept.items() if mapping[row] != -1)
+        
+        # reorder arrays
+        for name in obj_peak.PEAK_VALUES:
+            setattr(self, '_'+name, getattr(self, '_'+name)[rows])
+    # ----
+    
+    
+    def _intern(self, name):
+        """Get code of group name."""
+        
+        code = self._groupCodes.get(name)
+        if code is None:
+            code = self._groupCodes[name] = len(self._groups)
+            self._groups.append(name)
+        
+        return code
+    # ----
+    
+    
+    def _clearbuffers(self):
+        """Clear buffers of existing peak objects."""
+        
+        for peak in list(self._views.values()):
+            peak.reset()
+    # ----
+    
+    
     def _setbasepeak(self):
         """Get most intens peak."""
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             self.basepeak = None
             return
         
         # set new basepeak
-        self.basepeak = self.peaks[0]
-        maxInt = self.basepeak.intensity
-        for item in self.peaks[1:]:
-            if item.intensity > maxInt:
-                self.basepeak = item
-                maxInt = item.intensity
+        self.basepeak = self._view(int(numpy.argmax(self.intensities())))
     # ----
     
     
@@ -603,17 +959,15 @@ class peaklist:
         """Set relative intensities for all peaks."""
         
         # check peaklist
-        if not self.peaks:
+        if not len(self):
             return
         
         # set relative intensities
         maxInt = self.basepeak.intensity
         if maxInt:
-            for item in self.peaks:
-                item.ri = item.intensity / maxInt
+            self._ri = self.intensities() / maxInt
         else:
-            for item in self.peaks:
-                item.ri = 1.
+            self._ri = numpy.ones(len(self))
     # ----
     
     
@@ -627,6 +981,6 @@ class peaklist:
         for prod in result:
             yield ''.join(prod)
     # ----
-    
-    
+
+
 
@@ -54,7 +54,7 @@ class scan:
         
         # buffers
         self._baseline = None
-        self._baselineParams = {'window': None, 'offset': None}
+        self._baselineParams = {'window': None, 'offset': None, 'method': None}
         
         # convert profile to numPy array
         if not isinstance(profile, numpy.ndarray):
@@ -109,7 +109,7 @@ class scan:
         """Clear scan buffers."""
         
         self._baseline = None
-        self._baselineParams = {'window': None, 'offset': None}
+        self._baselineParams = {'window': None, 'offset': None, 'method': None}
     # ----
     
     
@@ -122,6 +122,42 @@ class scan:
     # ----
     
     
+    def snapshot(self):
+        """Return copy of current scan sharing data arrays with original.
+        Shared arrays are made read-only, scan and peaklist modifiers replace
+        them by new arrays instead of changing them in place."""
+        
+        # share profile
+        if isinstance(self.profile, numpy.ndarray):
+            self.profile.flags.writeable = False
+        
+        # make copy
+        dupl = scan.__new__(scan)
+        dupl.__dict__.update(self.__dict__)
+        dupl.peaklist = self.peaklist.snapshot()
+        dupl.attributes = copy.deepcopy(self.attributes)
+        dupl._baselineParams = self._baselineParams.copy()
+        
+        return dupl
+    # ----
+    
+    
+    def nbytes(self):
+        """Return sizes of data arrays as dict of buffer ID and size."""
+        
+        buff = self.peaklist.nbytes()
+        
+        # get profile buffer
+        if isinstance(self.profile, numpy.ndarray):
+            owner = self.profile
+            while isinstance(owner.base, numpy.ndarray):
+                owner = owner.base
+            buff[id(owner)] = owner.nbytes
+        
+        return buff
+    # ----
+    
+    
     def noise(self, minX=None, maxX=None, mz=None, window=0.1):
         """Return noise level and width for specified m/z range or m/z value.
             minX (float) - lower m/z limit
@@ -141,25 +177,29 @@ class scan:
     # ----
     
     
-    def baseline(self, window=0.1, offset=0.):
+    def baseline(self, window=0.1, offset=0., method='raster'):
         """Return spectrum baseline data.
             window (float or None) - noise calculation window (%/100)
             offset (float) - baseline offset, relative to noise width (in %/100)
+            method (raster, rolling, snip or als) - baseline estimation method
         """
         
         # calculate baseline
         if isinstance(self._baseline, type(None)) \
             or self._baselineParams['window'] != window \
-            or self._baselineParams['offset'] != offset:
+            or self._baselineParams['offset'] != offset \
+            or self._baselineParams['method'] != method:
             
             self._baseline = mod_signal.baseline(
                 signal = self.profile,
                 window = window,
-                offset = offset
+                offset = offset,
+                method = method
             )
             
             self._baselineParams['window'] = window
             self._baselineParams['offset'] = offset
+            self._baselineParams['method'] = method
         
         return self._baseline
     # ----
@@ -172,8 +212,8 @@ class scan:
         if len(self.profile) > 0 and len(self.peaklist) > 0:
             spectrumMax = numpy.maximum.reduce(self.profile)[1]
             spectrumMin = numpy.minimum.reduce(self.profile)[1]
-            peaklistMax = max([peak.ai for peak in self.peaklist])
-            peaklistMin = min([peak.base for peak in self.peaklist])
+            peaklistMax = self.peaklist.values('ai').max()
+            peaklistMin = self.peaklist.values('base').min()
             
             return max(spectrumMax, peaklistMax)/100.
         
@@ -186,8 +226,8 @@ class scan:
         
         # calculate range for peaklist only
         elif len(self.peaklist) > 0:
-            peaklistMax = max([peak.ai for peak in self.peaklist])
-            shift = min([peak.base for peak in self.peaklist])
+            peaklistMax = self.peaklist.values('ai').max()
+            shift = self.peaklist.values('base').min()
             
             return peaklistMax/100.
         
@@ -289,12 +329,10 @@ class scan:
         """Swap data between profile and peaklist."""
         
         # make new profile
-        profile = [[i.mz, i.ai] for i in self.peaklist]
-        profile = numpy.array(profile)
+        profile = numpy.column_stack((self.peaklist.values('mz'), self.peaklist.values('ai')))
         
         # make new peaklist
-        peaks = [obj_peak.peak(i[0],i[1]) for i in self.profile]
-        peaks = obj_peaklist.peaklist(peaks)
+        peaks = obj_peaklist.peaklist(self.profile.reshape(-1, 2), columns=('mz', 'ai'))
         
         # update scan
         self.profile = profile
@@ -347,14 +385,11 @@ class scan:
         
         # normalize profile
         if len(self.profile) > 0:
-            self.profile /= numpy.array((1, f))
+            self.profile = self.profile / numpy.array((1, f))
         
         # normalize peaklist
         if len(self.peaklist) > 0:
-            for peak in self.peaklist:
-                peak.setai(peak.ai / f)
-                peak.setbase(peak.base / f)
-            self.peaklist.reset()
+            self.peaklist.multiply(1. / f)
         
         # clear buffers
         self.reset()
@@ -465,8 +500,10 @@ class scan:
         """
         
         # calibrate profile
-        for x, point in enumerate(self.profile):
-            self.profile[x][0] = fn(params, point[0])
+        if len(self.profile) > 0:
+            profile = self.profile.copy()
+            profile[:,0] = fn(params, profile[:,0])
+            self.profile = profile
         
         # calibrate peaklist
         self.peaklist.recalibrate(fn, params)
@@ -476,16 +513,18 @@ class scan:
     # ----
     
     
-    def subbase(self, window=0.1, offset=0.):
+    def subbase(self, window=0.1, offset=0., method='raster'):
         """Subtract baseline from profile.
             window (float or None) - noise calculation window (%/100)
             offset (float) - baseline offset, relative to noise width (in %/100)
+            method (raster, rolling, snip or als) - baseline estimation method
         """
         
         # get baseline
         baseline = self.baseline(
             window = window,
-            offset = offset
+            offset = offset,
+            method = method
         )
         
         # subtract baseline
@@ -506,7 +545,7 @@ class scan:
     
     # PEAKLIST FUNCTIONS
     
-    def labelscan(self, pickingHeight=0.75, absThreshold=0., relThreshold=0., snThreshold=0., baselineWindow=0.1, baselineOffset=0., smoothMethod=None, smoothWindow=0.2, smoothCycles=1):
+    def labelscan(self, pickingHeight=0.75, absThreshold=0., relThreshold=0., snThreshold=0., baselineWindow=0.1, baselineOffset=0., baselineMethod='raster', smoothMethod=None, smoothWindow=0.2, smoothCycles=1):
         """Label centroides in current scan.
             pickingHeight (float) - peak picking height for centroiding
             absThreshold (float) - absolute intensity threshold
@@ -514,6 +553,7 @@ class scan:
             snThreshold (float) - signal to noise threshold
             baselineWindow (float) - noise calculation window (in %/100)
             baselineOffset (float) - baseline offset, relative to noise width (in %/100)
+            baselineMethod (raster, rolling, snip or als) - baseline estimation method
             smoothMethod (None, MA, GA or SG) - smoothing method
             smoothWindow (float) - m/z window size for smoothing
             smoothCycles (int) - number of smoothing cycles
@@ -522,7 +562,8 @@ class scan:
         # get baseline
         baseline = self.baseline(
             window = baselineWindow,
-            offset = baselineOffset
+            offset = baselineOffset,
+            method = baselineMethod
         )
         
         # pre-smooth profile
@@ -713,4 +754,3 @@ class scan:
     # ----
     
     
-
@@ -18,6 +18,7 @@
 #load libs
 import re
 import copy
+import numpy
 
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
@@ -437,7 +438,24 @@ class sequence:
     # ----
     
     
-    def pattern(self, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True):
+    def mzs(self, charges, agentFormula='H', agentCharge=1):
+        """Get ion m/z for several charges at once.
+            charges (list of int) - ion charges
+        Returns numpy array of (Mo, Av) m/z for each charge.
+        """
+        
+        charges = numpy.asarray(charges)
+        masses = numpy.tile(self.mass(), (len(charges), 1))
+        
+        return mod_basics.mzarray(masses,
+            charges = charges,
+            agentFormula = agentFormula,
+            agentCharge = agentCharge
+        )
+    # ----
+    
+    
+    def pattern(self, fwhm=0.1, threshold=0.01, charge=0, agentFormula='H', agentCharge=1, real=True, method='classic'):
         """Get isotopic pattern."""
         
         return mod_pattern.pattern(
@@ -447,7 +465,8 @@ class sequence:
             charge = charge,
             agentFormula = agentFormula,
             agentCharge = agentCharge,
-            real = real
+            real = real,
+            method = method
         )
     # ----
     
@@ -0,0 +1,268 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import base64
+import zlib
+import struct
+import numpy
+
+
+# BINARY ARRAYS DECODING
+# ----------------------
+# Binary arrays of XML formats are decoded by numpy.frombuffer straight from
+# decompressed bytes and written into preallocated (n, 2) float64 array of
+# points, so no intermediate Python objects are created.
+#
+# MS-Numpress encodings (linear prediction, positive integer and short logged
+# float) are decoded according to the reference implementation. Integers of
+# linear and positive integer encodings are stored as variable number of
+# half-bytes; only finding the start of each integer runs in Python loop.
+
+BYTE_ORDERS = {
+    'little': '<',
+    'big': '>',
+    'network': '>',
+    '<': '<',
+    '>': '>',
+}
+
+# number of half-bytes used by integer of given head
+NUMPRESS_STEPS = [9 - (x if x <= 8 else x - 8) for x in range(16)]
+
+# characters allowed in numeric text columns
+TEXT_CHARACTERS = b'0123456789.-+eE \t\r\n'
+
+
+def decodeArray(data, precision=32, byteOrder='little', compression=None, numpress=None):
+    """Decode base64 binary array into numpy array.
+        data (str or bytes) - base64 encoded data
+        precision (32 or 64) - float precision
+        byteOrder (little, big or network) - byte order of values, network if unknown
+        compression (zlib or None) - data compression
+        numpress (linear, pic, slof or None) - MS-Numpress encoding
+    Returns numpy array of values, plain arrays are read-only views of decoded data.
+    """
+    
+    # check data
+    if not data:
+        return numpy.zeros(0, dtype=numpy.float64)
+    
+    # decode data
+    data = base64.b64decode(data)
+    
+    # decompress data
+    if compression == 'zlib':
+        data = zlib.decompress(data)
+    
+    # decode numpress
+    if numpress == 'linear':
+        return decodeLinear(data)
+    elif numpress == 'pic':
+        return decodePic(data)
+    elif numpress == 'slof':
+        return decodeSlof(data)
+    elif numpress:
+        raise ValueError("Unknown numpress encoding! --> " + numpress)
+    
+    # get data type
+    dtype = BYTE_ORDERS.get(byteOrder, '>') + ('f8' if precision == 64 else 'f4')
+    
+    # cut incomplete value
+    size = 8 if precision == 64 else 4
+    return numpy.frombuffer(data, dtype=dtype, count=len(data)//size)
+# ----
+
+
+def makePoints(mzArray, intArray):
+    """Make (n, 2) array of points from separate m/z and intensity arrays.
+        mzArray (numpy array) - m/z values
+        intArray (numpy array) - intensity values
+    """
+    
+    count = min(len(mzArray), len(intArray))
+    
+    points = numpy.empty((count, 2), dtype=numpy.float64)
+    points[:,0] = mzArray[:count]
+    points[:,1] = intArray[:count]
+    
+    return points
+# ----
+
+
+def makePairs(array):
+    """Make (n, 2) array of points from interleaved m/z-intensity array.
+        array (numpy array) - interleaved m/z and intensity values
+    """
+    
+    count = len(array) // 2
+    
+    points = numpy.empty((count, 2), dtype=numpy.float64)
+    points[:,0] = array[0:2*count:2]
+    points[:,1] = array[1:2*count:2]
+    
+    return points
+# ----
+
+
+
+# TEXT ARRAYS DECODING
+# --------------------
+# Numeric text columns (MGF peaks, XY exports) are converted by single
+# numpy.fromstring call. Layout of the text is checked first by vectorized
+# operations on raw bytes, so the values can be reshaped safely into rows.
+
+def decodeColumns(data):
+    """Decode whitespace-separated numeric columns from text.
+        data (bytes) - text lines with the same number of values, blank lines allowed
+    Returns numpy array of (n, columns) or None if the text is not uniform
+    numeric table and must be parsed line by line.
+    """
+    
+    # check characters
+    if not data or data.translate(None, TEXT_CHARACTERS):
+        return None
+    
+    # find value starts and line ends, remaining characters below 33 are spaces
+    chars = numpy.frombuffer(b'\n' + data + b'\n', dtype=numpy.uint8)
+    spaces = chars < 33
+    starts = numpy.flatnonzero(spaces[:-1] & ~spaces[1:])
+    ends = numpy.flatnonzero(chars == 10)
+    
+    # check number of values in each line
+    counts = numpy.diff(numpy.searchsorted(starts, ends))
+    counts = counts[counts != 0]
+    if not len(counts) or (counts != counts[0]).any():
+        return None
+    
+    # convert values, incomplete conversion means invalid number
+    try:
+        values = numpy.fromstring(data, dtype=numpy.float64, sep=' ')
+    except ValueError:
+        return None
+    if values.size != len(starts):
+        return None
+    
+    return values.reshape(-1, counts[0])
+# ----
+
+
+
+# MS-NUMPRESS
+# -----------
+
+def decodeLinear(data):
+    """Decode MS-Numpress linear prediction data."""
+    
+    # check data
+    if len(data) < 8:
+        raise ValueError("Corrupt numpress linear data!")
+    if len(data) == 8:
+        return numpy.zeros(0, dtype=numpy.float64)
+    
+    # get fixed point and first values
+    fixedPoint = _decodeFixedPoint(data)
+    first = numpy.frombuffer(data, dtype='<u4', count=min(2, (len(data)-8)//4), offset=8).astype(numpy.int64)
+    if len(first) < 2:
+        return first / fixedPoint
+    
+    # get residues
+    residues = _decodeInts(data[16:]).astype(numpy.uint32).view(numpy.int32)
+    
+    # add linear prediction
+    values = numpy.empty(len(residues)+2, dtype=numpy.int64)
+    values[:2] = first
+    if len(residues):
+        diffs = numpy.cumsum(residues, dtype=numpy.int64)
+        diffs += first[1] - first[0]
+        values[2:] = first[1] + numpy.cumsum(diffs)
+    
+    return values / fixedPoint
+# ----
+
+
+def decodePic(data):
+    """Decode MS-Numpress positive integer data."""
+    
+    return _decodeInts(data).astype(numpy.float64)
+# ----
+
+
+def decodeSlof(data):
+    """Decode MS-Numpress short logged float data."""
+    
+    # check data
+    if len(data) < 8:
+        raise ValueError("Corrupt numpress slof data!")
+    
+    # get fixed point
+    fixedPoint = _decodeFixedPoint(data)
+    
+    # get values
+    values = numpy.frombuffer(data, dtype='<u2', count=(len(data)-8)//2, offset=8)
+    
+    return numpy.expm1(values / fixedPoint)
+# ----
+
+
+def _decodeFixedPoint(data):
+    """Decode fixed point stored as big-endian double."""
+    
+    return struct.unpack('>d', data[:8])[0]
+# ----
+
+
+def _decodeInts(data):
+    """Decode integers stored as variable number of half-bytes."""
+    
+    # split bytes into half-bytes, padded for last integer
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    nibbles = numpy.zeros(2*len(data)+8, dtype=numpy.int64)
+    nibbles[0:2*len(data):2] = data >> 4
+    nibbles[1:2*len(data):2] = data & 0xf
+    
+    # find integer heads
+    heads = []
+    i = 0
+    count = 2*len(data)
+    values = nibbles[:count].tolist()
+    steps = NUMPRESS_STEPS
+    while i < count:
+        if i == count-1 and values[i] == 0:
+            break
+        heads.append(i)
+        i += steps[values[i]]
+    
+    # assemble integers
+    heads = numpy.array(heads, dtype=numpy.int64)
+    head = nibbles[heads]
+    leading = numpy.where(head <= 8, head, head - 8)
+    ints = numpy.zeros(len(heads), dtype=numpy.int64)
+    
+    for x in range(8):
+        
+        # fill stored half-bytes
+        stored = x < 8 - leading
+        ints |= numpy.where(stored, nibbles[heads+1+x], 0) << (4*x)
+        
+        # fill leading ones
+        ones = (~stored) & (head > 8)
+        ints |= numpy.where(ones, 0xf, 0) << (4*x)
+    
+    return ints
+# ----
+
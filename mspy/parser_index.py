@@ -0,0 +1,317 @@
+# -------------------------------------------------------------------------
+#     Copyright (C) 2005-2013 Martin Strohalm <www.mmass.org>
+
+#     This program is free software; you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation; either version 3 of the License, or
+#     (at your option) any later version.
+
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#     GNU General Public License for more details.
+
+#     Complete text of GNU GPL can be found in the file LICENSE.TXT in the
+#     main directory of the program.
+# -------------------------------------------------------------------------
+
+# load libs
+import os
+import re
+import json
+import hashlib
+
+# load stopper
+from .mod_stopper import CHECK_FORCE_QUIT
+
+
+# BYTE-OFFSET INDEX OF XML DOCUMENTS
+# ----------------------------------
+# Raw-data parsers use byte offsets of spectrum elements to seek directly to
+# requested scan instead of parsing whole document. Offsets are taken from
+# index embedded in the document or found by byte scanner. Offsets and scan
+# list metadata are stored into sidecar file, so following opens of unchanged
+# document do not need to touch the data at all.
+#
+# Sidecar layout (JSON):
+#   version - index format version
+#   format - document format
+#   size, mtime - source file identification
+#   offsets - list of [scanNumber, offset, ...] in document order
+#   scanlist - list of scan metadata dicts or null
+
+INDEX_DIR = os.path.join(os.path.expanduser('~'), '.mmass', 'cache', 'index')
+INDEX_VERSION = 1
+
+READ_BLOCK = 1 << 20
+
+# compile basic patterns
+ATTRIBUTE_PATTERN = '\\s%s\\s*=\\s*(["\'])(.*?)\\1'
+
+
+# ELEMENTS READING
+# ----------------
+
+def scanElements(path, tag):
+    """Find byte offsets and start tags of all elements with given name.
+        path (str) - document path
+        tag (bytes) - element name
+    Returns list of (offset, start tag) in document order.
+    """
+    
+    buff = []
+    pattern = b'<' + tag
+    
+    with open(path, 'rb') as document:
+        data = b''
+        start = 0
+        
+        while True:
+            CHECK_FORCE_QUIT()
+            
+            block = document.read(READ_BLOCK)
+            data += block
+            
+            # find tags in current block
+            i = data.find(pattern)
+            while i != -1:
+                
+                # wait for more data if tag is incomplete
+                end = data.find(b'>', i)
+                if end == -1 and block:
+                    break
+                
+                # check full name to skip longer names
+                char = data[i+len(pattern):i+len(pattern)+1]
+                if char in (b' ', b'\t', b'\r', b'\n', b'>', b'/'):
+                    buff.append((start+i, data[i:end+1]))
+                
+                i = data.find(pattern, i+len(pattern))
+            
+            # end of file
+            if not block:
+                break
+            
+            # keep unprocessed data
+            if i == -1:
+                i = max(0, len(data) - len(pattern) + 1)
+            start += i
+            data = data[i:]
+    
+    return buff
+# ----
+
+
+def readElement(document, offset, tag, stop=None):
+    """Read element data from opened document.
+        document (file) - document opened in binary mode
+        offset (int) - byte offset of element start
+        tag (bytes) - element name
+        stop (bytes) - stop reading before this string if found first
+    Returns element data including end tag, or data up to stop string.
+    """
+    
+    endTag = b'</' + tag + b'>'
+    document.seek(offset)
+    
+    data = b''
+    size = 1 << 16
+    while True:
+        block = document.read(size)
+        if not block:
+            return data
+        
+        # search new data only
+        i = max(0, len(data) - max(len(endTag), len(stop or b'')))
+        data += block
+        
+        # check end tag and stop string
+        end = data.find(endTag, i)
+        if stop:
+            cut = data.find(stop, i)
+            if cut != -1 and (end == -1 or cut < end):
+                return data[:cut]
+        if end != -1:
+            return data[:end+len(endTag)]
+        
+        size = min(size*2, READ_BLOCK*16)
+# ----
+
+
+def stripEndTags(data, tag):
+    """Remove end tags of given element and whitespaces from data end.
+        data (bytes) - element data
+        tag (bytes) - element name
+    Returns stripped data and number of removed end tags.
+    """
+    
+    endTag = b'</' + tag + b'>'
+    
+    count = 0
+    end = len(data)
+    while True:
+        while end and data[end-1:end].isspace():
+            end -= 1
+        if not data.endswith(endTag, 0, end):
+            break
+        end -= len(endTag)
+        count += 1
+    
+    return data[:end], count
+# ----
+
+
+def nestElements(document, offsets, tag, size=1024):
+    """Get parent of each element from end tags preceding next element.
+        document (file) - document opened in binary mode
+        offsets (list) - sorted element offsets
+        tag (bytes) - element name
+    Returns list of parent positions within offsets or None.
+    """
+    
+    buff = []
+    opened = []
+    for i, offset in enumerate(offsets):
+        
+        # read data before element
+        start = max(0, offset - size)
+        document.seek(start)
+        data = document.read(offset - start)
+        
+        # close finished elements
+        count = stripEndTags(data, tag)[1]
+        del opened[max(0, len(opened)-count):]
+        
+        buff.append(opened[-1] if opened else None)
+        opened.append(i)
+    
+    return buff
+# ----
+
+
+def readAttribute(tag, name):
+    """Get attribute value from start tag.
+        tag (bytes) - element start tag
+        name (str) - attribute name
+    """
+    
+    match = re.search((ATTRIBUTE_PATTERN % name).encode('ascii'), tag, re.S)
+    if not match:
+        return None
+    
+    return match.group(2).decode('utf-8', 'replace')
+# ----
+
+
+def readTail(path, size=4096):
+    """Read last bytes of document."""
+    
+    with open(path, 'rb') as document:
+        document.seek(0, os.SEEK_END)
+        length = document.tell()
+        document.seek(max(0, length - size))
+        return document.read()
+# ----
+
+
+
+# SIDECAR INDEX
+# -------------
+
+def readIndex(path, docType):
+    """Read stored index if it matches current document, None otherwise.
+        path (str) - document path
+        docType (str) - document format
+    """
+    
+    indexPath = _indexPath(path)
+    if not os.path.exists(indexPath):
+        return None
+    
+    try:
+        with open(indexPath, 'r', encoding='utf-8') as handle:
+            index = json.load(handle)
+        key = _sourceKey(path, docType)
+        for item in key:
+            if index.get(item) != key[item]:
+                return None
+    except (IOError, OSError, ValueError):
+        return None
+    
+    return index
+# ----
+
+
+def writeIndex(path, docType, offsets, scanlist=None):
+    """Store index for given document. Failures are ignored as the index
+    can always be made again.
+        path (str) - document path
+        docType (str) - document format
+        offsets (list) - [scanNumber, offset] in document order
+        scanlist (list) - scan metadata dicts
+    """
+    
+    index = _sourceKey(path, docType)
+    index['offsets'] = offsets
+    index['scanlist'] = scanlist
+    
+    # write to temporary file and replace
+    try:
+        if not os.path.exists(INDEX_DIR):
+            os.makedirs(INDEX_DIR)
+        indexPath = _indexPath(path)
+        tmpPath = indexPath + '.tmp'
+        with open(tmpPath, 'w', encoding='utf-8') as handle:
+            handle.write(json.dumps(index))
+        os.replace(tmpPath, indexPath)
+    except (IOError, OSError):
+        pass
+# ----
+
+
+def _indexPath(path):
+    """Get sidecar index path of given document."""
+    
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INDEX_DIR, key + '.json')
+# ----
+
+
+def _sourceKey(path, docType):
+    """Get identification of document file."""
+    
+    stat = os.stat(path)
+    
+    return {
+        'version': INDEX_VERSION,
+        'format': docType,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+    }
+# ----
+
+
+
+# SCAN FILTERS
+# ------------
+
+def matchScan(scanData, msLevel=None, rtRange=None):
+    """Check scan metadata against iteration filters.
+        scanData (dict) - scan metadata
+        msLevel (int or None) - required ms level
+        rtRange ((float, float) or None) - required retention time range in seconds
+    """
+    
+    # check ms level
+    if msLevel is not None and scanData['msLevel'] != msLevel:
+        return False
+    
+    # check retention time
+    if rtRange is not None:
+        retentionTime = scanData['retentionTime']
+        if retentionTime is None or not rtRange[0] <= retentionTime <= rtRange[1]:
+            return False
+    
+    return True
+# ----
+
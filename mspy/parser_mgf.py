@@ -18,16 +18,27 @@
 # load libs
 import re
 import os.path
-from copy import deepcopy
+import numpy
 
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
 
 # load objects
-from . import obj_peak
 from . import obj_peaklist
 from . import obj_scan
 
+# load binary decoder
+from . import parser_binary
+
+# load index
+from . import parser_index
+
+
+# compile basic patterns
+HEADER_PATTERN = re.compile(rb'^[ \t]*([A-Z]+)=(.+)$', re.M)
+POINTS_PATTERN = re.compile(rb'^[ \t]*[-+.0-9]', re.M)
+CONTENT_PATTERN = re.compile(rb'^[ \t\r]*[^ \t\r\n#;!/]', re.M)
+
 
 # PARSE MGF DATA
 # --------------
@@ -39,6 +50,7 @@ class parseMGF():
         self.path = path
         self._scans = None
         self._scanlist = None
+        self._offsets = None
         
         # check path
         if not os.path.exists(path):
@@ -76,35 +88,73 @@ class parseMGF():
         if self._scanlist:
             return self._scanlist
         
-        # parse data
-        self._parseData()
+        # read scan headers by index
+        offsets = self._index()
+        if self._scanlist:
+            return self._scanlist
+        if offsets:
+            self._scanlist = self._readScanlist(offsets)
+            if self._scanlist:
+                parser_index.writeIndex(self.path, 'MGF', offsets, list(self._scanlist.values()))
         
         return self._scanlist
     # ----
     
     
     def scan(self, scanID=None, dataType=None):
-        """Get spectrum from document."""
+        """Get spectrum from document.
+            scanID (int, str or None) - scan number, scan title or None for first scan
+            dataType (peaklist, spectrum or None) - data type of scan
+        """
         
-        # parse file
-        if not self._scans:
-            self._parseData()
+        # use preloaded data if available
+        if self._scans and scanID in self._scans:
+            data = self._scans[scanID]
+        
+        # read scan by index
+        else:
+            data = self._readScan(scanID)
         
         # check data
-        if not self._scans:
+        if not data:
             return False
         
-        # check selected scan
-        if scanID in self._scans:
-            data = self._scans[scanID]
-        elif scanID is None:
-            data = self._scans[0]
-        
         # return scan
         return self._makeScan(data, dataType)
     # ----
     
     
+    def iterscans(self, msLevel=None, rtRange=None, mzRange=None, dataType=None):
+        """Iterate over scans in document order. Scans are read one by one
+        from indexed ions blocks, so only current scan is kept in memory.
+        Scans without data are skipped.
+            msLevel (int or None) - ms level of scans to read
+            rtRange ((float, float) or None) - retention time range in seconds
+            mzRange ((float, float) or None) - m/z range to crop scans to
+            dataType (peaklist, spectrum or None) - data type of scans
+        """
+        
+        # get index
+        offsets = self._index()
+        
+        with open(self.path, 'rb') as document:
+            for index in range(len(offsets)):
+                CHECK_FORCE_QUIT()
+                
+                # read scan
+                data = self._parseScan(document, index)
+                if not data['pointsCount'] or not parser_index.matchScan(data, msLevel, rtRange):
+                    continue
+                
+                # make scan
+                scan = self._makeScan(data, dataType)
+                if mzRange is not None:
+                    scan.crop(mzRange[0], mzRange[1])
+                
+                yield scan
+    # ----
+    
+    
     def _parseData(self):
         """Parse data."""
         
@@ -112,88 +162,247 @@ class parseMGF():
         self._scans = {}
         self._scanlist = None
         
-        # open document
+        # read scans
         try:
-            document = open(self.path)
-            rawData = document.readlines()
-            document.close()
+            offsets = self._index()
+            with open(self.path, 'rb') as document:
+                for index in range(len(offsets)):
+                    CHECK_FORCE_QUIT()
+                    scan = self._parseScan(document, index)
+                    self._scans[scan['scanNumber']] = scan
         except IOError:
             return False
         
-        headerPattern = re.compile('^([A-Z]+)=(.+)')
-        pointPattern = re.compile('[ \t]?')
-        currentID = None
+        # make scanlist
+        if self._scans:
+            self._scanlist = {}
+            for scanNumber, scan in self._scans.items():
+                self._scanlist[scanNumber] = scan.copy()
+                del self._scanlist[scanNumber]['data']
+    # ----
+    
+    
+    def _index(self):
+        """Get ions blocks as list of [scanNumber, start, end, title]."""
+        
+        # use loaded index
+        if self._offsets is not None:
+            return self._offsets
+        
+        # use stored index
+        stored = parser_index.readIndex(self.path, 'MGF')
+        if stored:
+            self._offsets = stored['offsets']
+            if stored['scanlist'] and not self._scanlist:
+                self._scanlist = dict((item['scanNumber'], item) for item in stored['scanlist'])
+            return self._offsets
+        
+        # scan the document
+        self._offsets = self._scanOffsets()
+        
+        # store index
+        parser_index.writeIndex(self.path, 'MGF', self._offsets)
+        
+        return self._offsets
+    # ----
+    
+    
+    def _scanOffsets(self):
+        """Find ions blocks by scanning the document. Data preceding the first
+        block are used as default scan, data following any block are ignored."""
+        
+        blocks = []
+        current = None
+        head = None
+        headTitle = ''
         
-        # parse each line
-        for line in rawData:
-            line = line.strip()
+        with open(self.path, 'rb') as document:
+            data = b''
+            start = 0
             
-            # discard comments
-            if not line or line[0] in ('#', ';', '!', '/'):
-                continue
+            while True:
+                CHECK_FORCE_QUIT()
+                
+                # read complete lines
+                block = document.read(parser_index.READ_BLOCK)
+                data += block
+                end = data.rfind(b'\n') + 1 if block else len(data)
+                
+                # get block boundaries and titles
+                for position, lineEnd, line in _findMarkers(data, end):
+                    if line == b'BEGIN IONS':
+                        if head is None:
+                            head = start + position
+                        if current:
+                            blocks.append([current[0], start + position, current[1]])
+                        current = [start + lineEnd, '']
+                    elif line == b'END IONS':
+                        if current:
+                            blocks.append([current[0], start + position, current[1]])
+                        current = None
+                    elif current:
+                        current[1] = line[6:].strip().decode('utf-8', 'replace')
+                    elif head is None:
+                        headTitle = line[6:].strip().decode('utf-8', 'replace')
+                
+                # end of file
+                if not block:
+                    break
+                
+                # keep incomplete line
+                start += end
+                data = data[end:]
             
-            # append default scan
-            if currentID is None or line == 'BEGIN IONS':
-                currentID = len(self._scans)
-                scan = {
-                    'title': '',
-                    'scanNumber': currentID,
-                    'parentScanNumber': None,
-                    'msLevel': None,
-                    'pointsCount': 0,
-                    'polarity': None,
-                    'retentionTime': None,
-                    'lowMZ': None,
-                    'highMZ': None,
-                    'basePeakMZ': None,
-                    'basePeakIntensity': None,
-                    'totIonCurrent': None,
-                    'precursorMZ': None,
-                    'precursorIntensity': None,
-                    'precursorCharge': None,
-                    'spectrumType': 'unknown',
-                    'data': [],
-                }
-                self._scans[currentID] = scan
+            # close last block
+            if current:
+                blocks.append([current[0], start + len(data), current[1]])
+            if head is None:
+                head = start + len(data)
             
-            # scan ended, use default scan
-            if line == 'END IONS':
-                currentID = 0
-                continue
+            # check data before first block
+            document.seek(0)
+            default = CONTENT_PATTERN.search(document.read(head))
+        
+        # make offsets
+        offsets = []
+        if default:
+            offsets.append([0, 0, head, headTitle])
+        for blockStart, blockEnd, title in blocks:
+            offsets.append([len(offsets), blockStart, blockEnd, title])
+        
+        return offsets
+    # ----
+    
+    
+    def _readScan(self, scanID):
+        """Read scan data from ions block at indexed offset."""
+        
+        offsets = self._index()
+        
+        # get block by scan number or title
+        index = None
+        for x, item in enumerate(offsets):
+            if scanID is None or item[0] == scanID or (isinstance(scanID, str) and item[3] == scanID):
+                index = x
+                break
+        
+        if index is None:
+            return False
+        
+        # parse block only
+        try:
+            with open(self.path, 'rb') as document:
+                return self._parseScan(document, index)
+        except IOError:
+            return False
+    # ----
+    
+    
+    def _parseScan(self, document, index):
+        """Parse ions block at given index position."""
+        
+        scanNumber, start, end, title = self._offsets[index]
+        
+        # read block
+        document.seek(start)
+        data = document.read(end - start)
+        
+        scan = {
+            'title': '',
+            'scanNumber': scanNumber,
+            'parentScanNumber': None,
+            'msLevel': None,
+            'pointsCount': 0,
+            'polarity': None,
+            'retentionTime': None,
+            'lowMZ': None,
+            'highMZ': None,
+            'basePeakMZ': None,
+            'basePeakIntensity': None,
+            'totIonCurrent': None,
+            'precursorMZ': None,
+            'precursorIntensity': None,
+            'precursorCharge': None,
+            'spectrumType': 'unknown',
+            'data': numpy.zeros((0, 2), dtype=numpy.float64),
+        }
+        
+        # find datapoints
+        match = POINTS_PATTERN.search(data)
+        pointsStart = match.start() if match else len(data)
+        
+        # get header data, search datapoints only if they contain headers
+        end = pointsStart if data.find(b'=', pointsStart) == -1 else len(data)
+        for name, value in HEADER_PATTERN.findall(data, 0, end):
+            if name == b'TITLE':
+                scan['title'] = value.strip().decode('utf-8', 'replace')
+            elif name == b'PEPMASS':
+                try: scan['precursorMZ'] = float(value.split()[0])
+                except: pass
+            elif name == b'CHARGE':
+                charge = value.strip().decode('utf-8', 'replace')
+                if charge[-1] in ('+', '-'):
+                    charge = charge[-1]+charge[:-1]
+                try: scan['precursorCharge'] = int(charge)
+                except: pass
+        
+        # get datapoints
+        if match:
+            scan['data'] = self._parsePoints(data[pointsStart:])
+            scan['pointsCount'] = len(scan['data'])
+        
+        return scan
+    # ----
+    
+    
+    def _parsePoints(self, data):
+        """Parse datapoints of ions block."""
+        
+        # convert all points at once
+        points = parser_binary.decodeColumns(data)
+        if points is not None:
+            if points.shape[1] == 1:
+                return parser_binary.makePoints(points[:,0], numpy.full(len(points), 100.))
+            return points[:,:2]
+        
+        # parse line by line
+        buff = []
+        for line in data.splitlines():
+            parts = line.split()
             
-            # get header data
-            parts = headerPattern.match(line)
-            if parts:
-                if parts.group(1) == 'TITLE':
-                    self._scans[currentID]['title'] = parts.group(2).strip()
-                elif parts.group(1) == 'PEPMASS':
-                    try: self._scans[currentID]['precursorMZ'] = float(pointPattern.split(parts.group(2))[0])
-                    except: pass
-                elif parts.group(1) == 'CHARGE':
-                    charge = parts.group(2).strip()
-                    if charge[-1] in ('+', '-'):
-                        charge = charge[-1]+charge[:-1]
-                    try: self._scans[currentID]['precursorCharge'] = int(charge)
-                    except: pass
+            # discard comments and headers
+            if not parts or parts[0][:1] in (b'#', b';', b'!', b'/'):
                 continue
             
             # append datapoint
-            parts = pointPattern.split(line)
-            if parts:
-                point = [0,100.]
-                try: point[0] = float(parts[0])
-                except ValueError: continue
-                try: point[1] = float(parts[1])
-                except (ValueError, IndexError) as target: pass
-                self._scans[currentID]['data'].append(point)
-                self._scans[currentID]['pointsCount'] += 1
-                continue
+            point = [0, 100.]
+            try: point[0] = float(parts[0])
+            except ValueError: continue
+            try: point[1] = float(parts[1])
+            except (ValueError, IndexError): pass
+            buff.append(point)
         
-        # make scanlist
-        if self._scans:
-            self._scanlist = deepcopy(self._scans)
-            for scanNumber in self._scanlist:
-                del self._scanlist[scanNumber]['data']
+        return numpy.array(buff, dtype=numpy.float64).reshape(-1, 2)
+    # ----
+    
+    
+    def _readScanlist(self, offsets):
+        """Read scan list from indexed ions blocks."""
+        
+        buff = {}
+        try:
+            with open(self.path, 'rb') as document:
+                for index in range(len(offsets)):
+                    CHECK_FORCE_QUIT()
+                    
+                    scan = self._parseScan(document, index)
+                    del scan['data']
+                    buff[scan['scanNumber']] = scan
+        
+        except IOError:
+            return None
+        
+        return buff
     # ----
     
     
@@ -202,10 +411,7 @@ class parseMGF():
         
         # parse data as peaklist (discrete points)
         if dataType == 'peaklist' or (dataType==None and len(scanData['data'])<3000):
-            buff = []
-            for point in scanData['data']:
-                buff.append(obj_peak.peak(point[0], point[1]))
-            scan = obj_scan.scan(peaklist=obj_peaklist.peaklist(buff))
+            scan = obj_scan.scan(peaklist=obj_peaklist.peaklist(scanData['data']))
         
         # parse data as spectrum (continuous line)
         else:
@@ -229,3 +435,30 @@ class parseMGF():
     # ----
     
     
+
+def _findMarkers(data, end):
+    """Find lines starting, ending or titling ions blocks within data[:end].
+    Returns sorted list of (line start, line end, stripped line)."""
+    
+    buff = []
+    for marker in (b'IONS', b'TITLE='):
+        i = data.find(marker, 0, end)
+        while i != -1:
+            
+            # get whole line
+            lineStart = data.rfind(b'\n', 0, i) + 1
+            lineEnd = data.find(b'\n', i, end) + 1 or end
+            line = data[lineStart:lineEnd].strip()
+            
+            # check marker
+            if line in (b'BEGIN IONS', b'END IONS'):
+                buff.append((lineStart, lineEnd, line))
+            elif marker == b'TITLE=' and line.startswith(marker):
+                buff.append((lineStart, lineEnd, line))
+            
+            i = data.find(marker, i+len(marker), end)
+    
+    buff.sort()
+    return buff
+# ----
+
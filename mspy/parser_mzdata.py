@@ -18,8 +18,7 @@
 # load libs
 import xml.sax
 import xml.dom.minidom
-import base64
-import struct
+import re
 import os.path
 import numpy
 from copy import deepcopy
@@ -28,10 +27,18 @@ from copy import deepcopy
 from .mod_stopper import CHECK_FORCE_QUIT
 
 # load objects
-from . import obj_peak
 from . import obj_peaklist
 from . import obj_scan
 
+# load index
+from . import parser_index
+
+# load binary decoder
+from . import parser_binary
+
+# compile basic patterns
+DATA_PATTERN = re.compile(rb'<data\b[^>]*>')
+
 
 # PARSE mzData DATA
 # -----------------
@@ -44,6 +51,7 @@ class parseMZDATA():
         self._scans = None
         self._scanlist = None
         self._info = None
+        self._offsets = None
         
         # check path
         if not os.path.exists(path):
@@ -114,6 +122,16 @@ class parseMZDATA():
         if self._scanlist:
             return self._scanlist
         
+        # read scan headers by index
+        offsets = self._index()
+        if self._scanlist:
+            return self._scanlist
+        if offsets:
+            self._scanlist = self._readScanlist(offsets)
+            if self._scanlist:
+                parser_index.writeIndex(self.path, 'mzData', offsets, list(self._scanlist.values()))
+                return self._scanlist
+        
         # init parser
         handler = scanlistHandler()
         parser = xml.sax.make_parser()
@@ -139,6 +157,10 @@ class parseMZDATA():
         if self._scans and scanID in self._scans:
             data = self._scans[scanID]
         
+        # read scan by index
+        elif self._index():
+            data = self._readScan(scanID)
+        
         # parse file
         else:
             handler = scanHandler(scanID)
@@ -163,14 +185,178 @@ class parseMZDATA():
     # ----
     
     
+    def iterscans(self, msLevel=None, rtRange=None, mzRange=None):
+        """Iterate over scans in document order. Scans are read one by one
+        from indexed offsets, so only current scan is kept in memory.
+            msLevel (int or None) - ms level of scans to read
+            rtRange ((float, float) or None) - retention time range in seconds
+            mzRange ((float, float) or None) - m/z range to crop scans to
+        """
+        
+        # get index
+        offsets = self._index()
+        
+        # get metadata to skip unwanted scans without reading
+        scanlist = None
+        if msLevel is not None or rtRange is not None:
+            scanlist = self.scanlist() or None
+        
+        with open(self.path, 'rb') as document:
+            for index, item in enumerate(offsets):
+                CHECK_FORCE_QUIT()
+                
+                # check metadata
+                if scanlist and item[0] is not None and item[0] in scanlist:
+                    if not parser_index.matchScan(scanlist[item[0]], msLevel, rtRange):
+                        continue
+                
+                # read scan
+                data = self._parseScan(document, index)
+                if not data or not parser_index.matchScan(data, msLevel, rtRange):
+                    continue
+                
+                # make scan
+                scan = self._makeScan(data)
+                if mzRange is not None:
+                    scan.crop(mzRange[0], mzRange[1])
+                
+                yield scan
+    # ----
+    
+    
+    def _index(self):
+        """Get byte offsets of all spectra as list of [scanNumber, offset]."""
+        
+        # use loaded index
+        if self._offsets is not None:
+            return self._offsets
+        
+        # use stored index
+        stored = parser_index.readIndex(self.path, 'mzData')
+        if stored:
+            self._offsets = stored['offsets']
+            if stored['scanlist'] and not self._scanlist:
+                self._scanlist = dict((item['scanNumber'], item) for item in stored['scanlist'])
+            return self._offsets
+        
+        # scan the document
+        self._offsets = self._scanOffsets()
+        
+        # store index
+        parser_index.writeIndex(self.path, 'mzData', self._offsets)
+        
+        return self._offsets
+    # ----
+    
+    
+    def _scanOffsets(self):
+        """Find spectrum offsets by scanning the document."""
+        
+        offsets = []
+        for offset, tag in parser_index.scanElements(self.path, b'spectrum'):
+            scanNumber = parser_index.readAttribute(tag, 'id')
+            try: scanNumber = int(scanNumber)
+            except (TypeError, ValueError): scanNumber = None
+            offsets.append([scanNumber, offset])
+        
+        return offsets
+    # ----
+    
+    
+    def _readScan(self, scanID, retry=True):
+        """Read scan data from spectrum element at indexed offset."""
+        
+        # get offset
+        index = None
+        for x, item in enumerate(self._offsets):
+            if scanID is None or item[0] == scanID:
+                index = x
+                break
+        
+        if index is None:
+            return False
+        
+        # parse spectrum element only
+        try:
+            with open(self.path, 'rb') as document:
+                data = self._parseScan(document, index)
+        except (IOError, OSError):
+            data = False
+        
+        # rebuild outdated index and try again
+        if not data and retry:
+            self._offsets = self._scanOffsets()
+            parser_index.writeIndex(self.path, 'mzData', self._offsets)
+            return self._readScan(scanID, retry=False)
+        
+        return data
+    # ----
+    
+    
+    def _parseScan(self, document, index):
+        """Parse spectrum element at given index position."""
+        
+        scanNumber, offset = self._offsets[index]
+        
+        # init parser
+        handler = scanHandler(scanNumber)
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(handler)
+        
+        # parse element
+        try:
+            parser.feed(parser_index.readElement(document, offset, b'spectrum'))
+        except stopParsing:
+            pass
+        except (ValueError, xml.sax.SAXException):
+            return False
+        
+        return handler.data
+    # ----
+    
+    
+    def _readScanlist(self, offsets):
+        """Read scan list from spectrum headers at indexed offsets."""
+        
+        # init parser
+        handler = scanlistHandler()
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(handler)
+        
+        # parse headers only, binary data are skipped
+        try:
+            with open(self.path, 'rb') as document:
+                parser.feed(b'<spectrumList>')
+                for scanNumber, offset in offsets:
+                    CHECK_FORCE_QUIT()
+                    
+                    data = parser_index.readElement(document, offset, b'spectrum', stop=b'<mzArrayBinary')
+                    if not data.startswith(b'<spectrum'):
+                        return False
+                    
+                    # get points count from first data tag
+                    if not data.endswith(b'</spectrum>'):
+                        document.seek(offset + len(data))
+                        match = DATA_PATTERN.search(document.read(1024))
+                        if match:
+                            data += match.group(0).rstrip(b'/>') + b'/>'
+                        data += b'</spectrum>'
+                    
+                    parser.feed(data)
+        
+        except (IOError, OSError, ValueError, xml.sax.SAXException):
+            return False
+        
+        return handler.data
+    # ----
+    
+    
     def _makeScan(self, scanData):
         """Make scan object from raw data."""
         
         # parse peaks
         points = self._parsePoints(scanData)
         if scanData['spectrumType'] == 'discrete':
-            for x, p in enumerate(points):
-                points[x] = obj_peak.peak(p[0], p[1])
             scan = obj_scan.scan(peaklist=obj_peaklist.peaklist(points))
         else:
             scan = obj_scan.scan(profile=points)
@@ -198,50 +384,14 @@ class parseMZDATA():
         
         # check data
         if not scanData['mzData'] or not scanData['intData']:
-            return []
+            return numpy.zeros((0,2), dtype=numpy.float64)
         
         # decode data
-        mzData = base64.b64decode(scanData['mzData'])
-        intData = base64.b64decode(scanData['intData'])
-        
-        # get endian
-        mzEndian = '!'
-        intEndian = '!'
-        if scanData['mzEndian'] == 'little':
-            mzEndian = '<'
-        elif scanData['mzEndian'] == 'big':
-            mzEndian = '>'
-        if scanData['intEndian'] == 'little':
-            intEndian = '<'
-        elif scanData['intEndian'] == 'big':
-            intEndian = '>'
-        
-        # get precision
-        mzPrecision = 'f'
-        intPrecision = 'f'
-        if scanData['mzPrecision'] == 64:
-            mzPrecision = 'd'
-        if scanData['intPrecision'] == 64:
-            intPrecision = 'd'
-        
-        # convert from binary
-        count = len(mzData) / struct.calcsize(mzEndian + mzPrecision)
-        mzData = struct.unpack(mzEndian + mzPrecision * count, mzData[0:len(mzData)])
-        count = len(intData) / struct.calcsize(intEndian + intPrecision)
-        intData = struct.unpack(intEndian + intPrecision * count, intData[0:len(intData)])
+        mzData = parser_binary.decodeArray(scanData['mzData'], scanData['mzPrecision'], scanData['mzEndian'])
+        intData = parser_binary.decodeArray(scanData['intData'], scanData['intPrecision'], scanData['intEndian'])
         
         # format
-        if scanData['spectrumType'] == 'discrete':
-            data = map(list, zip(mzData, intData))
-        else:
-            mzData = numpy.array(mzData)
-            mzData.shape = (-1,1)
-            intData = numpy.array(intData)
-            intData.shape = (-1,1)
-            data = numpy.concatenate((mzData,intData), axis=1)
-            data = data.copy()
-        
-        return data
+        return parser_binary.makePoints(mzData, intData)
     # ----
     
     
@@ -18,9 +18,6 @@
 # load libs
 import xml.sax
 import xml.dom.minidom
-import base64
-import zlib
-import struct
 import re
 import os.path
 import numpy
@@ -30,12 +27,30 @@ from copy import deepcopy
 from .mod_stopper import CHECK_FORCE_QUIT
 
 # load objects
-from . import obj_peak
 from . import obj_peaklist
 from . import obj_scan
 
+# load index
+from . import parser_index
+
+# load binary decoder
+from . import parser_binary
+
 # compile basic patterns
 SCAN_NUMBER_PATTERN = re.compile('scan=([0-9]+)')
+INDEX_OFFSET_PATTERN = re.compile(rb'<indexListOffset>\s*([0-9]+)\s*</indexListOffset>')
+INDEX_PATTERN = re.compile(rb'<index\s+name\s*=\s*["\']spectrum["\']\s*>(.*?)</index>', re.S)
+OFFSET_PATTERN = re.compile(rb'<offset\s+idRef\s*=\s*(["\'])(.*?)\1[^>]*>\s*([0-9]+)\s*</offset>', re.S)
+
+# MS-Numpress params (encoding, compression)
+NUMPRESS_PARAMS = {
+    'MS-Numpress linear prediction compression': ('linear', None),
+    'MS-Numpress positive integer compression': ('pic', None),
+    'MS-Numpress short logged float compression': ('slof', None),
+    'MS-Numpress linear prediction compression followed by zlib compression': ('linear', 'zlib'),
+    'MS-Numpress positive integer compression followed by zlib compression': ('pic', 'zlib'),
+    'MS-Numpress short logged float compression followed by zlib compression': ('slof', 'zlib'),
+}
 
 
 # PARSE mzML DATA
@@ -49,6 +64,7 @@ class parseMZML():
         self._scans = None
         self._scanlist = None
         self._info = None
+        self._offsets = None
         
         # check path
         if not os.path.exists(path):
@@ -83,6 +99,8 @@ class parseMZML():
                 del self._scanlist[scanNumber]['intData']
                 del self._scanlist[scanNumber]['intPrecision']
                 del self._scanlist[scanNumber]['intCompression']
+                del self._scanlist[scanNumber]['mzNumpress']
+                del self._scanlist[scanNumber]['intNumpress']
     # ----
     
     
@@ -119,6 +137,16 @@ class parseMZML():
         if self._scanlist:
             return self._scanlist
         
+        # read scan headers by index
+        offsets = self._index()
+        if self._scanlist:
+            return self._scanlist
+        if offsets:
+            self._scanlist = self._readScanlist(offsets)
+            if self._scanlist:
+                parser_index.writeIndex(self.path, 'mzML', offsets, list(self._scanlist.values()))
+                return self._scanlist
+        
         # init parser
         handler = scanlistHandler()
         parser = xml.sax.make_parser()
@@ -144,6 +172,10 @@ class parseMZML():
         if self._scans and scanID in self._scans:
             data = self._scans[scanID]
         
+        # read scan by index
+        elif self._index():
+            data = self._readScan(scanID)
+        
         # parse file
         else:
             handler = scanHandler(scanID)
@@ -167,14 +199,207 @@ class parseMZML():
     # ----
     
     
+    def iterscans(self, msLevel=None, rtRange=None, mzRange=None):
+        """Iterate over scans in document order. Scans are read one by one
+        from indexed offsets, so only current scan is kept in memory.
+            msLevel (int or None) - ms level of scans to read
+            rtRange ((float, float) or None) - retention time range in seconds
+            mzRange ((float, float) or None) - m/z range to crop scans to
+        """
+        
+        # get index
+        offsets = self._index()
+        
+        # get metadata to skip unwanted scans without reading
+        scanlist = None
+        if msLevel is not None or rtRange is not None:
+            scanlist = self.scanlist() or None
+        
+        with open(self.path, 'rb') as document:
+            for index, item in enumerate(offsets):
+                CHECK_FORCE_QUIT()
+                
+                # check metadata
+                if scanlist and item[0] is not None and item[0] in scanlist:
+                    if not parser_index.matchScan(scanlist[item[0]], msLevel, rtRange):
+                        continue
+                
+                # read scan
+                data = self._parseScan(document, index)
+                if not data or not parser_index.matchScan(data, msLevel, rtRange):
+                    continue
+                
+                # make scan
+                scan = self._makeScan(data)
+                if mzRange is not None:
+                    scan.crop(mzRange[0], mzRange[1])
+                
+                yield scan
+    # ----
+    
+    
+    def _index(self):
+        """Get byte offsets of all spectra as list of [scanNumber, offset]."""
+        
+        # use loaded index
+        if self._offsets is not None:
+            return self._offsets
+        
+        # use stored index
+        stored = parser_index.readIndex(self.path, 'mzML')
+        if stored:
+            self._offsets = stored['offsets']
+            if stored['scanlist'] and not self._scanlist:
+                self._scanlist = dict((item['scanNumber'], item) for item in stored['scanlist'])
+            return self._offsets
+        
+        # read embedded index or scan the document
+        self._offsets = self._readOffsets()
+        if self._offsets is None:
+            self._offsets = self._scanOffsets()
+        
+        # store index
+        parser_index.writeIndex(self.path, 'mzML', self._offsets)
+        
+        return self._offsets
+    # ----
+    
+    
+    def _readOffsets(self):
+        """Read spectrum offsets from indexedmzML index list."""
+        
+        try:
+            
+            # get index list position
+            match = INDEX_OFFSET_PATTERN.search(parser_index.readTail(self.path))
+            if not match:
+                return None
+            
+            # read index list
+            with open(self.path, 'rb') as document:
+                document.seek(int(match.group(1)))
+                match = INDEX_PATTERN.search(document.read())
+                if not match:
+                    return None
+                
+                offsets = []
+                for item in OFFSET_PATTERN.finditer(match.group(1)):
+                    scanNumber = _parseScanNumber(item.group(2).decode('utf-8', 'replace'))
+                    offsets.append([scanNumber, int(item.group(3))])
+                
+                # check offsets point to spectra
+                if offsets:
+                    document.seek(offsets[0][1])
+                    if document.read(9) != b'<spectrum':
+                        return None
+        
+        except (IOError, OSError, ValueError):
+            return None
+        
+        return offsets
+    # ----
+    
+    
+    def _scanOffsets(self):
+        """Find spectrum offsets by scanning the document."""
+        
+        offsets = []
+        for offset, tag in parser_index.scanElements(self.path, b'spectrum'):
+            scanNumber = _parseScanNumber(parser_index.readAttribute(tag, 'id') or '')
+            offsets.append([scanNumber, offset])
+        
+        return offsets
+    # ----
+    
+    
+    def _readScan(self, scanID, retry=True):
+        """Read scan data from spectrum element at indexed offset."""
+        
+        # get offset
+        index = None
+        for x, item in enumerate(self._offsets):
+            if scanID is None or item[0] == scanID:
+                index = x
+                break
+        
+        if index is None:
+            return False
+        
+        # parse spectrum element only
+        try:
+            with open(self.path, 'rb') as document:
+                data = self._parseScan(document, index)
+        except (IOError, OSError):
+            data = False
+        
+        # rebuild outdated index and try again
+        if not data and retry:
+            self._offsets = self._scanOffsets()
+            parser_index.writeIndex(self.path, 'mzML', self._offsets)
+            return self._readScan(scanID, retry=False)
+        
+        return data
+    # ----
+    
+    
+    def _parseScan(self, document, index):
+        """Parse spectrum element at given index position."""
+        
+        scanNumber, offset = self._offsets[index]
+        
+        # init parser
+        handler = scanHandler(scanNumber)
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(handler)
+        
+        # parse element
+        try:
+            parser.feed(parser_index.readElement(document, offset, b'spectrum'))
+        except stopParsing:
+            pass
+        except xml.sax.SAXException:
+            return False
+        
+        return handler.data
+    # ----
+    
+    
+    def _readScanlist(self, offsets):
+        """Read scan list from spectrum headers at indexed offsets."""
+        
+        # init parser
+        handler = scanlistHandler()
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(handler)
+        
+        # parse headers only, binary data are skipped
+        try:
+            with open(self.path, 'rb') as document:
+                parser.feed(b'<mzML>')
+                for scanNumber, offset in offsets:
+                    CHECK_FORCE_QUIT()
+                    
+                    data = parser_index.readElement(document, offset, b'spectrum', stop=b'<binaryDataArrayList')
+                    if not data.startswith(b'<spectrum'):
+                        return False
+                    if not data.endswith(b'</spectrum>'):
+                        data += b'</spectrum>'
+                    
+                    parser.feed(data)
+        
+        except (IOError, OSError, xml.sax.SAXException):
+            return False
+        
+        return handler.data
+    # ----
+    
+    
     def _makeScan(self, scanData):
         """Make scan object from raw data."""
         
         # parse peaks
         points = self._parsePoints(scanData)
         if scanData['spectrumType'] == 'discrete':
-            for x, p in enumerate(points):
-                points[x] = obj_peak.peak(p[0], p[1])
             scan = obj_scan.scan(peaklist=obj_peaklist.peaklist(points))
         else:
             scan = obj_scan.scan(profile=points)
@@ -202,44 +427,14 @@ class parseMZML():
         
         # check data
         if not scanData['mzData'] or not scanData['intData']:
-            return []
+            return numpy.zeros((0,2), dtype=numpy.float64)
         
         # decode data
-        mzData = base64.b64decode(scanData['mzData'])
-        intData = base64.b64decode(scanData['intData'])
-        
-        # decompress data
-        if scanData['mzCompression'] == 'zlib':
-            mzData = zlib.decompress(mzData)
-        if scanData['intCompression'] == 'zlib':
-            intData = zlib.decompress(intData)
-        
-        # get precision
-        mzPrecision = 'f'
-        intPrecision = 'f'
-        if scanData['mzPrecision'] == 64:
-            mzPrecision = 'd'
-        if scanData['intPrecision'] == 64:
-            intPrecision = 'd'
-        
-        # convert from binary
-        count = len(mzData) / struct.calcsize('<' + mzPrecision)
-        mzData = struct.unpack('<' + mzPrecision * count, mzData[0:len(mzData)])
-        count = len(intData) / struct.calcsize('<' + intPrecision)
-        intData = struct.unpack('<' + intPrecision * count, intData[0:len(intData)])
+        mzData = parser_binary.decodeArray(scanData['mzData'], scanData['mzPrecision'], 'little', scanData['mzCompression'], scanData['mzNumpress'])
+        intData = parser_binary.decodeArray(scanData['intData'], scanData['intPrecision'], 'little', scanData['intCompression'], scanData['intNumpress'])
         
         # format
-        if scanData['spectrumType'] == 'discrete':
-            data = map(list, zip(mzData, intData))
-        else:
-            mzData = numpy.array(mzData)
-            mzData.shape = (-1,1)
-            intData = numpy.array(intData)
-            intData.shape = (-1,1)
-            data = numpy.concatenate((mzData,intData), axis=1)
-            data = data.copy()
-        
-        return data
+        return parser_binary.makePoints(mzData, intData)
     # ----
     
     
@@ -456,6 +651,7 @@ class scanHandler(xml.sax.handler.ContentHandler):
         self.tmpBinaryData = None
         self.tmpPrecision = None
         self.tmpCompression = None
+        self.tmpNumpress = None
         self.tmpArrayType = None
     # ----
     
@@ -498,9 +694,11 @@ class scanHandler(xml.sax.handler.ContentHandler):
                     'mzData': None,
                     'mzPrecision': None,
                     'mzCompression': None,
+                    'mzNumpress': None,
                     'intData': None,
                     'intPrecision': None,
                     'intCompression': None,
+                    'intNumpress': None,
                 }
                 
                 # get points count
@@ -523,6 +721,7 @@ class scanHandler(xml.sax.handler.ContentHandler):
             self.tmpBinaryData = []
             self.tmpPrecision = None
             self.tmpCompression = None
+            self.tmpNumpress = None
             self.tmpArrayType = None
         
         # data array tag
@@ -559,6 +758,8 @@ class scanHandler(xml.sax.handler.ContentHandler):
                 self.tmpCompression = 'zlib'
             elif paramName == 'no compression':
                 self.tmpCompression = None
+            elif paramName in NUMPRESS_PARAMS:
+                self.tmpNumpress, self.tmpCompression = NUMPRESS_PARAMS[paramName]
             
             # array type
             elif paramName == 'm/z array':
@@ -638,16 +839,19 @@ class scanHandler(xml.sax.handler.ContentHandler):
                 self.data['mzData'] = ''.join(self.tmpBinaryData)
                 self.data['mzPrecision'] = self.tmpPrecision
                 self.data['mzCompression'] = self.tmpCompression
+                self.data['mzNumpress'] = self.tmpNumpress
             
             # intensity array
             elif self.tmpArrayType == 'intArray':
                 self.data['intData'] = ''.join(self.tmpBinaryData)
                 self.data['intPrecision'] = self.tmpPrecision
                 self.data['intCompression'] = self.tmpCompression
+                self.data['intNumpress'] = self.tmpNumpress
             
             self.tmpBinaryData = None
             self.tmpPrecision = None
             self.tmpCompression = None
+            self.tmpNumpress = None
         
         # stop reading binary array
         elif name == 'binary' and self._isMatch:
@@ -680,6 +884,7 @@ class runHandler(xml.sax.handler.ContentHandler):
         self.tmpBinaryData = None
         self.tmpPrecision = None
         self.tmpCompression = None
+        self.tmpNumpress = None
         self.tmpArrayType = None
     # ----
     
@@ -718,9 +923,11 @@ class runHandler(xml.sax.handler.ContentHandler):
                 'mzData': None,
                 'mzPrecision': None,
                 'mzCompression': None,
+                'mzNumpress': None,
                 'intData': None,
                 'intPrecision': None,
                 'intCompression': None,
+                'intNumpress': None,
             }
             
             # get points count
@@ -746,6 +953,7 @@ class runHandler(xml.sax.handler.ContentHandler):
             self.tmpBinaryData = []
             self.tmpPrecision = None
             self.tmpCompression = None
+            self.tmpNumpress = None
             self.tmpArrayType = None
         
         # data array tag
@@ -782,6 +990,8 @@ class runHandler(xml.sax.handler.ContentHandler):
                 self.tmpCompression = 'zlib'
             elif paramName == 'no compression':
                 self.tmpCompression = None
+            elif paramName in NUMPRESS_PARAMS:
+                self.tmpNumpress, self.tmpCompression = NUMPRESS_PARAMS[paramName]
             
             # array type
             elif paramName == 'm/z array':
@@ -857,16 +1067,19 @@ class runHandler(xml.sax.handler.ContentHandler):
                 self.data[self.currentID]['mzData'] = ''.join(self.tmpBinaryData)
                 self.data[self.currentID]['mzPrecision'] = self.tmpPrecision
                 self.data[self.currentID]['mzCompression'] = self.tmpCompression
+                self.data[self.currentID]['mzNumpress'] = self.tmpNumpress
             
             # intensity array
             elif self.tmpArrayType == 'intArray':
                 self.data[self.currentID]['intData'] = ''.join(self.tmpBinaryData)
                 self.data[self.currentID]['intPrecision'] = self.tmpPrecision
                 self.data[self.currentID]['intCompression'] = self.tmpCompression
+                self.data[self.currentID]['intNumpress'] = self.tmpNumpress
             
             self.tmpBinaryData = None
             self.tmpPrecision = None
             self.tmpCompression = None
+            self.tmpNumpress = None
         
         # stop reading binary array
         elif name == 'binary':
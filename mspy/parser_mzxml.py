@@ -18,9 +18,6 @@
 # load libs
 import xml.sax
 import xml.dom.minidom
-import base64
-import zlib
-import struct
 import re
 import os.path
 import numpy
@@ -30,12 +27,21 @@ from copy import deepcopy
 from .mod_stopper import CHECK_FORCE_QUIT
 
 # load objects
-from . import obj_peak
 from . import obj_peaklist
 from . import obj_scan
 
+# load index
+from . import parser_index
+
+# load binary decoder
+from . import parser_binary
+
 # compile basic patterns
 RETENTION_TIME_PATTERN = re.compile('^PT((\d*\.?\d*)M)?((\d*\.?\d*)S)?$')
+INDEX_OFFSET_PATTERN = re.compile(rb'<indexOffset>\s*([0-9]+)\s*</indexOffset>')
+INDEX_PATTERN = re.compile(rb'<index\s+name\s*=\s*["\']scan["\']\s*>(.*?)</index>', re.S)
+OFFSET_PATTERN = re.compile(rb'<offset\s+id\s*=\s*(["\'])(.*?)\1[^>]*>\s*([0-9]+)\s*</offset>', re.S)
+DATA_PROCESSING_PATTERN = re.compile(rb'<dataProcessing\s[^>]*>')
 
 
 # PARSE mzXML DATA
@@ -49,6 +55,8 @@ class parseMZXML():
         self._scans = None
         self._scanlist = None
         self._info = None
+        self._offsets = None
+        self._spectrumType = None
         
         # check path
         if not os.path.exists(path):
@@ -117,6 +125,16 @@ class parseMZXML():
         if self._scanlist:
             return self._scanlist
         
+        # read scan headers by index
+        offsets = self._index()
+        if self._scanlist:
+            return self._scanlist
+        if offsets:
+            self._scanlist = self._readScanlist(offsets)
+            if self._scanlist:
+                parser_index.writeIndex(self.path, 'mzXML', offsets, list(self._scanlist.values()))
+                return self._scanlist
+        
         # init parser
         handler = scanlistHandler()
         parser = xml.sax.make_parser()
@@ -142,6 +160,10 @@ class parseMZXML():
         if self._scans and scanID in self._scans:
             data = self._scans[scanID]
         
+        # read scan by index
+        elif self._index():
+            data = self._readScan(scanID)
+        
         # parse file
         else:
             handler = scanHandler(scanID)
@@ -166,14 +188,263 @@ class parseMZXML():
     # ----
     
     
+    def iterscans(self, msLevel=None, rtRange=None, mzRange=None):
+        """Iterate over scans in document order. Scans are read one by one
+        from indexed offsets, so only current scan is kept in memory.
+            msLevel (int or None) - ms level of scans to read
+            rtRange ((float, float) or None) - retention time range in seconds
+            mzRange ((float, float) or None) - m/z range to crop scans to
+        """
+        
+        # get index
+        offsets = self._index()
+        
+        # get metadata to skip unwanted scans without reading
+        scanlist = None
+        if msLevel is not None or rtRange is not None:
+            scanlist = self.scanlist() or None
+        
+        with open(self.path, 'rb') as document:
+            for index, item in enumerate(offsets):
+                CHECK_FORCE_QUIT()
+                
+                # check metadata
+                if scanlist and item[0] is not None and item[0] in scanlist:
+                    if not parser_index.matchScan(scanlist[item[0]], msLevel, rtRange):
+                        continue
+                
+                # read scan
+                data = self._parseScan(document, index)
+                if not data or not parser_index.matchScan(data, msLevel, rtRange):
+                    continue
+                
+                # make scan
+                scan = self._makeScan(data)
+                if mzRange is not None:
+                    scan.crop(mzRange[0], mzRange[1])
+                
+                yield scan
+    # ----
+    
+    
+    def _index(self):
+        """Get byte offsets of all scans as list of [scanNumber, offset, parentScanNumber]."""
+        
+        # use loaded index
+        if self._offsets is not None:
+            return self._offsets
+        
+        # use stored index
+        stored = parser_index.readIndex(self.path, 'mzXML')
+        if stored:
+            self._offsets = stored['offsets']
+            if stored['scanlist'] and not self._scanlist:
+                self._scanlist = dict((item['scanNumber'], item) for item in stored['scanlist'])
+            return self._offsets
+        
+        # read embedded index or scan the document
+        self._offsets = self._readOffsets()
+        if self._offsets is None:
+            self._offsets = self._scanOffsets()
+        
+        # store index
+        parser_index.writeIndex(self.path, 'mzXML', self._offsets)
+        
+        return self._offsets
+    # ----
+    
+    
+    def _readOffsets(self):
+        """Read scan offsets from embedded index."""
+        
+        try:
+            
+            # get index position
+            match = INDEX_OFFSET_PATTERN.search(parser_index.readTail(self.path))
+            if not match:
+                return None
+            
+            # read index
+            with open(self.path, 'rb') as document:
+                document.seek(int(match.group(1)))
+                match = INDEX_PATTERN.search(document.read())
+                if not match:
+                    return None
+                
+                offsets = []
+                for item in OFFSET_PATTERN.finditer(match.group(1)):
+                    offsets.append([int(item.group(2)), int(item.group(3)), None])
+                offsets.sort(key=lambda x: x[1])
+                
+                # check offsets point to scans
+                if offsets:
+                    document.seek(offsets[0][1])
+                    if document.read(5) != b'<scan':
+                        return None
+                
+                # get parent scans
+                self._setParents(document, offsets)
+        
+        except (IOError, OSError, ValueError):
+            return None
+        
+        return offsets
+    # ----
+    
+    
+    def _scanOffsets(self):
+        """Find scan offsets by scanning the document."""
+        
+        offsets = []
+        for offset, tag in parser_index.scanElements(self.path, b'scan'):
+            scanNumber = parser_index.readAttribute(tag, 'num')
+            if scanNumber is not None:
+                scanNumber = int(scanNumber)
+            offsets.append([scanNumber, offset, None])
+        
+        # get parent scans
+        with open(self.path, 'rb') as document:
+            self._setParents(document, offsets)
+        
+        return offsets
+    # ----
+    
+    
+    def _setParents(self, document, offsets):
+        """Set parent scan numbers of nested scans."""
+        
+        parents = parser_index.nestElements(document, [x[1] for x in offsets], b'scan')
+        for item, parent in zip(offsets, parents):
+            if parent is not None:
+                item[2] = offsets[parent][0]
+    # ----
+    
+    
+    def _getSpectrumType(self):
+        """Get spectrum type from data processing in document header."""
+        
+        # use cached value
+        if self._spectrumType is not None:
+            return self._spectrumType
+        
+        # read header before first scan
+        self._spectrumType = 'unknown'
+        with open(self.path, 'rb') as document:
+            header = document.read(self._offsets[0][1])
+        
+        for tag in DATA_PROCESSING_PATTERN.findall(header):
+            centroided = parser_index.readAttribute(tag, 'centroided')
+            if centroided and centroided != '0':
+                self._spectrumType = 'discrete'
+        
+        return self._spectrumType
+    # ----
+    
+    
+    def _readScan(self, scanID, retry=True):
+        """Read scan data from scan element at indexed offset."""
+        
+        # get offset
+        index = None
+        for x, item in enumerate(self._offsets):
+            if scanID is None or item[0] == scanID:
+                index = x
+                break
+        
+        if index is None:
+            return False
+        
+        # parse scan element only
+        try:
+            with open(self.path, 'rb') as document:
+                data = self._parseScan(document, index)
+        except (IOError, OSError):
+            data = False
+        
+        # rebuild outdated index and try again
+        if not data and retry:
+            self._offsets = self._scanOffsets()
+            parser_index.writeIndex(self.path, 'mzXML', self._offsets)
+            return self._readScan(scanID, retry=False)
+        
+        return data
+    # ----
+    
+    
+    def _parseScan(self, document, index):
+        """Parse scan element at given index position, nested scans are skipped."""
+        
+        scanNumber, offset, parent = self._offsets[index]
+        
+        # init parser
+        handler = scanHandler(scanNumber)
+        handler._spectrumType = self._getSpectrumType()
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(handler)
+        
+        # read scan own data up to next scan
+        if index+1 < len(self._offsets):
+            document.seek(offset)
+            data = document.read(self._offsets[index+1][1] - offset)
+        else:
+            data = parser_index.readElement(document, offset, b'msRun')
+            data = parser_index.stripEndTags(data, b'msRun')[0]
+        data = parser_index.stripEndTags(data, b'scan')[0]
+        
+        # parse element
+        try:
+            parser.feed(b'<msRun>')
+            parser.feed(data + b'</scan>')
+        except stopParsing:
+            pass
+        except xml.sax.SAXException:
+            return False
+        
+        # set parent scan
+        if handler.data:
+            handler.data['parentScanNumber'] = parent
+        
+        return handler.data
+    # ----
+    
+    
+    def _readScanlist(self, offsets):
+        """Read scan list from scan headers at indexed offsets."""
+        
+        # init parser
+        handler = scanlistHandler()
+        handler._spectrumType = self._getSpectrumType()
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(handler)
+        
+        # parse headers only, peaks are skipped
+        try:
+            with open(self.path, 'rb') as document:
+                parser.feed(b'<msRun>')
+                for scanNumber, offset, parent in offsets:
+                    CHECK_FORCE_QUIT()
+                    
+                    data = parser_index.readElement(document, offset, b'scan', stop=b'<peaks')
+                    if not data.startswith(b'<scan'):
+                        return False
+                    
+                    data = parser_index.stripEndTags(data, b'scan')[0]
+                    parser.feed(data + b'</scan>')
+                    handler.data[scanNumber]['parentScanNumber'] = parent
+        
+        except (IOError, OSError, KeyError, xml.sax.SAXException):
+            return False
+        
+        return handler.data
+    # ----
+    
+    
     def _makeScan(self, scanData):
         """Make scan object from raw data."""
         
         # parse peaks
         points = self._parsePoints(scanData)
         if scanData['spectrumType'] == 'discrete':
-            for x, p in enumerate(points):
-                points[x] = obj_peak.peak(p[0], p[1])
             scan = obj_scan.scan(peaklist=obj_peaklist.peaklist(points))
         else:
             scan = obj_scan.scan(profile=points)
@@ -201,40 +472,13 @@ class parseMZXML():
         
         # check data
         if not scanData['points']:
-            return []
-        
-        # get precision
-        precision = 'f'
-        if scanData['precision'] == 64:
-            precision = 'd'
-        
-        # get endian
-        endian = '!'
-        if scanData['byteOrder'] == 'little':
-            endian = '<'
-        elif scanData['byteOrder'] == 'big':
-            endian = '>'
+            return numpy.zeros((0,2), dtype=numpy.float64)
         
         # decode data
-        data = base64.b64decode(scanData['points'])
-        
-        # decompress data
-        if scanData['compression'] == 'zlib':
-            data = zlib.decompress(data)
-        
-        # convert from binary
-        count = len(data) / struct.calcsize(endian + precision)
-        data = struct.unpack(endian + precision * count, data[0:len(data)])
+        data = parser_binary.decodeArray(scanData['points'], scanData['precision'], scanData['byteOrder'], scanData['compression'])
         
         # format
-        if scanData['spectrumType'] == 'discrete':
-            data = map(list, zip(data[::2], data[1::2]))
-        else:
-            data = numpy.array(data)
-            data.shape = (-1,2)
-            data = data.copy()
-        
-        return data
+        return parser_binary.makePairs(data)
     # ----
     
     
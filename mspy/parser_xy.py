@@ -18,15 +18,23 @@
 # load libs
 import re
 import os.path
+import numpy
 
 # load stopper
 from .mod_stopper import CHECK_FORCE_QUIT
 
 # load objects
-from . import obj_peak
 from . import obj_peaklist
 from . import obj_scan
 
+# load binary decoder
+from . import parser_binary
+
+
+# compile basic patterns
+COMMENT_PATTERN = re.compile(rb'^[ \t]*(#|m/z).*$', re.M)
+SEPARATORS = bytes.maketrans(b',;', b'  ')
+
 
 # PARSE SIMPLE ASCII XY
 # ---------------------
@@ -67,7 +75,7 @@ class parseXY():
         data = self._parseData()
         
         # check data
-        if not data:
+        if data is False or not len(data):
             return False
         
         # return scan
@@ -75,24 +83,68 @@ class parseXY():
     # ----
     
     
+    def iterscans(self, msLevel=None, rtRange=None, mzRange=None, dataType='continuous'):
+        """Iterate over scans in document. XY document contains single scan
+        without ms level and retention time, so it is skipped if any of these
+        filters is used.
+            msLevel (int or None) - ms level of scans to read
+            rtRange ((float, float) or None) - retention time range in seconds
+            mzRange ((float, float) or None) - m/z range to crop scans to
+            dataType (continuous or discrete) - data type of scans
+        """
+        
+        # check filters
+        if msLevel is not None or rtRange is not None:
+            return
+        
+        # get scan
+        scan = self.scan(dataType)
+        if not scan:
+            return
+        
+        # crop data
+        if mzRange is not None:
+            scan.crop(mzRange[0], mzRange[1])
+        
+        yield scan
+    # ----
+    
+    
     def _parseData(self):
         """Parse data."""
         
         # open document
         try:
-            document = open(self.path)
-            rawData = document.readlines()
+            document = open(self.path, 'rb')
+            rawData = document.read()
             document.close()
         except IOError:
             return False
         
+        # remove comment lines
+        if b'#' in rawData or b'm/z' in rawData:
+            rawData = COMMENT_PATTERN.sub(b'', rawData)
+        
+        # convert all points at once
+        data = parser_binary.decodeColumns(rawData.translate(SEPARATORS))
+        if data is not None and data.shape[1] >= 2:
+            return data[:,:2]
+        
+        # parse line by line
+        return self._parseLines(rawData.decode('utf-8', 'replace'))
+    # ----
+    
+    
+    def _parseLines(self, rawData):
+        """Parse data line by line."""
+        
         #pattern = re.compile('^([-0-9\.eE+]+)[ \t]*(;|,)?[ \t]*([-0-9\.eE+]*)$')
         # new version to absorb junk at the end
         pattern = re.compile('^([-0-9\.eE+]+)[ \t]*(;|,)?[ \t]*([-0-9\.eE+]*).*$')
         
         # read lines
         data = []
-        for line in rawData:
+        for line in rawData.splitlines():
             line = line.strip()
             
             # discard comment lines
@@ -111,7 +163,7 @@ class parseXY():
             else:
                 return False
         
-        return data
+        return numpy.array(data, dtype=numpy.float64).reshape(-1, 2)
     # ----
     
     
@@ -120,10 +172,7 @@ class parseXY():
         
         # parse data as peaklist (discrete points)
         if dataType == 'discrete':
-            buff = []
-            for point in scanData:
-                buff.append(obj_peak.peak(point[0], point[1]))
-            scan = obj_scan.scan(peaklist=obj_peaklist.peaklist(buff))
+            scan = obj_scan.scan(peaklist=obj_peaklist.peaklist(scanData))
         
         # parse data as spectrum (continuous line)
         else:
@@ -921,7 +921,7 @@ class spectrum:
         
         # convert peaklist points to array
         self.peaklist = copy.deepcopy(scan.peaklist)
-        self.peaklistPoints = numpy.array([[peak.mz, peak.ai, peak.base] for peak in scan.peaklist])
+        self.peaklistPoints = numpy.column_stack((self.peaklist.values('mz'), self.peaklist.values('ai'), self.peaklist.values('base')))
         self.peaklistCropped = self.peaklistPoints
         self.peaklistScaled = self.peaklistCropped
         self.peaklistCroppedPeaks = self.peaklist[:]
@@ -1,206 +1,280 @@
 import os
 import sys
-import joblib
-import hashlib
+import json
+import queue
 import argparse
+import numpy
 from time import time
+from collections import deque
 from pathlib import Path
-from xml.dom.minidom import parse
-from multiprocessing import Pool, cpu_count, Value, Lock
-from mspy.obj_compound import compound as Compound
-from gui.panel_compounds_search import FORMULAS, CurrentCompound
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import Pool, cpu_count
+from gui.compounds_index import loadLibrary, compoundExpressions
+from gui.ion_engine import FORMULAS, RADICAL, ionGenerator
+from gui.ion_cache import ionCache, ionStoreBuilder, fingerprint
 
 # ---------- Configuration ----------
 COMPOUND_XML = os.path.join("configs", "compounds.xml")
 MASS_TYPE = 0  # 0 = monoisotopic, 1 = average
 MAX_CHARGE = 1
 RADICALS = True
-ADDUCTS = list(FORMULAS.keys())
+ADDUCTS = [adduct for adduct in FORMULAS if not adduct.startswith("(")]
 ISOTOPES = [iso for iso in FORMULAS if iso.startswith("(")]
+CHUNK_SIZE = 2000  # compounds per chunk before the cost is measured
+MIN_CHUNK_SIZE = 50
+MAX_CHUNK_SIZE = 50000
+TARGET_CHUNK_SECONDS = 2.0  # chunk size adapts to keep tasks around this duration
+SHARD_SIZE = 5000000  # ions per cache shard
+CHECKPOINT_SECONDS = 60  # max time between checkpoints
+JOURNAL_NAME = "precompute.journal"
 
 # ---------- Argument parsing ----------
 parser = argparse.ArgumentParser(description="Precompute ion configurations for compounds.")
 parser.add_argument('--home', action='store_true', help="Use ~/.mmass/cache as output directory")
 parser.add_argument('--group-name', type=str, default=None, help="Optional: limit to a specific group name in compounds.xml")
+parser.add_argument('--restart', action='store_true', help="Ignore journal of an interrupted run and plan from scratch")
 args = parser.parse_args()
 
 # ---------- Output directory ----------
 OUTPUT_ROOT = Path.home() / '.mmass' / 'cache' / 'ions' if args.home else Path("cache/ions")
 OUTPUT_ROOT.mkdir(parents=True, exist_ok=True)
+JOURNAL_PATH = OUTPUT_ROOT / JOURNAL_NAME
 
 # ---------- Utility Functions ----------
-def config_to_hash(name: str, adduct: str, charge: int, isotope: str, mass_type: int) -> str:
-    key = f"{name}|{adduct}|{charge}|{isotope or ''}|{mass_type}"
-    h = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
-    log_path = OUTPUT_ROOT / 'config_hash_log.txt'
-    try:
-        with log_path.open("a", encoding="utf-8") as f:
-            f.write(f"{h} | {key}\n")
-    except Exception as e:
-        print(f"[config_to_hash] Failed to write log: {e}")
-    return h
-
 def get_safe_cpu_count(reserve=2):
     return max(1, (cpu_count() or 1) - reserve)
 
 def get_all_compounds(xml_path, group_name=None):
-    compounds = {}
-    doc = parse(xml_path)
-    groups = doc.getElementsByTagName("group")
-
-    selected_groups = [g for g in groups if g.getAttribute("name") == group_name] if group_name else groups
+    """Get compound name to formula map, using the library index when up to date."""
+    library = loadLibrary(xml_path)
+    if group_name:
+        selected_groups = [library[group_name]] if group_name in library else []
+    else:
+        selected_groups = list(library.values())
     if not selected_groups:
         print(f"No group found with name '{group_name}'")
         return {}
 
+    compounds = {}
     for group in selected_groups:
-        for ctag in group.getElementsByTagName("compound"):
-            name = ctag.getAttribute("name")
-            formula = ctag.getAttribute("formula")
-            if not name or not formula:
-                continue
-            try:
-                c = Compound(formula)
-                compounds[name] = c
-            except Exception:
-                continue
+        compounds.update(compoundExpressions(group))
     print(f"Loaded {len(compounds)} compounds.")
     return compounds
 
-def generate_single_config_ions(name, compound, adduct, charge, isotope, mass_type):
-    result = []
-    hash_id = config_to_hash(name, adduct, charge, isotope, mass_type)
-    out_dir = OUTPUT_ROOT / compound.expression
-    out_path = out_dir / (hash_id + ".joblib")
-    invalid_path = out_dir / (hash_id + ".invalid")
-
-    try:
-        adduct_formula = FORMULAS[adduct]
-        if adduct in ('[M+Li]+', '[M+Na-2H]-', '[M+K-2H]-', '[M+Na]+', '[M+K]+', '[M+NH4]+'):
-            formula = f'{compound.expression}({adduct_formula})(H-1)'
-        elif adduct in ('[M+Cl]-', '[M-CH3]-', '[M-C3H10N]-', '[M-C5H12N]-'):
-            formula = f'{compound.expression}({adduct_formula})(H)'
-        elif adduct in ('[2M+Na]+', '[2M+K]+', '[2M+NH4]+', '[2M+H]+', '[2M-H]-'):
-            formula = f'{2 * compound.expression}({adduct_formula})(H-1)'
-        elif adduct in ('[2M+Cl]-', '[2M+Na-2H]-', '[2M+K-2H]-'):
-            formula = f'{2 * compound.expression}({adduct_formula})(H)'
-        elif adduct in ('[M-H2O-H]-', '[M-H2O+H]+', '[+MeOH+H]+', '[+ACN+H]+',
-                        '[M+FMP10]+', '[M+2FMP10]+', '[M+2FMP10-CH3]+',
-                        '[M+AMPP]+', '[M+2AMPP]+', '[M+3AMPP]+'):
-            formula = f'{compound.expression}({adduct_formula})'
-        else:
-            formula = compound.expression
-
-        c = Compound(formula)
-        if not c.isvalid():
-            out_dir.mkdir(parents=True, exist_ok=True)
-            invalid_path.touch()
-            return
-
-        if isotope:
-            iso_formula = f'{formula}({FORMULAS[isotope]})'
-            ci = Compound(iso_formula)
-            if ci.isvalid():
-                mz = ci.mz(charge)[mass_type]
-                result.append(CurrentCompound(name=name, mz=mz, z=charge, adduct=adduct,
-                                              isotope=isotope, formula=ci.expression))
-            else:
-                out_dir.mkdir(parents=True, exist_ok=True)
-                invalid_path.touch()
-                return
-        else:
-            mz = c.mz(charge)[mass_type]
-            result.append(CurrentCompound(name=name, mz=mz, z=charge, adduct=adduct, formula=c.expression))
+def generate_chunk_ions(chunk, items, charges, adducts, isotopes, mass_type, radicals):
+    """Generate ions of a chunk of (name, expression) compounds by the vectorized engine."""
+    start = time()
+    generator = ionGenerator(items)
+    ions = generator.generate(charges, adducts, isotopes, mass_type, radicals=radicals)
+    formulas = generator.formulas(ions)
+    return chunk, os.getpid(), time() - start, generator.names, generator.expressions, ions, formulas
 
-    except Exception as e:
-        print(f"[{name}] Error generating ion for {adduct}, {isotope}: {e}")
-        out_dir.mkdir(parents=True, exist_ok=True)
-        invalid_path.touch()
-        return
+def generate_chunk_ions_task(task):
+    return generate_chunk_ions(*task)
 
-    if result:
-        out_dir.mkdir(parents=True, exist_ok=True)
-        try:
-            joblib.dump(result, out_path, compress=("zlib", 3))
-        except Exception as e:
-            print(f"[{name}] Failed to save ions: {e}")
-            invalid_path.touch()
-
-def check_and_prepare_task(name, cmpd, adduct, charge, isotope, mass_type):
-    hash_id = config_to_hash(name, adduct, charge, isotope, mass_type)
-    out_dir = OUTPUT_ROOT / cmpd.expression
-    out_path = out_dir / (hash_id + ".joblib")
-    invalid_path = out_dir / (hash_id + ".invalid")
-
-    if not out_path.exists() and not invalid_path.exists():
-        return (name, cmpd, adduct, charge, isotope, mass_type)
-    return None
-
-def generate_tasks(compounds, adducts, charge, isotopes, mass_type, max_threads=32):
-    tasks, futures = [], []
-    total_compounds = len(compounds)
-    total_possible = total_compounds * len(adducts) * (len(isotopes) + 1)
-    print(f"Scanning approximately {total_possible} configs...")
-
-    with ThreadPoolExecutor(max_workers=max_threads) as executor:
-        for name, cmpd in compounds.items():
-            for adduct in adducts:
-                for iso in isotopes:
-                    futures.append(executor.submit(check_and_prepare_task, name, cmpd, adduct, charge, iso, mass_type))
-                futures.append(executor.submit(check_and_prepare_task, name, cmpd, adduct, charge, None, mass_type))
-
-        total_scanned = len(futures)
-        for i, future in enumerate(as_completed(futures), 1):
-            result = future.result()
-            if result:
-                tasks.append(result)
-            if i % 1000 == 0 or i == total_scanned:
-                print(f"Checked {i}/{total_scanned} configs. New tasks: {len(tasks)}", end='\r')
-
-    already_existing = total_possible - len(tasks)
-    print(f"\nSummary for charge {charge}:")
-    print(f"  Total configs:         {total_possible}")
-    print(f"  Already cached:        {already_existing}")
-    print(f"  New to generate:       {len(tasks)}")
-
-    return tasks
+def print_worker_stats(stats, elapsed):
+    print("\nWorker throughput:")
+    print(f"  {'worker':>8} {'chunks':>8} {'compounds':>10} {'ions':>12} {'busy [s]':>9} {'ions/s':>10}")
+    for pid, (chunks, compounds, ions, busy) in sorted(stats.items()):
+        rate = ions / busy if busy else 0
+        print(f"  {pid:>8} {chunks:>8} {compounds:>10} {ions:>12} {busy:>9.1f} {rate:>10.0f}")
+    total = sum(item[2] for item in stats.values())
+    print(f"  Total: {total} ions in {elapsed:.1f} s ({total / elapsed if elapsed else 0:.0f} ions/s)")
+
+# ---------- Checkpoint journal ----------
+# The journal is a JSON-lines file next to the cache manifest. The first line
+# stores the run key and the planned jobs, every checkpoint appends the
+# compound ranges whose ions were committed to the cache since the previous
+# one. An interrupted run with the same key continues with the ranges left.
+
+def read_journal(path, run_key):
+    """Get jobs, finished ranges and last per-compound cost of an interrupted run."""
+    jobs, done, cost = None, [], None
+    if not path.exists():
+        return jobs, done, cost
+    with path.open('r', encoding='utf-8') as handle:
+        for line in handle:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # torn line of a killed run
+            if 'run' in entry:
+                if entry['run'] != run_key:
+                    return None, [], None
+                jobs = entry['jobs']
+            elif 'done' in entry:
+                done += [tuple(item) for item in entry['done']]
+                cost = entry.get('cost', cost)
+    return jobs, done, cost
+
+def write_journal(path, entry, start=False):
+    with path.open('w' if start else 'a', encoding='utf-8') as handle:
+        handle.write(json.dumps(entry) + "\n")
+        handle.flush()
+        os.fsync(handle.fileno())
+
+# ---------- Scheduling ----------
+class ChunkScheduler:
+    """Hands out compound ranges of jobs, sized by the measured per-compound cost.
+
+    Chunks are submitted a few at a time into the pool queue, so idle workers
+    always take the next chunk and none is bound to a fixed share of work.
+    """
+
+    def __init__(self, jobs, done, workers, cost=None):
+        self.workers = workers
+        self.cost = cost
+        self.size = CHUNK_SIZE
+        self.ranges = deque()
+        for job, item in enumerate(jobs):
+            finished = sorted((start, stop) for j, start, stop in done if j == job)
+            position = 0
+            for start, stop in finished + [(len(item['names']), len(item['names']))]:
+                if start > position:
+                    self.ranges.append((job, position, start))
+                position = max(position, stop)
+        self.remaining = sum(stop - start for job, start, stop in self.ranges)
+        if cost:
+            self.update(0, 0.)
+
+    def next(self):
+        if not self.ranges:
+            return None
+        job, start, stop = self.ranges[0]
+        # split the tail so the last chunks are spread over all workers
+        size = min(self.size, max(MIN_CHUNK_SIZE, self.remaining // (2 * self.workers)))
+        end = min(stop, start + size)
+        if end == stop:
+            self.ranges.popleft()
+        else:
+            self.ranges[0] = (job, end, stop)
+        self.remaining -= end - start
+        return job, start, end
+
+    def update(self, compounds, seconds):
+        if compounds:
+            cost = seconds / compounds
+            self.cost = cost if self.cost is None else 0.7 * self.cost + 0.3 * cost
+        if self.cost:
+            self.size = int(min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, TARGET_CHUNK_SECONDS / self.cost)))
 
 # ---------- Main ----------
 if __name__ == "__main__":
     print("Reading compounds from XML...")
-    compounds = get_all_compounds(COMPOUND_XML, args.group_name)
-    if not compounds:
+    library = get_all_compounds(COMPOUND_XML, args.group_name)
+    if not library:
         sys.exit(1)
 
     mass_type = MASS_TYPE
-    adducts = ADDUCTS
-    isotopes = ISOTOPES
+    isotopes = [''] + ISOTOPES  # C/N combinations are computed by the search panel on top of cached single labels
+    charges = [polarity * z for polarity in (+1, -1) for z in range(1, MAX_CHARGE + 1)]
+    store_adducts = ADDUCTS + ([RADICAL] if RADICALS else [])
     workers = get_safe_cpu_count(reserve=2)
     print(f"Using {workers} worker(s)\n")
 
-    for polarity in [+1, -1]:
-        charge = polarity
-        tasks = generate_tasks(compounds, adducts, charge, isotopes, mass_type)
-        total_tasks = len(tasks)
+    run_key = fingerprint(sorted(library.items()), mass_type, charges, store_adducts, isotopes)
+    cache = ionCache(OUTPUT_ROOT)
+
+    # resume interrupted run or diff library against the cache shards
+    jobs, done, cost = (None, [], None) if args.restart else read_journal(JOURNAL_PATH, run_key)
+    if jobs is None:
+        jobs = [{'names': names, 'adducts': adducts, 'isotopes': job_isotopes} for names, adducts, job_isotopes in cache.plan(library, mass_type, charges, store_adducts, isotopes)]
+        done = []
+        if jobs:
+            write_journal(JOURNAL_PATH, {'run': run_key, 'jobs': jobs}, start=True)
+    scheduler = ChunkScheduler(jobs, done, workers, cost)
+
+    print(f"Summary:")
+    print(f"  Total compounds:       {len(library)}")
+    print(f"  Cached shards:         {len(cache.shards)}")
+    print(f"  Already cached:        {len(library) - sum(len(job['names']) for job in jobs)}")
+    for job in jobs:
+        print(f"  To compute:            {len(job['names'])} compounds x {len(job['adducts'])} adducts x {len(job['isotopes'])} isotopes")
+    if done:
+        print(f"  Resumed:               {sum(stop - start for job, start, stop in done)} compounds finished by interrupted run")
+
+    if scheduler.remaining:
+        print(f"Generating ions of {scheduler.remaining} compounds...")
+        start = time()
+        total = scheduler.remaining
+        finished = 0
+        shards = 0
+        stats = {}
+        builders = {}
+        committed = []
+        last_checkpoint = time()
+        results = queue.Queue()
+
+        def checkpoint():
+            global shards, last_checkpoint
+            names = []
+            for builder in builders.values():
+                shard = cache.append(builder)
+                if shard is not None:
+                    names.append(shard.path.name)
+                    shard.close()
+            if committed:
+                write_journal(JOURNAL_PATH, {'done': committed, 'shards': names, 'cost': scheduler.cost})
+            shards += len(names)
+            builders.clear()
+            del committed[:]
+            last_checkpoint = time()
+
+        def submit(pool):
+            chunk = scheduler.next()
+            if chunk is None:
+                return False
+            job, first, last = chunk
+            adducts = [a for a in jobs[job]['adducts'] if a != RADICAL]
+            items = [(name, library[name]) for name in jobs[job]['names'][first:last]]
+            task = (chunk, items, charges, adducts, jobs[job]['isotopes'], mass_type, RADICAL in jobs[job]['adducts'])
+            pool.apply_async(generate_chunk_ions_task, (task,), callback=results.put, error_callback=results.put)
+            return True
+
+        # workers only compute, this process is the single writer of the cache
+        try:
+            with Pool(processes=workers) as pool:
+                pending = sum(submit(pool) for _ in range(2 * workers))
+                while pending:
+                    result = results.get()
+                    pending -= 1
+                    if isinstance(result, BaseException):
+                        raise result
+
+                    chunk, pid, busy, names, expressions, ions, formulas = result
+                    job = chunk[0]
+                    scheduler.update(len(names), busy)
+                    pending += submit(pool)
+
+                    builder = builders.get(job)
+                    if builder is None:
+                        builder = builders[job] = ionStoreBuilder(mass_type, charges, jobs[job]['adducts'], jobs[job]['isotopes'])
+                    ids = [builder.addCompound(name, expression) for name, expression in zip(names, expressions)]
+                    builder.addIons(numpy.asarray(ids, dtype=numpy.int64)[ions['compound']], ions['mz'], ions['charge'], ions['adduct'], ions['isotope'], formulas, ions['adducts'], ions['isotopes'])
+                    committed.append(chunk)
 
-        if total_tasks == 0:
-            print(f"No new tasks for charge {charge}")
-            continue
+                    item = stats.setdefault(pid, [0, 0, 0, 0.])
+                    item[0] += 1
+                    item[1] += len(names)
+                    item[2] += len(ions['mz'])
+                    item[3] += busy
+                    finished += len(names)
 
-        print(f"Generating {total_tasks} ion configs for charge {charge}...")
-        counter = Value('i', 0)
-        lock = Lock()
+                    if len(builder) >= SHARD_SIZE or time() - last_checkpoint >= CHECKPOINT_SECONDS:
+                        checkpoint()
+                    print(f"Progress: {finished}/{total} compounds, chunk size {scheduler.size}, {shards} shards written", end='\r')
 
-        def wrapped_generate(*args):
-            with lock:
-                counter.value += 1
-                print(f"Progress [{charge:+}]: {counter.value}/{total_tasks}", end='\r')
-            return generate_single_config_ions(*args)
+        except KeyboardInterrupt:
+            checkpoint()
+            cache.close()
+            print(f"\nInterrupted after {finished}/{total} compounds, re-run to resume.")
+            sys.exit(130)
 
-        with Pool(processes=workers) as pool:
-            pool.starmap(wrapped_generate, tasks)
+        checkpoint()
+        print(f"\nDone: {finished}/{total} compounds generated in {time() - start:.1f} s")
+        print_worker_stats(stats, time() - start)
 
-        print(f"\nDone: {counter.value}/{total_tasks} generated for charge {charge}")
+    if JOURNAL_PATH.exists():
+        JOURNAL_PATH.unlink()
 
+    cache.close()
     print("\nAll done! Ion cache stored in:", OUTPUT_ROOT)